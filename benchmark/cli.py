@@ -0,0 +1,220 @@
+import argparse
+import textwrap
+from utils.common_cli import float_between_0_and_1, non_negative_int
+
+
+def register_subcommand(add_parser):
+    help_text = (
+        'Time the stages of the search engine on synthetic ontologies, '
+        'datasets and dataset taggings of different sizes.'
+    )
+    description = textwrap.fill(
+        help_text + ' The synthetic data is kept in memory, so the database '
+        'is not used. WordNet must have been downloaded already (see the '
+        'nltk_data subcommand). Results are written as JSON. Multiple values '
+        'can be given for the size options, in which case every combination '
+        'is benchmarked.',
+        width=80
+    )
+    parser = add_parser(
+        'benchmark',
+        help=help_text,
+        description=description,
+    )
+
+    parser.add_argument(
+        '--depth',
+        help='Number of levels below the top concept of the synthetic '
+             'ontology. (Default: %(default)s)',
+        type=non_negative_int,
+        nargs='+',
+        default=[3],
+    )
+
+    parser.add_argument(
+        '--branching',
+        help='Number of narrower concepts of each concept in the synthetic '
+             'ontology. (Default: %(default)s)',
+        type=non_negative_int,
+        nargs='+',
+        default=[5],
+    )
+
+    parser.add_argument(
+        '--datasets',
+        help='Number of synthetic datasets. (Default: %(default)s)',
+        type=non_negative_int,
+        nargs='+',
+        default=[1000, 10000],
+    )
+
+    parser.add_argument(
+        '--density',
+        help='Average number of concepts each synthetic dataset is tagged '
+             'with. (Default: %(default)s)',
+        type=float,
+        nargs='+',
+        default=[2.0],
+    )
+
+    query_option = parser.add_mutually_exclusive_group()
+    query_option.add_argument(
+        '--queries',
+        help='File with one search query per line, to use as queries. By '
+             'default, queries are made up of random words from the '
+             'vocabulary used for the synthetic concept labels.',
+        type=argparse.FileType('r'),
+    )
+    query_option.add_argument(
+        '--num-queries',
+        help='Number of random queries to use when --queries is not given. '
+             '(Default: %(default)s, Type: non-negative integer)',
+        type=non_negative_int,
+        default=10,
+    )
+
+    parser.add_argument(
+        '--repeat',
+        '-r',
+        help='Number of times to time each operation. (Default: %(default)s)',
+        type=non_negative_int,
+        default=3,
+    )
+
+    parser.add_argument(
+        '--seed',
+        help='Seed for generating the synthetic data and queries. '
+             '(Default: %(default)s)',
+        type=int,
+        default=0,
+    )
+
+    parser.add_argument(
+        '--search-result-threshold',
+        '-t',
+        help='The lower threshold for how similar a dataset vector must be to '
+             'the query vector in order to be included in the results (Ts). '
+             '(Default: %(default)s, Type: float between 0.0 and 1.0)',
+        type=float_between_0_and_1,
+        default=0.75,
+        dest='t_s',
+        metavar='THRESHOLD',
+    )
+
+    parser.add_argument(
+        '--concept-relevance-threshold',
+        '-c',
+        help='The lower threshold of similarity between a dataset and '
+             'concepts, used to decide which concepts are relevant (Tc). '
+             '(Default: %(default)s, Type: float between 0.0 and 1.0)',
+        type=float_between_0_and_1,
+        default=0.0,
+        dest='t_c',
+        metavar='THRESHOLD',
+    )
+
+    parser.add_argument(
+        '--query-concept-threshold',
+        '-q',
+        help='The lower threshold for how similar a concept must be to the '
+             'search query in order to be picked to represent it. '
+             '(Default: %(default)s, Type: float between 0.0 and 1.0)',
+        type=float_between_0_and_1,
+        default=0.0,
+        dest='t_q',
+        metavar='THRESHOLD',
+    )
+
+    parser.add_argument(
+        '--wup-pairs',
+        help='Number of random WordNet noun pairs for which to check that '
+             'the vectorized Wu-Palmer similarity equals the one from NLTK. '
+             'Pairs which differ are reported, and make the command exit '
+             'with status 1. Use 0 to skip the check. (Default: %(default)s)',
+        type=non_negative_int,
+        default=1000,
+    )
+
+    parser.add_argument(
+        '--output',
+        '-o',
+        help='File to write the results to. (Default: standard output)',
+        type=argparse.FileType('w'),
+        default='-',
+    )
+
+    parser.add_argument(
+        '--baseline',
+        '-b',
+        help='Results from an earlier run to compare with. Benchmarks whose '
+             'median duration has increased by more than --tolerance are '
+             'reported, and make the command exit with status 1.',
+        type=argparse.FileType('r'),
+    )
+
+    parser.add_argument(
+        '--tolerance',
+        help='How much slower a benchmark may become before it is regarded as '
+             'a regression, with 0.2 meaning 20 %% slower. '
+             '(Default: %(default)s)',
+        type=float,
+        default=0.2,
+    )
+
+    parser.set_defaults(
+        func=do_benchmark,
+    )
+
+
+def do_benchmark(args):
+    import json
+    from sys import stderr
+    from benchmark import synthetic
+    from benchmark.run import get_scale_points, run_benchmarks, \
+        find_regressions
+
+    if args.queries is not None:
+        with args.queries as file:
+            queries = [line.strip() for line in file if line.strip()]
+    else:
+        queries = synthetic.generate_queries(args.num_queries, args.seed)
+
+    results = run_benchmarks(
+        get_scale_points(args.depth, args.branching, args.datasets,
+                         args.density),
+        queries,
+        args.repeat,
+        args.t_c,
+        args.t_q,
+        args.t_s,
+        args.seed,
+        args.wup_pairs,
+    )
+
+    with args.output as file:
+        json.dump(results, file, indent=2)
+        file.write('\n')
+
+    mismatches = results.get('wup_check', {}).get('mismatches', [])
+    for synset, other, similarity, expected in mismatches:
+        print(
+            f'Wu-Palmer similarity of {synset} and {other} is {similarity}, '
+            f'but NLTK gives {expected}',
+            file=stderr
+        )
+    status = 1 if mismatches else None
+
+    if args.baseline is not None:
+        with args.baseline as file:
+            baseline = json.load(file)
+        regressions = find_regressions(baseline, results, args.tolerance)
+        for point, name, before, after in regressions:
+            print(
+                f'Regression in {name} for {point}: median went from '
+                f'{before * 1000.0:.1f} ms to {after * 1000.0:.1f} ms',
+                file=stderr
+            )
+        if regressions:
+            status = 1
+
+    return status
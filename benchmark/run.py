@@ -0,0 +1,396 @@
+"""
+Module for timing the stages of the search engine on synthetic data.
+"""
+import itertools
+import math
+import platform
+import random
+import statistics
+import time
+from collections import namedtuple, OrderedDict
+from sys import stderr
+
+import nltk
+import numpy as np
+import pandas as pd
+import scipy
+
+from benchmark import synthetic
+from otd.constants import SIMTYPE_ALL, SIMTYPE_AUTOTAG, SIMTYPE_SIMILARITY
+from otd.opendatasemanticframework import OpenDataSemanticFramework
+from otd.synsethierarchy import SynsetHierarchy
+
+
+ScalePoint = namedtuple(
+    'ScalePoint',
+    ('depth', 'branching', 'datasets', 'density')
+)
+"""Size of the synthetic ontology, dataset graph and dataset taggings."""
+
+BENCHMARKS = (
+    'compute_ccs',
+    'compute_cds',
+    'score_vector',
+    'enrich_query_with_ccs',
+    'calculate_dataset_query_sim',
+    'search_query',
+)
+"""Names of the operations which are timed, in the order they are run."""
+
+
+def get_scale_points(depths, branchings, datasets, densities):
+    """
+    Combine the given sizes in every possible way.
+
+    Args:
+        depths: Depths of the ontology to use.
+        branchings: Number of narrower concepts per concept to use.
+        datasets: Number of datasets to use.
+        densities: Average number of concepts per dataset to use.
+
+    Returns:
+        List of ScalePoint.
+    """
+    return [
+        ScalePoint(*point)
+        for point in itertools.product(depths, branchings, datasets, densities)
+    ]
+
+
+def run_benchmarks(
+        scale_points,
+        queries,
+        repeat=3,
+        concept_similarity=0.0,
+        qc_sim_threshold=0.0,
+        score_threshold=0.75,
+        seed=0,
+        wup_pairs=0,
+):
+    """
+    Time the stages of the search engine for each scale point.
+
+    Nothing is read from or written to the database, since the synthetic
+    graphs and their matrices are kept in memory.
+
+    Args:
+        scale_points: List of ScalePoint to generate synthetic data for.
+        queries: Search queries to time the query stages with.
+        repeat: Number of times each operation is timed. For query stages,
+            each query is run this many times.
+        concept_similarity: Concept-dataset similarity threshold (Tc).
+        qc_sim_threshold: Query-concept similarity threshold (Tq).
+        score_threshold: Query-dataset similarity threshold (Ts).
+        seed: Seed used when generating synthetic data.
+        wup_pairs: Number of noun pairs to compare with NLTK using
+            check_wup_similarities(), or 0 to skip the check.
+
+    Returns:
+        Dictionary which can be serialized to JSON, describing the
+        environment, the parameters and the timings of each scale point.
+        If wup_pairs is not 0, the result of check_wup_similarities() is
+        included as well.
+    """
+    results = []
+    for point in scale_points:
+        print(f'Benchmarking {point}…', file=stderr)
+        results.append(run_benchmark(
+            point,
+            queries,
+            repeat,
+            concept_similarity,
+            qc_sim_threshold,
+            score_threshold,
+            seed,
+        ))
+
+    report = {
+        'environment': get_environment(),
+        'parameters': {
+            'queries': list(queries),
+            'repeat': repeat,
+            'concept_similarity': concept_similarity,
+            'qc_sim_threshold': qc_sim_threshold,
+            'score_threshold': score_threshold,
+            'seed': seed,
+            'wup_pairs': wup_pairs,
+        },
+        'results': results,
+    }
+    if wup_pairs:
+        print(f'Comparing {wup_pairs} noun pairs with NLTK…', file=stderr)
+        report['wup_check'] = check_wup_similarities(wup_pairs, seed)
+    return report
+
+
+def run_benchmark(
+        point,
+        queries,
+        repeat,
+        concept_similarity,
+        qc_sim_threshold,
+        score_threshold,
+        seed,
+):
+    """
+    Time the stages of the search engine for one scale point.
+
+    See run_benchmarks() for a description of the arguments.
+
+    Returns:
+        Dictionary with the scale point, the size of the generated data and
+        statistics for each benchmark in BENCHMARKS.
+    """
+    start = time.perf_counter()
+    # Label synsets are stored in MATRIX_DIR under the ontology's UUID, so
+    # ontologies with different labels must not share one
+    ontology = synthetic.InMemoryOntology(
+        f'synthetic-ontology-{point.depth}-{point.branching}-{seed}',
+        synthetic.generate_ontology(point.depth, point.branching, seed=seed)
+    )
+    dataset = synthetic.InMemoryDataset(
+        'synthetic-dataset',
+        synthetic.generate_datasets(point.datasets)
+    )
+    similarity = synthetic.InMemorySimilarity(
+        'synthetic-similarity',
+        synthetic.generate_tagging(
+            ontology.graph,
+            point.datasets,
+            point.density,
+            seed
+        )
+    )
+    autotag = synthetic.InMemoryAutotag(
+        'synthetic-autotag',
+        synthetic.generate_tagging(
+            ontology.graph,
+            point.datasets,
+            point.density,
+            seed + 1
+        )
+    )
+    generate_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    # The result cache would hide the cost of repeated queries
+    odsf = OpenDataSemanticFramework(
+        ontology,
+        dataset,
+        auto_compute=True,
+        concept_similarity=concept_similarity,
+        result_cache_size=0,
+    )
+    odsf.load_similarity_graph(SIMTYPE_SIMILARITY, similarity)
+    odsf.load_similarity_graph(SIMTYPE_AUTOTAG, autotag)
+    load_seconds = time.perf_counter() - start
+
+    durations = OrderedDict((name, []) for name in BENCHMARKS)
+
+    def measure(name, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        durations[name].append(time.perf_counter() - start)
+        return result
+
+    for _ in range(repeat):
+        measure('compute_ccs', odsf.compute_ccs)
+        measure(
+            'compute_cds',
+            odsf.compute_cds,
+            similarity.graph,
+            SIMTYPE_SIMILARITY,
+            concept_similarity
+        )
+
+    for _, query in itertools.product(range(repeat), queries):
+        # Time the stages of search_query() one by one, like it runs them
+        score_vec = measure(
+            'score_vector',
+            odsf._semscore.score_vector,
+            query,
+            qc_sim_threshold
+        )
+        query_concept_sim = measure(
+            'enrich_query_with_ccs',
+            odsf.enrich_query_with_ccs,
+            score_vec,
+            concept_similarity
+        )
+        measure(
+            'calculate_dataset_query_sim',
+            odsf.calculate_dataset_query_sim,
+            query_concept_sim,
+            SIMTYPE_ALL
+        )
+        measure(
+            'search_query',
+            lambda: odsf.search_query(
+                query,
+                SIMTYPE_ALL,
+                qc_sim_threshold=qc_sim_threshold,
+                score_threshold=score_threshold,
+            )
+        )
+
+    return {
+        'scale': point._asdict(),
+        'size': {
+            'concepts': len(odsf.concepts),
+            'datasets': len(odsf.cds[SIMTYPE_ALL]),
+            'similarities': int(odsf.cds[SIMTYPE_SIMILARITY].matrix.nnz),
+            'autotags': int(odsf.cds[SIMTYPE_AUTOTAG].matrix.nnz),
+            'array_bytes': odsf.nbytes,
+        },
+        'generate_seconds': generate_seconds,
+        'load_seconds': load_seconds,
+        'benchmarks': OrderedDict(
+            (name, summarize(seconds))
+            for name, seconds in durations.items()
+        ),
+    }
+
+
+def summarize(seconds):
+    """
+    Calculate statistics for the durations of an operation.
+
+    Args:
+        seconds: List of durations, in seconds.
+
+    Returns:
+        Dictionary with the number of runs and the minimum, median, mean,
+        95th percentile and maximum duration in seconds.
+    """
+    if not seconds:
+        return {'runs': 0}
+    return {
+        'runs': len(seconds),
+        'min': min(seconds),
+        'median': statistics.median(seconds),
+        'mean': statistics.mean(seconds),
+        'p95': float(np.percentile(seconds, 95)),
+        'max': max(seconds),
+    }
+
+
+def get_environment():
+    """
+    Describe the environment the benchmarks run in.
+
+    Returns:
+        Dictionary with the Python version, platform and library versions.
+    """
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'nltk': nltk.__version__,
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'scipy': scipy.__version__,
+    }
+
+
+def check_wup_similarities(num_pairs, seed=0):
+    """
+    Compare the Wu-Palmer similarities of SynsetHierarchy with NLTK's.
+
+    SynsetHierarchy copies how NLTK picks the least common subsumer and
+    decides whether to simulate a root, none of which is part of NLTK's
+    public API. This check should therefore pass before the NLTK version
+    pinned in requirements.txt is changed.
+
+    Random nouns are compiled into a SynsetHierarchy together with their
+    hypernyms, so that pairs where one synset subsumes the other are
+    compared too. Other random nouns are then compared with all of them.
+
+    Args:
+        num_pairs: Approximate number of noun pairs to compare.
+        seed: Seed used when picking the nouns.
+
+    Returns:
+        Dictionary with the number of pairs compared, the number of pairs
+        that could not be compared because can_compare() is False, and a
+        list of (synset, other synset, our similarity, NLTK's similarity)
+        for each pair where the similarities differ.
+    """
+    from nltk.corpus import wordnet as wn
+
+    random_state = random.Random(seed)
+    nouns = list(wn.all_synsets('n'))
+    # Each sampled noun brings a hypernym along, and the compiled synsets
+    # are compared with themselves as well, giving about 6 * sample_size ** 2
+    # pairs
+    sample_size = min(len(nouns), max(1, round(math.sqrt(num_pairs / 6))))
+
+    compiled = random_state.sample(nouns, sample_size)
+    compiled += [
+        hypernym
+        for synset in compiled
+        for hypernym in synset.hypernyms()[:1]
+    ]
+    # Also compare the compiled synsets with each other, so that the synset
+    # itself is among the candidate subsumers
+    synsets = random_state.sample(nouns, sample_size) + compiled
+
+    hierarchy = SynsetHierarchy(compiled)
+    others = [compiled[i] for i in hierarchy.compiled_ids]
+
+    pairs = 0
+    skipped = (len(compiled) - len(others)) * len(synsets)
+    mismatches = []
+    for synset in synsets:
+        if not hierarchy.can_compare(synset):
+            skipped += len(others)
+            continue
+        similarities = hierarchy.wup_similarities(synset)
+        for other, similarity in zip(others, similarities):
+            expected = synset.wup_similarity(other) or 0.0
+            pairs += 1
+            if not math.isclose(similarity, expected, abs_tol=1e-12):
+                mismatches.append(
+                    (synset.name(), other.name(), float(similarity), expected)
+                )
+
+    return {
+        'pairs': pairs,
+        'skipped': skipped,
+        'mismatches': mismatches,
+    }
+
+
+def find_regressions(baseline, current, tolerance=0.2):
+    """
+    Find benchmarks which have become slower than in an earlier run.
+
+    The median durations are compared for each scale point found in both
+    runs.
+
+    Args:
+        baseline: Dictionary returned by run_benchmarks() for the earlier run.
+        current: Dictionary returned by run_benchmarks() for this run.
+        tolerance: How much slower a benchmark may become before it is
+            regarded as a regression. 0.2 means 20 % slower.
+
+    Returns:
+        List of (scale point, benchmark name, baseline median, current median)
+        tuples, one for each regression.
+    """
+    baseline_by_scale = {
+        ScalePoint(**result['scale']): result['benchmarks']
+        for result in baseline['results']
+    }
+
+    regressions = []
+    for result in current['results']:
+        point = ScalePoint(**result['scale'])
+        if point not in baseline_by_scale:
+            continue
+        for name, stats in result['benchmarks'].items():
+            before = baseline_by_scale[point].get(name, {}).get('median')
+            after = stats.get('median')
+            if before is None or after is None:
+                continue
+            if after > before * (1.0 + tolerance):
+                regressions.append((point, name, before, after))
+    return regressions
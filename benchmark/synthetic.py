@@ -0,0 +1,248 @@
+"""
+Module for generating synthetic ontologies, datasets and dataset taggings.
+
+The generated graphs have the same structure as the real ones, so they can be
+given to OpenDataSemanticFramework. They are kept in memory instead of in the
+database, using the in-memory graph classes found here.
+"""
+import datetime
+import random
+
+from rdflib import URIRef, Literal, XSD
+
+import db.graph
+from utils.graph import create_bound_graph, RDF, SKOS, DCAT, DCT, OTD
+
+
+SYNTHETIC = 'http://example.org/synthetic/'
+"""Namespace used for the URIs of synthetic concepts and datasets."""
+
+VOCABULARY = (
+    'accident', 'address', 'agriculture', 'air', 'airport', 'animal',
+    'area', 'art', 'bank', 'beach', 'bicycle', 'birth', 'boat', 'border',
+    'bridge', 'budget', 'building', 'bus', 'business', 'camp', 'car',
+    'census', 'child', 'church', 'city', 'climate', 'coast', 'company',
+    'court', 'crime', 'crop', 'culture', 'death', 'disease', 'district',
+    'doctor', 'education', 'election', 'electricity', 'emergency',
+    'employment', 'energy', 'environment', 'event', 'export', 'factory',
+    'farm', 'ferry', 'festival', 'fire', 'fish', 'flood', 'food', 'forest',
+    'fuel', 'garden', 'gas', 'government', 'grant', 'harbour', 'health',
+    'highway', 'hospital', 'hotel', 'house', 'household', 'housing',
+    'import', 'income', 'industry', 'island', 'lake', 'land', 'library',
+    'licence', 'map', 'market', 'medicine', 'mountain', 'museum', 'noise',
+    'nurse', 'office', 'park', 'parking', 'patient', 'police', 'pollution',
+    'population', 'port', 'poverty', 'price', 'prison', 'property', 'rail',
+    'rain', 'recycling', 'restaurant', 'river', 'road', 'salary', 'school',
+    'sea', 'shop', 'snow', 'soil', 'sport', 'station', 'street', 'student',
+    'subway', 'tax', 'teacher', 'temperature', 'theatre', 'tourism',
+    'traffic', 'train', 'transport', 'tree', 'university', 'vehicle',
+    'voter', 'waste', 'water', 'weather', 'wind', 'worker',
+)
+"""Common nouns used to create concept labels and queries."""
+
+LAST_MODIFIED = datetime.datetime(2000, 1, 1)
+"""Modification time used for all synthetic graphs."""
+
+
+def generate_ontology(depth, branching, alt_label_ratio=0.3, seed=0):
+    """
+    Create a SKOS ontology with one top concept and a tree of concepts below.
+
+    Each concept is given an English preferred label of one or two words from
+    VOCABULARY, and possibly an alternative label.
+
+    Args:
+        depth: Number of levels below the top concept.
+        branching: Number of narrower concepts of each concept above the
+            lowest level.
+        alt_label_ratio: Share of the concepts which get an alternative label.
+        seed: Seed for the random choice of labels.
+
+    Returns:
+        RDF graph with the ontology. It has
+        1 + branching + branching ** 2 + ... + branching ** depth concepts.
+    """
+    rand = random.Random(seed)
+    graph = create_bound_graph()
+
+    scheme = URIRef(SYNTHETIC + 'scheme')
+    graph.add((scheme, RDF.type, SKOS.ConceptScheme))
+
+    def add_concept(number, parent):
+        concept = URIRef(f'{SYNTHETIC}concept/{number}')
+        graph.add((concept, RDF.type, SKOS.Concept))
+        graph.add((concept, SKOS.prefLabel, Literal(
+            _random_label(rand), lang='en'
+        )))
+        if rand.random() < alt_label_ratio:
+            graph.add((concept, SKOS.altLabel, Literal(
+                _random_label(rand), lang='en'
+            )))
+        if parent is None:
+            graph.add((concept, SKOS.topConceptOf, scheme))
+        else:
+            graph.add((concept, SKOS.broader, parent))
+            graph.add((parent, SKOS.narrower, concept))
+        return concept
+
+    level = [add_concept(0, None)]
+    number = 1
+    for _ in range(depth):
+        next_level = []
+        for parent in level:
+            for _ in range(branching):
+                next_level.append(add_concept(number, parent))
+                number += 1
+        level = next_level
+    return graph
+
+
+def _random_label(rand):
+    return ' '.join(rand.sample(VOCABULARY, rand.choice((1, 1, 2))))
+
+
+def generate_datasets(num_datasets):
+    """
+    Create a DCAT graph with datasets that have a title, description and
+    landing page.
+
+    Args:
+        num_datasets: Number of datasets to create.
+
+    Returns:
+        RDF graph with the datasets.
+    """
+    graph = create_bound_graph()
+    for number in range(num_datasets):
+        dataset = get_dataset_uri(number)
+        graph.add((dataset, RDF.type, DCAT.Dataset))
+        graph.add((dataset, DCT.title, Literal(f'Dataset {number}')))
+        graph.add((dataset, DCT.description, Literal(
+            f'Synthetic dataset number {number}.'
+        )))
+        graph.add((dataset, DCAT.landingPage, URIRef(
+            f'{SYNTHETIC}page/{number}'
+        )))
+    return graph
+
+
+def get_dataset_uri(number):
+    """
+    Find the URI of a dataset created by generate_datasets().
+
+    Args:
+        number: The number of the dataset, from 0 up to the number of datasets.
+
+    Returns:
+        URIRef of the dataset.
+    """
+    return URIRef(f'{SYNTHETIC}dataset/{number}')
+
+
+def generate_tagging(ontology_graph, num_datasets, density, seed=0):
+    """
+    Create a graph which tags datasets with random concepts.
+
+    Args:
+        ontology_graph: The ontology to pick concepts from.
+        num_datasets: Number of datasets created by generate_datasets().
+        density: Average number of concepts each dataset is tagged with.
+            Datasets are tagged with at least one concept.
+        seed: Seed for the random choice of concepts and scores.
+
+    Returns:
+        RDF graph with one otd:Similarity for each tag.
+    """
+    rand = random.Random(seed)
+    concepts = sorted(ontology_graph.subjects(RDF.type, SKOS.Concept))
+    graph = create_bound_graph()
+    number = 0
+    for dataset_number in range(num_datasets):
+        dataset = get_dataset_uri(dataset_number)
+        num_tags = max(1, round(rand.expovariate(1.0 / density)))
+        for concept in rand.sample(concepts, min(num_tags, len(concepts))):
+            similarity = URIRef(f'{SYNTHETIC}similarity/{seed}/{number}')
+            number += 1
+            graph.add((similarity, RDF.type, OTD.Similarity))
+            graph.add((similarity, OTD.dataset, dataset))
+            graph.add((similarity, OTD.concept, concept))
+            graph.add((similarity, OTD.score, Literal(
+                round(rand.uniform(0.5, 1.0), 3),
+                datatype=XSD.double
+            )))
+    return graph
+
+
+def generate_queries(num_queries, seed=0):
+    """
+    Create search queries of one to three words from VOCABULARY.
+
+    Args:
+        num_queries: Number of queries to create.
+        seed: Seed for the random choice of words.
+
+    Returns:
+        List of queries.
+    """
+    rand = random.Random(seed)
+    return [
+        ' '.join(rand.sample(VOCABULARY, rand.randint(1, 3)))
+        for _ in range(num_queries)
+    ]
+
+
+class InMemoryOntology(db.graph.Ontology):
+    """
+    Ontology whose concept-concept similarity matrix is kept in memory
+    instead of being stored in the database.
+    """
+    def __init__(self, uuid, graph):
+        super().__init__(uuid, graph, LAST_MODIFIED)
+        self.__dataframe = None
+
+    def get_dataframe(self, **kwargs):
+        return self.__dataframe
+
+    def save_dataframe(self, df, **kwargs):
+        self.__dataframe = df
+
+
+class InMemoryDataset(db.graph.Dataset):
+    """
+    Dataset graph which is not stored in the database.
+    """
+    def __init__(self, uuid, graph):
+        super().__init__(uuid, graph, LAST_MODIFIED)
+
+
+class InMemorySimilarity(db.graph.Similarity):
+    """
+    Similarity graph whose concept-dataset similarity matrices are kept in
+    memory instead of being stored in the database.
+    """
+    def __init__(self, uuid, graph, dataset=None, ontology=None):
+        super().__init__(uuid, graph, LAST_MODIFIED, None, dataset, ontology)
+        self.__dataframes = dict()
+
+    def get_dataframe(self, concept_similarity, **kwargs):
+        return self.__dataframes.get(concept_similarity)
+
+    def save_dataframe(self, df, concept_similarity, **kwargs):
+        self.__dataframes[concept_similarity] = df
+
+
+class InMemoryAutotag(db.graph.Autotag):
+    """
+    Autotag graph whose concept-dataset similarity matrices are kept in memory
+    instead of being stored in the database.
+    """
+    def __init__(self, uuid, graph, dataset=None, ontology=None):
+        super().__init__(uuid, graph, LAST_MODIFIED, None, dataset, ontology)
+        self.__dataframes = dict()
+
+    def get_dataframe(self, concept_similarity, **kwargs):
+        return self.__dataframes.get(concept_similarity)
+
+    def save_dataframe(self, df, concept_similarity, **kwargs):
+        self.__dataframes[concept_similarity] = df
+
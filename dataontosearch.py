@@ -32,6 +32,7 @@ PACKAGES_WITH_CLI = (
     'similarity',
     'autotag',
     'configuration',
+    'benchmark',
 )
 # Name of modules that should also be used to create subcommands, but which
 # aren't called cli
@@ -1,58 +1,118 @@
-import json
-from rdflib import URIRef
-import pandas as pd
-from utils.db import MongoDBConnection
+from db import matrixfile
+from db import storage
 
 
 def store(df, graph_identifier, **kwargs):
-    with MongoDBConnection(**kwargs) as client:
-        db = client.ontodb
-        j = df.to_json(orient='split')
-        doc = {
-            'df': j,
-            'graphType': graph_identifier.graph_type,
-            'graphUuid': graph_identifier.graph_uuid,
-            'lastModified': graph_identifier.last_modified,
-            'otherParameters': graph_identifier.other_parameters,
-        }
-        existing_id = _get_uuid_for_outdated(graph_identifier, **kwargs)
-        is_update = existing_id is not None
-        if is_update:
-            db.dataframe.replace_one(
-                {'_id': existing_id},
-                doc,
-            )
-            return str(existing_id)
-        else:
-            return str(db.dataframe.insert_one(doc).inserted_id)
+    """
+    Store the matrix made for the given graph version.
+
+    Args:
+        df: SparseMatrix or DataFrame to store.
+        graph_identifier: DataFrameId of the graph version the matrix was made
+            for.
+        kwargs: Arguments for the storage backend.
+
+    Returns:
+        Identifier of the stored matrix.
+    """
+    backend = storage.get_backend()
+    if matrixfile.is_enabled() and not backend.is_local:
+        matrixfile.save_matrix(_get_file_name(graph_identifier), df)
+
+    return backend.store_matrix(df, graph_identifier, **kwargs)
 
 
 def get(graph_identifier, **kwargs):
-    with MongoDBConnection(**kwargs) as client:
-        db = client.ontodb
-        doc = db.dataframe.find_one({
-            'graphType': graph_identifier.graph_type,
-            'graphUuid': graph_identifier.graph_uuid,
-            'lastModified': graph_identifier.last_modified,
-            'otherParameters': graph_identifier.other_parameters,
-        })
-        if doc is None:
-            return None
-        js = json.loads(doc['df'])
-    js['columns'] = list(map(lambda x: URIRef(x), js['columns']))
-    js['index'] = list(map(lambda x: URIRef(x), js['index']))
-    df = pd.DataFrame(data=js['data'], index=js['index'], columns=js['columns'])
-    return df
-
-
-def _get_uuid_for_outdated(graph_identifier, **kwargs):
-    with MongoDBConnection(**kwargs) as client:
-        db = client.ontodb
-        doc = db.dataframe.find_one({
-            'graphType': graph_identifier.graph_type,
-            'graphUuid': graph_identifier.graph_uuid,
-            'otherParameters': graph_identifier.other_parameters,
-        })
-        if doc is None:
+    """
+    Retrieve the matrix stored for the given graph version.
+
+    When matrix files are in use (see db.matrixfile), the matrix is read from
+    the local file if present. Otherwise, it is retrieved from the storage
+    backend and written to a local file, which is then opened with memory
+    mapping. This is skipped when the storage backend itself is local.
+
+    Args:
+        graph_identifier: DataFrameId of the graph version the matrix was made
+            for.
+        kwargs: Arguments for the storage backend.
+
+    Returns:
+        SparseMatrix or DataFrame with the stored matrix, or None if no matrix
+        is stored for this graph version.
+    """
+    backend = storage.get_backend()
+    if not matrixfile.is_enabled() or backend.is_local:
+        return backend.get_matrix(graph_identifier, **kwargs)
+
+    return matrixfile.load_or_create_matrix(
+        _get_file_name(graph_identifier),
+        lambda: backend.get_matrix(graph_identifier, **kwargs)
+    )
+
+
+def store_arrays(arrays, labels, graph_identifier, **kwargs):
+    """
+    Store the arrays made for the given graph version.
+
+    Args:
+        arrays: Dictionary with the NumPy arrays to store.
+        labels: Dictionary with additional information to store alongside the
+            arrays, which must be serializable to JSON.
+        graph_identifier: DataFrameId of the graph version the arrays were
+            made for.
+        kwargs: Arguments for the storage backend.
+
+    Returns:
+        Identifier of the stored arrays.
+    """
+    backend = storage.get_backend()
+    if matrixfile.is_enabled() and not backend.is_local:
+        matrixfile.save_arrays(
+            _get_file_name(graph_identifier),
+            arrays,
+            labels
+        )
+
+    return backend.store_arrays(arrays, labels, graph_identifier, **kwargs)
+
+
+def get_arrays(graph_identifier, **kwargs):
+    """
+    Retrieve the arrays stored for the given graph version.
+
+    Like with get(), local files are used when matrix files are in use.
+
+    Args:
+        graph_identifier: DataFrameId of the graph version the arrays were
+            made for.
+        kwargs: Arguments for the storage backend.
+
+    Returns:
+        Tuple with the dictionary of NumPy arrays and the dictionary of labels
+        given to store_arrays(), or None if no arrays are stored for this
+        graph version.
+    """
+    backend = storage.get_backend()
+    if not matrixfile.is_enabled() or backend.is_local:
+        return backend.get_arrays(graph_identifier, **kwargs)
+
+    name = _get_file_name(graph_identifier)
+    stored = matrixfile.load_arrays(name)
+    if stored is None:
+        stored = backend.get_arrays(graph_identifier, **kwargs)
+        if stored is None:
             return None
-        return doc['_id']
+        matrixfile.save_arrays(name, *stored)
+        # Fall back to the arrays in memory, should the file be removed
+        # before we open it
+        stored = matrixfile.load_arrays(name) or stored
+    return stored
+
+
+def _get_file_name(graph_identifier):
+    return matrixfile.get_name(
+        graph_identifier.graph_type,
+        graph_identifier.graph_uuid,
+        graph_identifier.other_parameters,
+        version=graph_identifier.last_modified,
+    )
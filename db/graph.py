@@ -4,10 +4,8 @@ import warnings
 from abc import ABCMeta, abstractmethod
 from collections import namedtuple
 
-from bson.objectid import ObjectId
-
 import db.dataframe
-from utils.db import MongoDBConnection
+from db import storage
 from utils.dotenv import ensure_loaded_dotenv
 from utils.graph import create_bound_graph, RDF, SKOS
 from utils.misc import first, second
@@ -47,6 +45,9 @@ class NoSuchGraph(Exception):
 class DbCollection(metaclass=ABCMeta):
     """
     Generic class for any MongoDB collection in DataOntoSearch.
+
+    The documents are stored using the storage backend returned by
+    db.storage.get_backend(), which is MongoDB unless configured otherwise.
     """
     def __init__(self, uuid=None):
         """
@@ -82,7 +83,7 @@ class DbCollection(metaclass=ABCMeta):
                 variable named <COLLECTION_NAME>_UUID will be used. If that one
                 does not exist, a MissingUuidWarning will be emitted and the
                 first instance returned from the database is used.
-            **kwargs: Extra keyword arguments to give to MongoDBConnection.
+            **kwargs: Extra keyword arguments to give to the storage backend.
 
         Returns:
             An instance of this class, filled with information from the
@@ -99,21 +100,17 @@ class DbCollection(metaclass=ABCMeta):
         collection_name = cls.get_collection_name()
         uuid = cls.find_uuid(uuid)
 
-        criteria = None
-        if uuid is not None:
-            criteria = {'_id': ObjectId(uuid)}
-
-        with MongoDBConnection(**kwargs) as client:
-            db = client.ontodb
-            collection = getattr(db, collection_name)
-
-            document = collection.find_one(criteria)
+        document = storage.get_backend().find_one(
+            collection_name,
+            uuid,
+            **kwargs
+        )
 
-            if document is None:
-                raise ValueError(
-                    'No {} found with the UUID "{}"'
-                        .format(collection_name, uuid)
-                )
+        if document is None:
+            raise ValueError(
+                'No {} found with the UUID "{}"'
+                    .format(collection_name, uuid)
+            )
         return cls.from_document(document)
 
     @classmethod
@@ -194,7 +191,7 @@ class DbCollection(metaclass=ABCMeta):
         Args:
             uuid: Potentially a UUID, in which case it will be used as-is and
                 not checked for validity.
-            **kwargs: Extra keyword arguments to give to MongoDBConnection.
+            **kwargs: Extra keyword arguments to give to the storage backend.
 
         Returns:
             The UUID of the document that would have been returned when calling
@@ -216,7 +213,7 @@ class DbCollection(metaclass=ABCMeta):
             collection_name: Name of the MongoDB collection to find a UUID for.
             uuid: Potentially a UUID, in which case it will be used as-is and
                 not checked for validity.
-            **kwargs: Extra keyword arguments to give to MongoDBConnection.
+            **kwargs: Extra keyword arguments to give to the storage backend.
 
         Returns:
             The UUID of the document that would have been returned when fetching
@@ -227,13 +224,7 @@ class DbCollection(metaclass=ABCMeta):
             return uuid
 
         # We're using whatever MongoDB returns first, so find that
-        with MongoDBConnection(**kwargs) as client:
-            db = client.ontodb
-            collection = getattr(db, collection_name)
-            first_document = collection.find_one({})
-            if first_document is None:
-                return None
-            return str(first_document['_id'])
+        return storage.get_backend().find_first_uuid(collection_name, **kwargs)
 
     def prepare(self):
         """
@@ -255,7 +246,7 @@ class DbCollection(metaclass=ABCMeta):
         will be associated with this object and returned.
 
         Args:
-            **kwargs: Extra keyword arguments to give to MongoDBConnection.
+            **kwargs: Extra keyword arguments to give to the storage backend.
 
         Returns:
             The UUID of the saved object.
@@ -274,25 +265,23 @@ class DbCollection(metaclass=ABCMeta):
         Save this object to the database collection as a new document.
         """
         document = self._get_as_document()
-        with MongoDBConnection(**kwargs) as client:
-            db = client.ontodb
-            collection = getattr(db, self.get_collection_name())
-            assigned_id = collection.insert_one(document).inserted_id
-        return str(assigned_id)
+        return storage.get_backend().insert(
+            self.get_collection_name(),
+            document,
+            **kwargs
+        )
 
     def _save_with_uuid(self, uuid, **kwargs):
         """
         Save this object to the database collection using the given UUID.
         """
         document = self._get_as_document()
-        with MongoDBConnection(**kwargs) as client:
-            db = client.ontodb
-            collection = getattr(db, self.get_collection_name())
-            collection.replace_one(
-                {'_id': ObjectId(uuid)},
-                document,
-                upsert=True,
-            )
+        storage.get_backend().replace(
+            self.get_collection_name(),
+            uuid,
+            document,
+            **kwargs
+        )
         return uuid
 
     def remove(self, **kwargs):
@@ -300,7 +289,7 @@ class DbCollection(metaclass=ABCMeta):
         Remove this object from the database.
 
         Args:
-            **kwargs: Extra keyword arguments to give to MongoDBConnection.
+            **kwargs: Extra keyword arguments to give to the storage backend.
 
         Returns:
             True if an object was removed, False if not.
@@ -321,17 +310,16 @@ class DbCollection(metaclass=ABCMeta):
 
         Args:
             uuid: The UUID of the document to remove from the database.
-            **kwargs: Extra keyword arguments to give to MongoDBConnection.
+            **kwargs: Extra keyword arguments to give to the storage backend.
 
         Returns:
             True if a document was actually removed, False if not.
         """
-        with MongoDBConnection(**kwargs) as client:
-            db = client.ontodb
-            collection = getattr(db, cls.get_collection_name())
-            r = collection.delete_one({'_id': ObjectId(uuid)})
-            num_deleted = r.deleted_count
-        return num_deleted > 0
+        return storage.get_backend().remove(
+            cls.get_collection_name(),
+            uuid,
+            **kwargs
+        )
 
     @classmethod
     def find_all_ids(cls, **kwargs):
@@ -339,16 +327,15 @@ class DbCollection(metaclass=ABCMeta):
         Return the UUIDs of all documents in the database collection.
 
         Args:
-            **kwargs: Extra keyword arguments to give to MongoDBConnection.
+            **kwargs: Extra keyword arguments to give to the storage backend.
 
         Returns:
             List of UUIDs, one for each document in the database collection.
         """
-        with MongoDBConnection(**kwargs) as client:
-            db = client.ontodb
-            collection = getattr(db, cls.get_collection_name())
-            ids = [str(i) for i in collection.distinct('_id')]
-        return ids
+        return storage.get_backend().find_all_ids(
+            cls.get_collection_name(),
+            **kwargs
+        )
 
     @abstractmethod
     def _get_as_document(self):
@@ -672,6 +659,49 @@ class Ontology(Graph):
             tuple(),
         )
 
+    def get_label_synsets(self, wordnet_version, **kwargs):
+        """
+        Retrieve the WordNet synsets stored for the concept labels of this
+        version of the ontology.
+
+        Args:
+            wordnet_version: Version of WordNet the synsets were found in.
+            kwargs: Arguments for the storage backend.
+
+        Returns:
+            Tuple with the arrays and labels given to save_label_synsets(), or
+            None if none are stored.
+        """
+        identifier = self._get_label_synsets_id(wordnet_version)
+        return db.dataframe.get_arrays(identifier, **kwargs)
+
+    def save_label_synsets(self, arrays, labels, wordnet_version, **kwargs):
+        """
+        Store the WordNet synsets found for the concept labels of this version
+        of the ontology, next to the concept-concept similarity matrix.
+
+        Args:
+            arrays: Dictionary of arrays, as returned by
+                SemScore.get_label_arrays().
+            labels: Dictionary of labels, as returned by
+                SemScore.get_label_arrays().
+            wordnet_version: Version of WordNet the synsets were found in.
+            kwargs: Arguments for the storage backend.
+
+        Returns:
+            Identifier of the stored synsets.
+        """
+        identifier = self._get_label_synsets_id(wordnet_version)
+        return db.dataframe.store_arrays(arrays, labels, identifier, **kwargs)
+
+    def _get_label_synsets_id(self, wordnet_version):
+        return DataFrameId(
+            self.get_collection_name(),
+            self.uuid,
+            self.last_modified,
+            ('label_synsets', wordnet_version),
+        )
+
 
 class Dataset(Graph):
     """
@@ -1,7 +1,5 @@
-from utils.db import MongoDBConnection
+from db import storage
 
 
 def store(json, **kwargs):
-    with MongoDBConnection(**kwargs) as client:
-        db = client.ontodb
-        db.log.insert_one(json)
+    storage.get_backend().insert('log', json, **kwargs)
@@ -0,0 +1,314 @@
+"""
+Module for storing matrices as files on the local disk.
+
+Each matrix is stored in its own directory, with one NumPy .npy file for each
+array and a labels.json sidecar with additional information. The URIs of the
+rows and columns of sparse matrices are stored as the arrays of a StringTable,
+while those of dense matrices are stored in the sidecar. The arrays are opened
+using memory mapping, so processes that open the same matrix
+share one copy of it through the operating system's page cache, instead of
+each process holding its own copy. This is used by the webserver, where every
+worker would otherwise load all matrices into its own memory.
+
+The files are only used when the MATRIX_DIR environment variable names the
+directory to store them in. Files are never modified once written, and are
+named after the graph version they were made for, so the directory can be
+emptied at any time to reclaim space. Once arrays are stored for a new
+version, the arrays stored for earlier versions of the same graph are removed.
+Processes which have them memory mapped can keep using them until they close.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+from rdflib import URIRef
+
+from utils.dotenv import ensure_loaded_dotenv
+from utils.sparse import SparseMatrix
+from utils.stringtable import StringTable
+
+
+FORMAT_DENSE = 'dense'
+FORMAT_SPARSE = 'csr'
+
+_LABELS_FILE = 'labels.json'
+_ARRAY_SUFFIX = '.npy'
+_VERSION_SEPARATOR = '-'
+
+
+def get_directory():
+    """
+    Find the directory matrix files are stored in.
+
+    Returns:
+        The directory named in the MATRIX_DIR environment variable, or None if
+        matrix files are not in use.
+    """
+    ensure_loaded_dotenv()
+    return os.environ.get('MATRIX_DIR') or None
+
+
+def is_enabled():
+    """
+    Check whether matrix files are in use.
+
+    Returns:
+        True if MATRIX_DIR is set, False otherwise.
+    """
+    return get_directory() is not None
+
+
+def get_name(*parts, version=None):
+    """
+    Create a file name identifying a matrix.
+
+    Args:
+        parts: Values which together identify the matrix, like the type and
+            UUID of the graph it was made from. Their repr() is used, so they
+            must have a stable one.
+        version: Value identifying the version of the matrix, like the last
+            modification time of the graph it was made from. When arrays are
+            stored under a name with a version, the arrays stored under the
+            same parts with any other version are removed. Its repr() is used
+            as well.
+
+    Returns:
+        Name which can be given to the other functions in this module.
+    """
+    name = _hash_repr(parts)
+    if version is None:
+        return name
+    return name + _VERSION_SEPARATOR + _hash_repr(version)
+
+
+def _hash_repr(value):
+    return hashlib.sha1(repr(value).encode('utf-8')).hexdigest()
+
+
+def save_arrays(name, arrays, labels=None, directory=None):
+    """
+    Store the given arrays under the given name, unless already stored.
+
+    The arrays are first written to a temporary directory which is then
+    renamed, so that other processes never see partially written files.
+    Arrays stored for other versions of the same matrix are then removed, see
+    get_name().
+
+    Args:
+        name: Name to store the arrays under, created by get_name().
+        arrays: Dictionary with the NumPy arrays to store, using names which
+            can be used in file names as keys.
+        labels: Optional dictionary with additional information to store
+            alongside the arrays, which must be serializable to JSON.
+        directory: Directory to store the arrays in. Defaults to the one
+            returned by get_directory().
+    """
+    directory = directory or get_directory()
+    target = os.path.join(directory, name)
+    if os.path.isdir(target):
+        return
+
+    os.makedirs(directory, exist_ok=True)
+    temporary = tempfile.mkdtemp(prefix=f'.{name}-', dir=directory)
+    try:
+        for key, array in arrays.items():
+            np.save(
+                os.path.join(temporary, key + _ARRAY_SUFFIX),
+                np.asarray(array)
+            )
+        with open(os.path.join(temporary, _LABELS_FILE), 'w') as fp:
+            json.dump(labels or dict(), fp)
+        os.rename(temporary, target)
+    except OSError:
+        shutil.rmtree(temporary, ignore_errors=True)
+        # Another process may have stored the same arrays in the meantime
+        if not os.path.isdir(target):
+            raise
+        return
+
+    _remove_other_versions(name, directory)
+
+
+def _remove_other_versions(name, directory):
+    if _VERSION_SEPARATOR not in name:
+        return
+    prefix = name.split(_VERSION_SEPARATOR)[0] + _VERSION_SEPARATOR
+    for other in os.listdir(directory):
+        if other.startswith(prefix) and other != name:
+            shutil.rmtree(os.path.join(directory, other), ignore_errors=True)
+
+
+def load_arrays(name, directory=None):
+    """
+    Open the arrays stored under the given name.
+
+    Args:
+        name: Name the arrays were stored under.
+        directory: Directory the arrays were stored in. Defaults to the one
+            returned by get_directory().
+
+    Returns:
+        Tuple with a dictionary of read-only, memory mapped arrays and the
+        dictionary of labels given to save_arrays(). None is returned if
+        nothing is stored under this name, or matrix files are not in use.
+    """
+    directory = directory or get_directory()
+    if directory is None:
+        return None
+    source = os.path.join(directory, name)
+    if not os.path.isdir(source):
+        return None
+
+    arrays = dict()
+    try:
+        for filename in os.listdir(source):
+            if filename.endswith(_ARRAY_SUFFIX):
+                key = filename[:-len(_ARRAY_SUFFIX)]
+                arrays[key] = np.load(
+                    os.path.join(source, filename),
+                    mmap_mode='r'
+                )
+        with open(os.path.join(source, _LABELS_FILE)) as fp:
+            labels = json.load(fp)
+    except FileNotFoundError:
+        # Removed while we were opening it, since arrays for another version
+        # were stored
+        return None
+    return arrays, labels
+
+
+def load_or_create_arrays(name, create):
+    """
+    Open the arrays stored under the given name, creating them if missing.
+
+    Args:
+        name: Name the arrays are stored under.
+        create: Function which takes no arguments and returns a dictionary of
+            arrays to store, called only if no arrays are stored yet.
+
+    Returns:
+        Dictionary of read-only, memory mapped arrays. If the stored arrays
+        are removed before they can be opened, the arrays returned by create
+        are used instead.
+    """
+    result = load_arrays(name)
+    if result is None:
+        arrays = create()
+        save_arrays(name, arrays)
+        result = load_arrays(name)
+        if result is None:
+            return arrays
+    arrays, _ = result
+    return arrays
+
+
+def save_matrix(name, matrix, directory=None):
+    """
+    Store a matrix with its row and column labels.
+
+    Args:
+        name: Name to store the matrix under, created by get_name().
+        matrix: SparseMatrix or DataFrame to store. The labels are stored as
+            strings. Those of a DataFrame are loaded as URIRefs.
+        directory: Directory to store the matrix in. Defaults to the one
+            returned by get_directory().
+    """
+    if isinstance(matrix, SparseMatrix):
+        csr = matrix.matrix
+        csr.sort_indices()
+        arrays = {
+            'data': csr.data,
+            'indices': csr.indices,
+            'indptr': csr.indptr,
+        }
+        for key, table in (('index', matrix.index),
+                           ('columns', matrix.columns)):
+            for part, array in table.get_arrays().items():
+                arrays[f'{key}_{part}'] = array
+        labels = {'format': FORMAT_SPARSE}
+    else:
+        arrays = {'values': matrix.values.astype(float)}
+        labels = {
+            'format': FORMAT_DENSE,
+            'index': [str(i) for i in matrix.index],
+            'columns': [str(c) for c in matrix.columns],
+        }
+
+    save_arrays(name, arrays, labels, directory)
+
+
+def load_matrix(name, directory=None):
+    """
+    Open a matrix stored by save_matrix().
+
+    Args:
+        name: Name the matrix was stored under.
+        directory: Directory the matrix was stored in. Defaults to the one
+            returned by get_directory().
+
+    Returns:
+        SparseMatrix or DataFrame (same type as was stored) backed by read-only,
+        memory mapped arrays, or None if no matrix is stored under this name.
+        The labels of a SparseMatrix are memory mapped as well.
+    """
+    result = load_arrays(name, directory)
+    if result is None:
+        return None
+    arrays, labels = result
+
+    if labels['format'] == FORMAT_SPARSE:
+        return SparseMatrix.from_arrays(
+            arrays['data'],
+            arrays['indices'],
+            arrays['indptr'],
+            _load_string_table(arrays, labels, 'index'),
+            _load_string_table(arrays, labels, 'columns'),
+        )
+    return pd.DataFrame(
+        arrays['values'],
+        index=[URIRef(i) for i in labels['index']],
+        columns=[URIRef(c) for c in labels['columns']],
+    )
+
+
+def load_or_create_matrix(name, create):
+    """
+    Open the matrix stored under the given name, creating it if missing.
+
+    Args:
+        name: Name the matrix is stored under.
+        create: Function which takes no arguments and returns the SparseMatrix
+            or DataFrame to store, called only if no matrix is stored yet. It
+            may return None when there is no matrix to store.
+
+    Returns:
+        Memory mapped matrix like load_matrix() returns, or None if create
+        returned None. If the stored matrix is removed before it can be
+        opened, the matrix returned by create is used instead.
+    """
+    matrix = load_matrix(name)
+    if matrix is None:
+        matrix = create()
+        if matrix is None:
+            return None
+        save_matrix(name, matrix)
+        stored = load_matrix(name)
+        if stored is not None:
+            matrix = stored
+    return matrix
+
+
+def _load_string_table(arrays, labels, key):
+    if key in labels:
+        # Stored before the labels of sparse matrices were kept as arrays
+        return StringTable(labels[key])
+    prefix = key + '_'
+    return StringTable.from_arrays({
+        name[len(prefix):]: array
+        for name, array in arrays.items()
+        if name.startswith(prefix)
+    })
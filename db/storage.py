@@ -0,0 +1,577 @@
+"""
+Module with the backends used to store graphs, configurations and matrices.
+
+By default, everything is stored in MongoDB. Set the STORAGE_BACKEND
+environment variable to local to store everything as files in the directory
+named by STORAGE_DIR instead, which needs no database server at all.
+
+The local directory has one subdirectory for each collection. Each document is
+stored as a JSON file named after its UUID, with binary fields like the RDF
+graph stored in separate files next to it. Matrices, and other arrays made
+from graphs, are stored under the dataframe subdirectory using the format of
+db.matrixfile, so they are memory mapped when loaded.
+"""
+import datetime
+import json
+import os
+import shutil
+import tempfile
+from abc import ABCMeta, abstractmethod
+
+from bson.objectid import ObjectId
+from rdflib import URIRef
+import numpy as np
+import pandas as pd
+
+from db import matrixfile
+from utils.db import MongoDBConnection
+from utils.dotenv import ensure_loaded_dotenv
+from utils.sparse import SparseMatrix
+
+
+BACKEND_MONGODB = 'mongodb'
+BACKEND_LOCAL = 'local'
+backends = (BACKEND_MONGODB, BACKEND_LOCAL)
+
+
+def get_backend():
+    """
+    Create the storage backend chosen by the environment variables.
+
+    Returns:
+        Instance of StorageBackend.
+
+    Raises:
+        ValueError: If STORAGE_BACKEND names an unknown backend, or
+            STORAGE_DIR is missing for the local backend.
+    """
+    ensure_loaded_dotenv()
+    name = os.environ.get('STORAGE_BACKEND') or BACKEND_MONGODB
+
+    if name == BACKEND_MONGODB:
+        return MongoDBStorage()
+    elif name == BACKEND_LOCAL:
+        directory = os.environ.get('STORAGE_DIR')
+        if not directory:
+            raise ValueError(
+                'STORAGE_DIR must name a directory when using the local '
+                'storage backend'
+            )
+        return LocalStorage(directory)
+    else:
+        raise ValueError(
+            f'Unrecognized storage backend {name!r}, please use one of '
+            f'{backends}'
+        )
+
+
+class StorageBackend(metaclass=ABCMeta):
+    """
+    Place where documents (like graphs and configurations) and matrices are
+    stored.
+
+    Documents are dictionaries, which are stored in named collections and
+    identified by a UUID. The UUID is found under the _id key of retrieved
+    documents. All methods accept extra keyword arguments, which are used by
+    MongoDBStorage to connect to the database and ignored by other backends.
+    """
+
+    is_local = False
+    """
+    Whether everything is stored on the local disk, in which case there is no
+    need to keep copies of matrices in MATRIX_DIR.
+    """
+
+    @abstractmethod
+    def find_one(self, collection_name, uuid=None, **kwargs):
+        """
+        Retrieve a document.
+
+        Args:
+            collection_name: Name of the collection to look in.
+            uuid: UUID of the document to retrieve. When None, the first
+                document in the collection is retrieved.
+
+        Returns:
+            The document, or None if it could not be found.
+
+        Raises:
+            bson.errors.InvalidId: If the UUID is not a valid UUID.
+        """
+        return None
+
+    def find_first_uuid(self, collection_name, **kwargs):
+        """
+        Find the UUID of the document find_one() returns when no UUID is given.
+
+        Args:
+            collection_name: Name of the collection to look in.
+
+        Returns:
+            The UUID, or None if the collection is empty.
+        """
+        document = self.find_one(collection_name, **kwargs)
+        if document is None:
+            return None
+        return str(document['_id'])
+
+    @abstractmethod
+    def find_all_ids(self, collection_name, **kwargs):
+        """
+        List the UUIDs of all documents in a collection.
+
+        Args:
+            collection_name: Name of the collection to look in.
+
+        Returns:
+            List of UUIDs.
+        """
+        return []
+
+    @abstractmethod
+    def insert(self, collection_name, document, **kwargs):
+        """
+        Store a new document, assigning it a new UUID.
+
+        Args:
+            collection_name: Name of the collection to store it in.
+            document: The document to store.
+
+        Returns:
+            The UUID assigned to the document.
+        """
+        return ''
+
+    @abstractmethod
+    def replace(self, collection_name, uuid, document, **kwargs):
+        """
+        Store a document with the given UUID, replacing any existing document
+        with the same UUID.
+
+        Args:
+            collection_name: Name of the collection to store it in.
+            uuid: UUID of the document.
+            document: The document to store.
+        """
+        pass
+
+    @abstractmethod
+    def remove(self, collection_name, uuid, **kwargs):
+        """
+        Remove a document.
+
+        Args:
+            collection_name: Name of the collection to remove it from.
+            uuid: UUID of the document to remove.
+
+        Returns:
+            True if a document was removed, False if not.
+        """
+        return False
+
+    @abstractmethod
+    def get_matrix(self, graph_identifier, **kwargs):
+        """
+        Retrieve the matrix stored for the given graph version.
+
+        Args:
+            graph_identifier: DataFrameId of the graph version the matrix was
+                made for.
+
+        Returns:
+            SparseMatrix or DataFrame with the stored matrix, or None if no
+            matrix is stored for this graph version.
+        """
+        return None
+
+    @abstractmethod
+    def store_matrix(self, matrix, graph_identifier, **kwargs):
+        """
+        Store a matrix, replacing any matrix stored for an earlier version of
+        the same graph with the same parameters.
+
+        Args:
+            matrix: SparseMatrix or DataFrame to store.
+            graph_identifier: DataFrameId of the graph version the matrix was
+                made for.
+
+        Returns:
+            Identifier of the stored matrix.
+        """
+        return ''
+
+    @abstractmethod
+    def get_arrays(self, graph_identifier, **kwargs):
+        """
+        Retrieve the arrays stored for the given graph version.
+
+        Args:
+            graph_identifier: DataFrameId of the graph version the arrays were
+                made for.
+
+        Returns:
+            Tuple with the dictionary of NumPy arrays and the dictionary of
+            labels given to store_arrays(), or None if no arrays are stored
+            for this graph version.
+        """
+        return None
+
+    @abstractmethod
+    def store_arrays(self, arrays, labels, graph_identifier, **kwargs):
+        """
+        Store arrays made from a graph, like store_matrix() does for matrices.
+
+        Args:
+            arrays: Dictionary with the NumPy arrays to store, using names
+                which can be used in file names as keys.
+            labels: Dictionary with additional information to store alongside
+                the arrays, which must be serializable to JSON.
+            graph_identifier: DataFrameId of the graph version the arrays were
+                made for. Use other_parameters to tell them apart from the
+                matrix made for the same graph.
+
+        Returns:
+            Identifier of the stored arrays.
+        """
+        return ''
+
+
+class MongoDBStorage(StorageBackend):
+    """
+    Storage in the MongoDB database configured by the environment variables.
+
+    The extra keyword arguments of each method are given to MongoDBConnection.
+    """
+
+    FORMAT_DENSE = 'split'
+    FORMAT_SPARSE = 'csr'
+    FORMAT_ARRAYS = 'arrays'
+
+    def find_one(self, collection_name, uuid=None, **kwargs):
+        criteria = None
+        if uuid is not None:
+            criteria = {'_id': ObjectId(uuid)}
+
+        with MongoDBConnection(**kwargs) as client:
+            collection = getattr(client.ontodb, collection_name)
+            return collection.find_one(criteria)
+
+    def find_all_ids(self, collection_name, **kwargs):
+        with MongoDBConnection(**kwargs) as client:
+            collection = getattr(client.ontodb, collection_name)
+            return [str(i) for i in collection.distinct('_id')]
+
+    def insert(self, collection_name, document, **kwargs):
+        with MongoDBConnection(**kwargs) as client:
+            collection = getattr(client.ontodb, collection_name)
+            return str(collection.insert_one(document).inserted_id)
+
+    def replace(self, collection_name, uuid, document, **kwargs):
+        with MongoDBConnection(**kwargs) as client:
+            collection = getattr(client.ontodb, collection_name)
+            collection.replace_one(
+                {'_id': ObjectId(uuid)},
+                document,
+                upsert=True,
+            )
+
+    def remove(self, collection_name, uuid, **kwargs):
+        with MongoDBConnection(**kwargs) as client:
+            collection = getattr(client.ontodb, collection_name)
+            r = collection.delete_one({'_id': ObjectId(uuid)})
+            return r.deleted_count > 0
+
+    def get_matrix(self, graph_identifier, **kwargs):
+        with MongoDBConnection(**kwargs) as client:
+            doc = client.ontodb.dataframe.find_one({
+                'graphType': graph_identifier.graph_type,
+                'graphUuid': graph_identifier.graph_uuid,
+                'lastModified': graph_identifier.last_modified,
+                'otherParameters': graph_identifier.other_parameters,
+            })
+            if doc is None:
+                return None
+            js = json.loads(doc['df'])
+            # Documents stored before sparse matrices were supported lack format
+            df_format = doc.get('format', self.FORMAT_DENSE)
+        js['columns'] = list(map(lambda x: URIRef(x), js['columns']))
+        js['index'] = list(map(lambda x: URIRef(x), js['index']))
+        if df_format == self.FORMAT_SPARSE:
+            return SparseMatrix.from_dict(js)
+        df = pd.DataFrame(
+            data=js['data'],
+            index=js['index'],
+            columns=js['columns']
+        )
+        return df
+
+    def store_matrix(self, matrix, graph_identifier, **kwargs):
+        if isinstance(matrix, SparseMatrix):
+            j = json.dumps(matrix.to_dict())
+            df_format = self.FORMAT_SPARSE
+        else:
+            j = matrix.to_json(orient='split')
+            df_format = self.FORMAT_DENSE
+        return self._store_document(j, df_format, graph_identifier, **kwargs)
+
+    def get_arrays(self, graph_identifier, **kwargs):
+        with MongoDBConnection(**kwargs) as client:
+            doc = client.ontodb.dataframe.find_one({
+                'graphType': graph_identifier.graph_type,
+                'graphUuid': graph_identifier.graph_uuid,
+                'lastModified': graph_identifier.last_modified,
+                'otherParameters': graph_identifier.other_parameters,
+                'format': self.FORMAT_ARRAYS,
+            })
+            if doc is None:
+                return None
+            js = json.loads(doc['df'])
+        arrays = {
+            key: np.array(array['data'], dtype=array['dtype'])
+            for key, array in js['arrays'].items()
+        }
+        return arrays, js['labels']
+
+    def store_arrays(self, arrays, labels, graph_identifier, **kwargs):
+        j = json.dumps({
+            'arrays': {
+                key: {
+                    'dtype': np.asarray(array).dtype.str,
+                    'data': np.asarray(array).tolist(),
+                }
+                for key, array in arrays.items()
+            },
+            'labels': labels,
+        })
+        return self._store_document(
+            j,
+            self.FORMAT_ARRAYS,
+            graph_identifier,
+            **kwargs
+        )
+
+    def _store_document(self, j, df_format, graph_identifier, **kwargs):
+        with MongoDBConnection(**kwargs) as client:
+            db = client.ontodb
+            doc = {
+                'df': j,
+                'format': df_format,
+                'graphType': graph_identifier.graph_type,
+                'graphUuid': graph_identifier.graph_uuid,
+                'lastModified': graph_identifier.last_modified,
+                'otherParameters': graph_identifier.other_parameters,
+            }
+            existing_id = self._get_uuid_for_outdated(graph_identifier, db)
+            if existing_id is not None:
+                db.dataframe.replace_one(
+                    {'_id': existing_id},
+                    doc,
+                )
+                return str(existing_id)
+            else:
+                return str(db.dataframe.insert_one(doc).inserted_id)
+
+    @staticmethod
+    def _get_uuid_for_outdated(graph_identifier, db):
+        doc = db.dataframe.find_one({
+            'graphType': graph_identifier.graph_type,
+            'graphUuid': graph_identifier.graph_uuid,
+            'otherParameters': graph_identifier.other_parameters,
+        })
+        if doc is None:
+            return None
+        return doc['_id']
+
+
+class LocalStorage(StorageBackend):
+    """
+    Storage in a directory on the local disk.
+
+    Writes are atomic, so readers never see partially written documents or
+    matrices. There is no locking beyond that, so when two processes store
+    the same document at the same time, the last one wins.
+    """
+
+    is_local = True
+
+    _DOCUMENT_SUFFIX = '.json'
+    _DATE_KEY = '$date'
+    _DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+    _FILE_KEY = '$file'
+    _MATRIX_COLLECTION = 'dataframe'
+
+    def __init__(self, directory):
+        """
+        Use the given directory for storage.
+
+        Args:
+            directory: Path to the directory. It is created when something is
+                stored, if missing.
+        """
+        self.directory = directory
+        """Path to the directory everything is stored in."""
+
+    def find_one(self, collection_name, uuid=None, **kwargs):
+        if uuid is None:
+            uuids = self.find_all_ids(collection_name)
+            if not uuids:
+                return None
+            uuid = uuids[0]
+
+        path = self._get_document_path(collection_name, uuid)
+        try:
+            with open(path) as fp:
+                document = json.load(fp, object_hook=self._decode)
+        except FileNotFoundError:
+            return None
+
+        for key, value in document.items():
+            if isinstance(value, dict) and self._FILE_KEY in value:
+                with open(os.path.join(
+                        os.path.dirname(path),
+                        value[self._FILE_KEY]
+                ), 'rb') as fp:
+                    document[key] = fp.read()
+        document['_id'] = uuid
+        return document
+
+    def find_all_ids(self, collection_name, **kwargs):
+        try:
+            filenames = os.listdir(
+                os.path.join(self.directory, collection_name)
+            )
+        except FileNotFoundError:
+            return []
+        # UUIDs are ObjectIds, which start with their creation time, so the
+        # first UUID is that of the oldest document
+        return sorted(
+            filename[:-len(self._DOCUMENT_SUFFIX)]
+            for filename in filenames
+            if filename.endswith(self._DOCUMENT_SUFFIX)
+            and not filename.startswith('.')
+        )
+
+    def insert(self, collection_name, document, **kwargs):
+        uuid = str(ObjectId())
+        self.replace(collection_name, uuid, document)
+        return uuid
+
+    def replace(self, collection_name, uuid, document, **kwargs):
+        path = self._get_document_path(collection_name, uuid)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Binary fields, like serialized graphs, are kept in their own files
+        encoded = dict()
+        for key, value in document.items():
+            if key == '_id':
+                continue
+            if isinstance(value, bytes):
+                filename = f'{uuid}.{key}'
+                self._write_atomically(
+                    os.path.join(os.path.dirname(path), filename),
+                    value
+                )
+                value = {self._FILE_KEY: filename}
+            encoded[key] = value
+
+        self._write_atomically(
+            path,
+            json.dumps(encoded, default=self._encode).encode('utf-8')
+        )
+
+    def remove(self, collection_name, uuid, **kwargs):
+        path = self._get_document_path(collection_name, uuid)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+
+        # Remove the files with binary fields as well
+        directory = os.path.dirname(path)
+        for filename in os.listdir(directory):
+            if filename.startswith(f'{uuid}.'):
+                os.remove(os.path.join(directory, filename))
+        return True
+
+    def get_matrix(self, graph_identifier, **kwargs):
+        directory, name = self._get_matrix_location(graph_identifier)
+        return matrixfile.load_matrix(name, directory)
+
+    def store_matrix(self, matrix, graph_identifier, **kwargs):
+        directory, name = self._get_matrix_location(graph_identifier)
+        matrixfile.save_matrix(name, matrix, directory)
+        self._remove_other_versions(directory, name)
+        return os.path.join(directory, name)
+
+    def get_arrays(self, graph_identifier, **kwargs):
+        directory, name = self._get_matrix_location(graph_identifier)
+        return matrixfile.load_arrays(name, directory)
+
+    def store_arrays(self, arrays, labels, graph_identifier, **kwargs):
+        directory, name = self._get_matrix_location(graph_identifier)
+        matrixfile.save_arrays(name, arrays, labels, directory)
+        self._remove_other_versions(directory, name)
+        return os.path.join(directory, name)
+
+    @staticmethod
+    def _remove_other_versions(directory, name):
+        # Remove what was stored for earlier versions of the graph. Processes
+        # which have it memory mapped can keep using it until they close it.
+        for other in os.listdir(directory):
+            if other != name and not other.startswith('.'):
+                shutil.rmtree(
+                    os.path.join(directory, other),
+                    ignore_errors=True
+                )
+
+    def _get_document_path(self, collection_name, uuid):
+        # Also ensures the UUID cannot be used to access other files
+        uuid = str(ObjectId(uuid))
+        return os.path.join(
+            self.directory,
+            collection_name,
+            uuid + self._DOCUMENT_SUFFIX
+        )
+
+    def _get_matrix_location(self, graph_identifier):
+        # One directory for each graph and set of parameters, with one matrix
+        # inside named after the version of the graph it was made for
+        directory = os.path.join(
+            self.directory,
+            self._MATRIX_COLLECTION,
+            graph_identifier.graph_type,
+            str(ObjectId(graph_identifier.graph_uuid)),
+            matrixfile.get_name(graph_identifier.other_parameters),
+        )
+        name = matrixfile.get_name(graph_identifier.last_modified)
+        return directory, name
+
+    @classmethod
+    def _encode(cls, value):
+        if isinstance(value, datetime.datetime):
+            return {cls._DATE_KEY: value.strftime(cls._DATE_FORMAT)}
+        raise TypeError(
+            f'Cannot store value of type {type(value).__name__}'
+        )
+
+    @classmethod
+    def _decode(cls, obj):
+        if len(obj) == 1 and cls._DATE_KEY in obj:
+            return datetime.datetime.strptime(
+                obj[cls._DATE_KEY],
+                cls._DATE_FORMAT
+            )
+        return obj
+
+    @staticmethod
+    def _write_atomically(path, data):
+        directory = os.path.dirname(path)
+        fd, temporary = tempfile.mkstemp(prefix='.', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(data)
+            os.replace(temporary, path)
+        except OSError:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
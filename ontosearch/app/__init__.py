@@ -2,6 +2,8 @@ from flask import Flask
 from ontosearch.config import Config
 from otd.opendatasemanticframework import ODSFLoader
 from os import path
+import gc
+import os
 
 app = Flask(__name__)
 app.config.from_object(Config)
@@ -9,9 +11,25 @@ app.config.from_object(Config)
 app_path = path.dirname(__file__)
 
 
-odsf_loader = ODSFLoader()
+odsf_loader = ODSFLoader(
+    compute_matrices=os.environ.get('COMPUTE_MATRICES') == '1',
+    search_index=ODSFLoader.parse_search_index(os.environ.get('SEARCH_INDEX')),
+)
 odsf_loader.ensure_all_loaded()
 
+# Compare the synsets of the concept labels before workers are forked, so that
+# they share the cached similarities instead of computing them on each query
+if os.environ.get('PREPOPULATE_WUP_CACHE') == '1':
+    for _, odsf in odsf_loader.loaded():
+        odsf.prepopulate_wup_cache()
+
+# The loaded matrices and graphs live as long as the app. Exclude them from
+# garbage collection, so that collections in workers forked from a preloading
+# Gunicorn master don't write to (and thereby copy) the memory they are in.
+gc.collect()
+if hasattr(gc, 'freeze'):
+    gc.freeze()
+
 
 print ("ready")
 
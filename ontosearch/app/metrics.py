@@ -0,0 +1,318 @@
+"""
+Metrics about requests and loaded configurations, served at /metrics.
+
+Request counts and latencies are recorded by hooks registered on the app,
+while the state of the loaded configurations is collected when metrics are
+scraped. If the METRICS_DIR environment variable is set, each worker process
+shares its metrics through files in that directory, so that a scrape answered
+by any worker describes all of them.
+
+Workers forked from a preloading Gunicorn master inherit the master's counts,
+like the configurations it loaded. They start counting from zero instead,
+while the master writes its own counts to METRICS_DIR before forking, so they
+are reported once.
+"""
+import os
+import resource
+import threading
+import time
+
+import numpy as np
+from flask import g, request
+
+from ontosearch.app import app
+from ontosearch.app import odsf_loader
+from otd.constants import SIMTYPE_ALL
+from otd.opendatasemanticframework import ODSFLoader
+from otd.semscore import wup_cache
+from utils.metrics import Metrics, MetricsDirectory, COUNTER, GAUGE, \
+    HISTOGRAM, merge
+
+
+WRITE_INTERVAL = 5.0
+"""Minimum number of seconds between writes to METRICS_DIR after requests."""
+
+
+metrics = Metrics()
+"""Metrics recorded by this process."""
+
+_directory = None
+if os.environ.get('METRICS_DIR'):
+    _directory = MetricsDirectory(os.environ['METRICS_DIR'])
+
+_last_write = 0.0
+_write_lock = threading.Lock()
+
+
+def _write_before_fork():
+    if _directory is not None:
+        collect()
+        _directory.write(metrics)
+
+
+def _reset_after_fork():
+    global _last_write
+    metrics.clear()
+    odsf_loader.reset_counters()
+    wup_cache.reset_counters()
+    _last_write = 0.0
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(
+        before=_write_before_fork,
+        after_in_child=_reset_after_fork,
+    )
+
+
+@app.before_request
+def _start_timer():
+    g.metrics_start = time.perf_counter()
+
+
+@app.after_request
+def _record_request(response):
+    start = g.pop('metrics_start', None)
+    if start is None:
+        return response
+    elapsed = time.perf_counter() - start
+
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    configuration = _get_configuration_label()
+    metrics.inc(
+        'ontosearch_requests_total',
+        'Number of requests handled.',
+        {
+            'route': route,
+            'method': request.method,
+            'status': str(response.status_code),
+            'configuration': configuration,
+        },
+    )
+    metrics.observe(
+        'ontosearch_request_duration_seconds',
+        'How many seconds it took to handle requests.',
+        elapsed,
+        {'route': route, 'configuration': configuration},
+    )
+    _write_if_due()
+    return response
+
+
+def _get_configuration_label():
+    # Only use configurations we know about, so that arbitrary user input does
+    # not create new label values
+    uuid = request.args.get('c', ODSFLoader.DEFAULT_KEY)
+    if uuid == ODSFLoader.DEFAULT_KEY:
+        return uuid
+    if uuid in dict(odsf_loader.loaded()):
+        return uuid
+    return 'unknown'
+
+
+def _write_if_due():
+    global _last_write
+    if _directory is None:
+        return
+    now = time.monotonic()
+    with _write_lock:
+        if now - _last_write < WRITE_INTERVAL:
+            return
+        _last_write = now
+    collect()
+    _directory.write(metrics)
+
+
+def collect():
+    """
+    Update the metrics which describe the state of this process, like the
+    loaded configurations and the memory in use.
+    """
+    pid = str(os.getpid())
+
+    for uuid, odsf in odsf_loader.loaded():
+        configuration = {'configuration': uuid}
+        cache = odsf._result_cache
+        metrics.set(
+            'ontosearch_result_cache_hits_total',
+            COUNTER,
+            'Number of searches answered from the result cache.',
+            cache.hits,
+            configuration,
+        )
+        metrics.set(
+            'ontosearch_result_cache_misses_total',
+            COUNTER,
+            'Number of searches not found in the result cache.',
+            cache.misses,
+            configuration,
+        )
+        metrics.set(
+            'ontosearch_shared_searches_total',
+            COUNTER,
+            'Number of searches which shared the result of an identical '
+            'search running at the same time.',
+            odsf._searches.shared,
+            configuration,
+        )
+        metrics.set(
+            'ontosearch_result_cache_entries',
+            GAUGE,
+            'Number of entries in the result cache.',
+            len(cache),
+            dict(configuration, pid=pid),
+        )
+
+        for stage, histogram in odsf.stage_histograms.items():
+            metrics.set(
+                'ontosearch_search_stage_seconds',
+                HISTOGRAM,
+                'How many seconds each stage of uncached searches took.',
+                histogram,
+                dict(configuration, stage=stage),
+            )
+
+        matrices = [
+            (name, cds.shape, cds.matrix.nnz)
+            for name, cds in odsf.cds.items()
+            if name != SIMTYPE_ALL
+        ]
+        if odsf.ccs is not None:
+            matrices.append((
+                'ccs',
+                odsf.ccs.shape,
+                int(np.count_nonzero(odsf.ccs.values)),
+            ))
+        for name, (rows, columns), nonzero in matrices:
+            labels = dict(configuration, matrix=name, pid=pid)
+            metrics.set(
+                'ontosearch_matrix_rows',
+                GAUGE,
+                'Number of rows in the loaded similarity matrices.',
+                rows,
+                labels,
+            )
+            metrics.set(
+                'ontosearch_matrix_columns',
+                GAUGE,
+                'Number of columns in the loaded similarity matrices.',
+                columns,
+                labels,
+            )
+            metrics.set(
+                'ontosearch_matrix_nonzero',
+                GAUGE,
+                'Number of non-zero values in the loaded similarity matrices.',
+                nonzero,
+                labels,
+            )
+
+        metrics.set(
+            'ontosearch_odsf_array_bytes',
+            GAUGE,
+            'Bytes used by the arrays (matrices, indices and tables) of each '
+            'loaded configuration. Memory mapped arrays are counted in full.',
+            odsf.nbytes,
+            dict(configuration, pid=pid),
+        )
+
+    for uuid, count in list(odsf_loader.load_counts.items()):
+        metrics.set(
+            'ontosearch_odsf_loads_total',
+            COUNTER,
+            'Number of times a configuration was loaded or had its dataset '
+            'taggings reloaded.',
+            count,
+            {'configuration': uuid},
+        )
+    for uuid, histogram in list(odsf_loader.load_durations.items()):
+        metrics.set(
+            'ontosearch_odsf_load_duration_seconds',
+            HISTOGRAM,
+            'How many seconds loads of configurations took.',
+            histogram,
+            {'configuration': uuid},
+        )
+
+    metrics.set(
+        'ontosearch_wup_cache_hits_total',
+        COUNTER,
+        'Number of Wu-Palmer similarities of synset pairs found in the cache.',
+        wup_cache.hits,
+    )
+    metrics.set(
+        'ontosearch_wup_cache_misses_total',
+        COUNTER,
+        'Number of Wu-Palmer similarities of synset pairs not found in the '
+        'cache.',
+        wup_cache.misses,
+    )
+    metrics.set(
+        'ontosearch_wup_cache_entries',
+        GAUGE,
+        'Number of synset pairs in the cache of Wu-Palmer similarities.',
+        len(wup_cache),
+        {'pid': pid},
+    )
+
+    metrics.set(
+        'ontosearch_process_resident_memory_bytes',
+        GAUGE,
+        'Resident memory of each process, in bytes.',
+        _get_resident_memory(),
+        {'pid': pid},
+    )
+
+
+def _get_resident_memory():
+    try:
+        with open('/proc/self/statm') as fp:
+            resident_pages = int(fp.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # Not on Linux. Use the peak instead, which is reported in kilobytes
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def snapshot():
+    """
+    Collect the metrics of all processes.
+
+    Returns:
+        Dictionary with the merged metrics, which can be given to
+        utils.metrics.render().
+    """
+    collect()
+    if _directory is None:
+        merged = merge([metrics.to_dict()])
+    else:
+        _directory.write(metrics)
+        merged = _directory.read()
+    _add_hit_ratios(merged)
+    return merged
+
+
+def _add_hit_ratios(merged):
+    # Ratios cannot be summed across processes, so they are calculated from
+    # the merged counters instead
+    hits = dict()
+    misses = dict()
+    for name, labels, value in merged['samples']:
+        if name == 'ontosearch_result_cache_hits_total':
+            hits[labels['configuration']] = value
+        elif name == 'ontosearch_result_cache_misses_total':
+            misses[labels['configuration']] = value
+
+    if not hits:
+        return
+    merged['families']['ontosearch_result_cache_hit_ratio'] = {
+        'type': GAUGE,
+        'help': 'Share of searches answered from the result cache.',
+    }
+    for configuration, hit_count in hits.items():
+        lookups = hit_count + misses.get(configuration, 0)
+        merged['samples'].append([
+            'ontosearch_result_cache_hit_ratio',
+            {'configuration': configuration},
+            hit_count / lookups if lookups else 0.0,
+        ])
@@ -1,16 +1,21 @@
+from argparse import ArgumentTypeError
 from datetime import datetime
 from time import time
 
 from flask import render_template, redirect
-from flask import request, flash, abort
+from flask import request, flash, abort, Response
 from flask.json import jsonify
 
 import db.log
 from ontosearch.app import app
 from ontosearch.app import odsf_loader
+from ontosearch.app import metrics
 from ontosearch.app.forms import SearchForm, ScoreForm
 from otd.constants import SIMTYPE_AUTOTAG, SIMTYPE_SIMILARITY
 from otd.opendatasemanticframework import ODSFLoader, MissingMatrixError
+from utils.common_cli import non_negative_int
+from utils.metrics import render
+from utils.timing import StageTimings
 
 
 @app.route('/')
@@ -78,6 +83,7 @@ def api_search():
     include_dataset_info = request.args.get('d') != '0'
     include_concepts = request.args.get('ic') != '0'
     configuration_uuid = request.args.get('c', ODSFLoader.DEFAULT_KEY)
+    include_timing = request.args.get('timing') == '1'
 
     # Collect parameters which should use the ODSF default when not present
     extra_options = {}
@@ -88,7 +94,7 @@ def api_search():
             value = float(value)
         except ValueError:
             return jsonify({'errors': ['qcs value is not a float']}), 400
-        extra_options['query_concept_sim'] = value
+        extra_options['qc_sim_threshold'] = value
 
     if 'qds' in request.args:
         value = request.args['qds']
@@ -97,7 +103,29 @@ def api_search():
             value = float(value)
         except ValueError:
             return jsonify({'errors': ['qds value is not a float']}), 400
-        extra_options['query_dataset_sim'] = value
+        extra_options['score_threshold'] = value
+
+    if 'k' in request.args:
+        value = request.args['k']
+        # Convert to correct format
+        try:
+            value = non_negative_int(value)
+        except ArgumentTypeError:
+            return jsonify({
+                'errors': ['k value is not a non-negative integer']
+            }), 400
+        extra_options['top_k'] = value
+
+    if 'm' in request.args:
+        value = request.args['m']
+        # Convert to correct format
+        try:
+            value = non_negative_int(value)
+        except ArgumentTypeError:
+            return jsonify({
+                'errors': ['m value is not a non-negative integer']
+            }), 400
+        extra_options['min_results'] = value
 
     # Load the configuration
     try:
@@ -110,18 +138,20 @@ def api_search():
         }), 500
 
     # Perform the query
+    timings = StageTimings()
     results, concept_similarities = odsf.search_query(
         query,
         SIMTYPE_AUTOTAG if autotag else SIMTYPE_SIMILARITY,
         include_dataset_info=include_dataset_info,
         include_concepts=include_concepts,
+        timings=timings,
         **extra_options
     )
 
     # Create a representation of the results.
     # namedtuples are treated as tuples, so we must create a comprehensible
     # structure ourself
-    return jsonify({
+    response = {
         'concepts': [
             {
                 'uri': c.uri,
@@ -148,7 +178,18 @@ def api_search():
             }
             for d in results
         ],
-    })
+    }
+    if include_timing:
+        response['timing'] = timings.to_dict()
+    return jsonify(response)
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(
+        render(metrics.snapshot()),
+        mimetype='text/plain; version=0.0.4',
+    )
 
 
 def get_concept_labels():
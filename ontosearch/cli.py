@@ -1,7 +1,7 @@
 import argparse
 import textwrap
 from os.path import dirname
-from utils.common_cli import make_subcommand_gunicorn, float_between_0_and_1
+from utils.common_cli import make_subcommand_gunicorn, float_between_0_and_1, non_negative_int
 from otd.constants import SIMTYPE_ALL, SIMTYPE_AUTOTAG, SIMTYPE_SIMILARITY, simtypes, DATAONTOSEARCH_ENGINE, GOOGLE_ENGINE, engines
 
 
@@ -10,6 +10,7 @@ def register_subcommand(add_parser):
     register_search(add_parser)
     register_multi_search(add_parser)
     register_matrix(add_parser)
+    register_index_report(add_parser)
 
 
 def register_serve(add_parser):
@@ -27,11 +28,28 @@ def register_serve(add_parser):
              'time when they are already up-to-date, but crashes if not.',
         action='store_true',
     )
+    parser.add_argument(
+        '--preload',
+        '-p',
+        help='Load all configurations once in the Gunicorn master process, '
+             'before forking the workers, instead of loading them in every '
+             'worker. The workers then share the loaded matrices and graphs '
+             'until they modify them. Missing matrices are created by the '
+             'master process, unless --skip-matrix is given.',
+        action='store_true',
+    )
     make_subcommand_gunicorn(parser, dirname(dirname(__file__)), 'ontosearch.app:app', ensure_server_ready)
 
 
 def ensure_server_ready(args):
-    if not args.skip_matrix:
+    if args.preload:
+        import os
+        # The app is loaded once before forking, so it can create the
+        # matrices itself instead of us loading everything an extra time
+        if not args.skip_matrix:
+            os.environ['COMPUTE_MATRICES'] = '1'
+        args.gunicorn_args.append('--preload')
+    elif not args.skip_matrix:
         from ontosearch.cds_update import ensure_matrices_are_created
         ensure_matrices_are_created()
 
@@ -170,6 +188,31 @@ def register_search(add_parser):
         metavar='THRESHOLD',
     )
 
+    parser.add_argument(
+        '--top-k',
+        '-k',
+        help='Return at most this many datasets, even when more datasets are '
+             'above the search result threshold. By default, all datasets '
+             'above the threshold are returned. (Type: non-negative integer)',
+        type=non_negative_int,
+        default=None,
+        dest='top_k',
+        metavar='K',
+    )
+
+    parser.add_argument(
+        '--min-results',
+        '-m',
+        help='Return at least this many datasets, by including the most '
+             'similar datasets below the search result threshold when needed. '
+             '--top-k takes precedence over this. (Default: %(default)s, '
+             'Type: non-negative integer)',
+        type=non_negative_int,
+        default=0,
+        dest='min_results',
+        metavar='N',
+    )
+
     format_option = parser.add_mutually_exclusive_group()
     format_option.add_argument(
         '--details',
@@ -224,3 +267,128 @@ def register_matrix(add_parser):
 def do_matrix(args):
     from ontosearch.search import do_matrix
     return do_matrix(args)
+
+
+def register_index_report(add_parser):
+    help_text = (
+        'Compare the recall and latency of the approximate search index to '
+        'exact search.'
+    )
+    description = textwrap.fill(
+        help_text + ' The approximate index is built once for each '
+                    'combination of --tables, --bits and --probes, and the '
+                    'same queries are run with both the exact and the '
+                    'approximate index.',
+        width=80
+    )
+    parser = add_parser(
+        'indexreport',
+        help=help_text,
+        description=description,
+    )
+
+    parser.add_argument(
+        '--search-result-threshold',
+        '-t',
+        help='The lower threshold for how similar a dataset vector must be to '
+             'the query vector in order to be included in the results (Ts). '
+             '(Default: %(default)s, Type: float between 0.0 and 1.0)',
+        type=float_between_0_and_1,
+        default=0.75,
+        dest='t_s',
+        metavar='THRESHOLD',
+    )
+
+    parser.add_argument(
+        '--concept-relevance-threshold',
+        '-c',
+        help='The lower threshold of similarity between a dataset and '
+             'concepts, used to decide which concepts are relevant (Tc). '
+             '(Default: %(default)s, Type: float between 0.0 and 1.0)',
+        type=float_between_0_and_1,
+        default=0.0,
+        dest='t_c',
+        metavar='THRESHOLD',
+    )
+
+    parser.add_argument(
+        '--query-concept-threshold',
+        '-q',
+        help='The lower threshold for how similar a concept must be to the '
+             'search query in order to be picked to represent it. Only used '
+             'with --queries. (Default: %(default)s, Type: float between 0.0 '
+             'and 1.0)',
+        type=float_between_0_and_1,
+        default=0.0,
+        dest='t_q',
+        metavar='THRESHOLD',
+    )
+
+    parser.add_argument(
+        '--top-k',
+        '-k',
+        help='The maximum number of datasets to retrieve for each query. '
+             '(Default: %(default)s, Type: non-negative integer)',
+        type=non_negative_int,
+        default=10,
+        dest='top_k',
+        metavar='K',
+    )
+
+    parser.add_argument(
+        '--tables',
+        help='Number of hash tables to evaluate. Multiple values can be '
+             'given. (Default: %(default)s)',
+        type=non_negative_int,
+        nargs='+',
+        default=[16],
+    )
+
+    parser.add_argument(
+        '--bits',
+        help='Number of hyperplanes per hash table to evaluate. Multiple '
+             'values can be given. (Default: %(default)s)',
+        type=non_negative_int,
+        nargs='+',
+        default=[10],
+    )
+
+    parser.add_argument(
+        '--probes',
+        help='Number of neighbouring buckets to look in for each table. '
+             'Multiple values can be given. (Default: %(default)s)',
+        type=non_negative_int,
+        nargs='+',
+        default=[4],
+    )
+
+    query_option = parser.add_mutually_exclusive_group()
+    query_option.add_argument(
+        '--queries',
+        help='File with one search query per line, to use as queries. By '
+             'default, the concept vectors of randomly picked datasets are '
+             'used as queries instead, which does not require WordNet.',
+        type=argparse.FileType('r'),
+    )
+    query_option.add_argument(
+        '--sample',
+        help='Number of datasets to pick as queries when --queries is not '
+             'given. (Default: %(default)s, Type: non-negative integer)',
+        type=non_negative_int,
+        default=100,
+    )
+
+    parser.add_argument(
+        'simtype',
+        choices=simtypes,
+        help='The set of dataset-concept links to use.',
+    )
+
+    parser.set_defaults(
+        func=do_index_report,
+    )
+
+
+def do_index_report(args):
+    from ontosearch.search import do_index_report
+    return do_index_report(args)
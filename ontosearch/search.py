@@ -4,6 +4,9 @@ from yaml import load
 from sys import stderr
 from tabulate import tabulate
 
+import numpy as np
+
+from otd.annindex import LSHIndex, evaluate_index
 from otd.constants import SIMTYPE_SIMILARITY, simtypes, DATAONTOSEARCH_ENGINE
 from otd.opendatasemanticframework import ODSFLoader
 from utils.common_cli import float_between_0_and_1
@@ -89,33 +92,55 @@ def do_dataontosearch_multi_search(document, queries, configurations):
             f'Did not recognize the simtypes {unrecognized_simtypes}'
         )
 
-    # Iterate through the instantiated queries
+    # Iterate through the instantiated variables. All queries for one
+    # combination of variables are performed together, as one batch
+    queries = list(queries)
     is_first_result = True
-    for arguments in itertools.product(
+    for configuration, t_s, t_c, t_q, simtype in itertools.product(
             configurations,
             t_s,
             t_c,
             t_q,
             chosen_simtypes,
-            queries
     ):
-        # Use empty lines between results, but not before first or after
-        # last
-        if not is_first_result:
-            print()
-        else:
-            is_first_result = False
-
-        do_single_multi_search(*arguments)
-
+        results_per_query = make_searches(
+            queries,
+            simtype,
+            t_s,
+            t_c,
+            t_q,
+            configuration,
+            include_dataset_info=False,
+            include_concepts=False,
+        )
 
-def do_single_multi_search(
+        for query, (results, _) in zip(queries, results_per_query):
+            # Use empty lines between results, but not before first or after
+            # last
+            if not is_first_result:
+                print()
+            else:
+                is_first_result = False
+
+            print_single_multi_search(
+                configuration,
+                t_s,
+                t_c,
+                t_q,
+                simtype,
+                query,
+                results,
+            )
+
+
+def print_single_multi_search(
         configuration,
         t_s,
         t_c,
         t_q,
         simtype,
-        query
+        query,
+        results
 ):
     # Print the first line, with information about chosen variables
     document = {
@@ -129,18 +154,6 @@ def do_single_multi_search(
     }
     print(json.dumps(document))
 
-    # Perform query
-    results, _ = make_search(
-        query,
-        simtype,
-        t_s,
-        t_c,
-        t_q,
-        configuration,
-        include_dataset_info=False,
-        include_concepts=False,
-    )
-
     # Print the datasets we found
     print_results_simple(results, None, None)
 
@@ -157,6 +170,8 @@ def do_search(args):
         args.t_q,
         include_dataset_info=include_dataset_info,
         include_concepts=include_concepts,
+        top_k=args.top_k,
+        min_results=args.min_results,
     )
 
     if args.simple:
@@ -174,13 +189,72 @@ def do_matrix(_):
     odsf_loader.ensure_all_loaded()
 
 
-def make_search(query, simtype, t_s, t_c, t_q, configuration=None, **kwargs):
-    print('Loading indices and matrices…', file=stderr)
-    odsf_loader = ODSFLoader(True, t_c, simtype)
-    if configuration is None:
-        odsf = odsf_loader.get_default()
+def do_index_report(args):
+    odsf = load_odsf(args.simtype, args.t_c)
+    kernel = odsf.search_kernels[args.simtype]
+
+    print('Creating query vectors…', file=stderr)
+    if args.queries is not None:
+        with args.queries as file:
+            queries = [line.strip() for line in file if line.strip()]
+        query_vectors = [
+            kernel.align_query(
+                odsf.calculate_query_sim_to_concepts(query, args.t_q),
+                odsf.concepts
+            )
+            for query in queries
+        ]
     else:
-        odsf = odsf_loader[configuration]
+        # Use the datasets' own concept vectors, so that each query has at
+        # least one similar dataset
+        random_state = np.random.RandomState(0)
+        positions = random_state.choice(
+            len(kernel.datasets),
+            min(args.sample, len(kernel.datasets)),
+            replace=False
+        )
+        query_vectors = kernel.matrix[positions].toarray()
+
+    rows = []
+    for num_tables, num_bits, num_probes in itertools.product(
+            args.tables,
+            args.bits,
+            args.probes,
+    ):
+        print(
+            f'Evaluating {num_tables} tables with {num_bits} bits and '
+            f'{num_probes} probes…',
+            file=stderr
+        )
+        index = LSHIndex(kernel, num_tables, num_bits, num_probes)
+        report = evaluate_index(
+            kernel,
+            index,
+            query_vectors,
+            args.t_s,
+            args.top_k
+        )
+        rows.append((num_tables, num_bits, num_probes) + tuple(report))
+
+    print(tabulate(
+        rows,
+        headers=(
+            'Tables',
+            'Bits',
+            'Probes',
+            'Recall',
+            'Exact ms',
+            'Exact p95 ms',
+            'Approx. ms',
+            'Approx. p95 ms',
+            'Candidates',
+        ),
+        tablefmt='psql',
+    ))
+
+
+def make_search(query, simtype, t_s, t_c, t_q, configuration=None, **kwargs):
+    odsf = load_odsf(simtype, t_c, configuration)
 
     print('Performing query…', file=stderr)
     return odsf.search_query(
@@ -192,6 +266,36 @@ def make_search(query, simtype, t_s, t_c, t_q, configuration=None, **kwargs):
     )
 
 
+def make_searches(
+        queries,
+        simtype,
+        t_s,
+        t_c,
+        t_q,
+        configuration=None,
+        **kwargs
+):
+    odsf = load_odsf(simtype, t_c, configuration)
+
+    print(f'Performing {len(queries)} queries…', file=stderr)
+    return odsf.search_queries(
+        queries,
+        cds_name=simtype,
+        qc_sim_threshold=t_q,
+        score_threshold=t_s,
+        **kwargs
+    )
+
+
+def load_odsf(simtype, t_c, configuration=None):
+    print('Loading indices and matrices…', file=stderr)
+    odsf_loader = ODSFLoader(True, t_c, simtype)
+    if configuration is None:
+        return odsf_loader.get_default()
+    else:
+        return odsf_loader[configuration]
+
+
 def print_results_simple(results, _1, _2):
     # Simply print URIs (for processing by other script)
     for result in results:
@@ -0,0 +1,308 @@
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from otd.searchkernel import SearchKernel
+
+
+IndexReport = namedtuple(
+    'IndexReport',
+    (
+        'recall',
+        'exact_ms',
+        'exact_p95_ms',
+        'approximate_ms',
+        'approximate_p95_ms',
+        'candidates',
+    )
+)
+"""
+Comparison of an approximate index with exact search, as made by
+evaluate_index(). Recall is the share of the exact results that were also
+found by the approximate index. Latencies are the mean and 95th percentile
+number of milliseconds per query, while candidates is the mean number of
+datasets scored by the approximate index per query.
+"""
+
+
+class LSHIndex:
+    """
+    Approximate nearest neighbour index for the datasets of a SearchKernel.
+
+    This uses locality-sensitive hashing with random hyperplanes. Each table
+    has num_bits random hyperplanes, and each dataset is hashed to a bucket
+    based on which side of each hyperplane its normalized concept vector lies.
+    Vectors with a small angle between them, and thus a high cosine similarity,
+    are likely to end up in the same bucket. A query is hashed the same way,
+    and only the datasets found in its buckets are scored exactly.
+
+    To find more of the similar datasets, multiple tables are used, and for
+    each table the buckets that differ from the query's bucket in one of the
+    num_probes least certain bits are looked in as well.
+
+    Since datasets that never share a bucket with the query are not scored,
+    some datasets above the score threshold may be left out. Use
+    evaluate_index() to see how many for a given set of parameters.
+    """
+    def __init__(
+            self,
+            kernel: SearchKernel,
+            num_tables=16,
+            num_bits=10,
+            num_probes=4,
+            seed=0,
+            arrays=None,
+    ):
+        """
+        Build the index for the datasets of the given kernel.
+
+        Args:
+            kernel: The search kernel whose datasets should be indexed. It is
+                used for scoring the candidates, and for exact search when the
+                index cannot be used.
+            num_tables: Number of hash tables. More tables improve the recall,
+                but increase the number of candidates and memory usage.
+            num_bits: Number of hyperplanes used by each table. More bits give
+                smaller buckets and faster search, at the cost of recall.
+            num_probes: Number of neighbouring buckets to look in for each
+                table, in addition to the query's own bucket.
+            seed: Seed for generating the random hyperplanes.
+            arrays: Dictionary returned by get_arrays() for an index of the
+                same kernel. When given, the tables are used as-is instead of
+                being built, so they may for example be memory mapped. The
+                number of tables and bits are then taken from the arrays,
+                while num_tables, num_bits and seed are ignored.
+        """
+        self.kernel = kernel
+        """The search kernel whose datasets are indexed."""
+
+        if arrays is None:
+            arrays = self._build_arrays(kernel, num_tables, num_bits, seed)
+
+        self.hyperplanes = arrays['hyperplanes']
+        """The normal vectors of each table's hyperplanes."""
+
+        num_bits = self.hyperplanes.shape[2]
+        self.num_probes = min(num_probes, num_bits)
+        """Number of neighbouring buckets to look in for each table."""
+
+        self._bit_values = 1 << np.arange(num_bits)
+
+        self.buckets = list(zip(
+            arrays['bucket_positions'],
+            arrays['bucket_codes']
+        ))
+        """
+        For each table, a tuple with the indexed datasets' positions sorted by
+        bucket, and the sorted bucket codes of those datasets.
+        """
+
+    @staticmethod
+    def _build_arrays(kernel, num_tables, num_bits, seed):
+        random_state = np.random.RandomState(seed)
+        hyperplanes = random_state.standard_normal(
+            (num_tables, len(kernel.concepts), num_bits)
+        )
+        bit_values = 1 << np.arange(num_bits)
+
+        # Datasets without concepts can never be similar to a query, so they
+        # are left out of the tables
+        row_lengths = np.diff(kernel.matrix.indptr)
+        indexed = np.flatnonzero(row_lengths)
+        vectors = kernel.matrix[indexed]
+
+        bucket_positions = np.empty((num_tables, len(indexed)), dtype=int)
+        bucket_codes = np.empty((num_tables, len(indexed)), dtype=int)
+        for table, table_hyperplanes in enumerate(hyperplanes):
+            codes = (vectors.dot(table_hyperplanes) > 0).dot(bit_values)
+            order = np.argsort(codes, kind='stable')
+            bucket_positions[table] = indexed[order]
+            bucket_codes[table] = codes[order]
+
+        return {
+            'hyperplanes': hyperplanes,
+            'bucket_positions': bucket_positions,
+            'bucket_codes': bucket_codes,
+        }
+
+    def get_arrays(self):
+        """
+        Collect the arrays that make up this index.
+
+        Returns:
+            Dictionary with the NumPy arrays of this index, which can be given
+            to the constructor to re-create it for the same kernel.
+        """
+        num_indexed = len(self.buckets[0][0]) if self.buckets else 0
+        return {
+            'hyperplanes': self.hyperplanes,
+            'bucket_positions': np.array(
+                [positions for positions, _ in self.buckets],
+                dtype=int
+            ).reshape((len(self.buckets), num_indexed)),
+            'bucket_codes': np.array(
+                [codes for _, codes in self.buckets],
+                dtype=int
+            ).reshape((len(self.buckets), num_indexed)),
+        }
+
+    @property
+    def nbytes(self):
+        """
+        Number of bytes used by the hash tables, not counting the kernel.
+        """
+        return self.hyperplanes.nbytes + sum(
+            positions.nbytes + codes.nbytes
+            for positions, codes in self.buckets
+        )
+
+    def _hash(self, projections):
+        return (projections > 0).dot(self._bit_values)
+
+    def search(
+            self,
+            query_vector,
+            score_threshold=0.0,
+            top_k=None,
+            min_results=0,
+    ):
+        """
+        Find the datasets to include in the result for the given query.
+
+        This mirrors SearchKernel.search(), but only the datasets found in the
+        query's buckets are considered. Exact search is used when all datasets
+        are to be included (no score_threshold nor top_k), or when too few
+        candidates are found to satisfy min_results.
+
+        Args:
+            query_vector: The query's similarity to each concept, aligned with
+                the kernel's matrix using SearchKernel.align_query().
+            score_threshold: See SearchKernel.rank().
+            top_k: See SearchKernel.rank().
+            min_results: See SearchKernel.rank().
+
+        Returns:
+            Tuple with two NumPy arrays. The first has the positions of the
+            datasets to include, most similar first. The second has their
+            similarity to the query.
+        """
+        norm = np.linalg.norm(query_vector)
+        if norm > 0.0 and (score_threshold > 0.0 or top_k is not None):
+            normalized = query_vector / norm
+            candidates = self.find_candidates(normalized)
+            if len(candidates) >= min_results:
+                scores = self.kernel.matrix[candidates].dot(normalized)
+                selected = SearchKernel.rank(
+                    scores,
+                    score_threshold,
+                    top_k,
+                    min_results
+                )
+                return candidates[selected], scores[selected]
+
+        return self.kernel.search(
+            query_vector,
+            score_threshold,
+            top_k,
+            min_results
+        )
+
+    def find_candidates(self, normalized_query):
+        """
+        Find the datasets that share a bucket with the query in any table.
+
+        Args:
+            normalized_query: The query's similarity to each concept, aligned
+                with the kernel's matrix and normalized to unit length.
+
+        Returns:
+            Sorted NumPy array with the positions of the candidate datasets.
+        """
+        found = []
+        for hyperplanes, (positions, codes) in zip(
+                self.hyperplanes,
+                self.buckets
+        ):
+            projections = normalized_query.dot(hyperplanes)
+            code = self._hash(projections)
+
+            # Also probe the buckets across the hyperplanes nearest the query
+            uncertain_bits = np.argsort(np.abs(projections))[:self.num_probes]
+            probes = np.append(code, code ^ self._bit_values[uncertain_bits])
+
+            starts = np.searchsorted(codes, probes, side='left')
+            ends = np.searchsorted(codes, probes, side='right')
+            found.extend(
+                positions[start:end]
+                for start, end in zip(starts, ends)
+                if start != end
+            )
+        if not found:
+            return np.array([], dtype=int)
+        return np.unique(np.concatenate(found))
+
+
+def evaluate_index(
+        kernel: SearchKernel,
+        index,
+        query_vectors,
+        score_threshold=0.75,
+        top_k=10,
+):
+    """
+    Compare the results and latency of an approximate index to exact search.
+
+    Args:
+        kernel: The search kernel to use for exact search.
+        index: The approximate index to evaluate, built for kernel.
+        query_vectors: Iterable of query vectors, aligned with the kernel's
+            matrix using SearchKernel.align_query().
+        score_threshold: The score threshold to search with.
+        top_k: The maximum number of results to search for.
+
+    Returns:
+        IndexReport with the recall and latencies of the index.
+    """
+    exact_times = []
+    approximate_times = []
+    num_candidates = []
+    num_expected = 0
+    num_found = 0
+
+    for query_vector in query_vectors:
+        start = time.perf_counter()
+        expected, _ = kernel.search(query_vector, score_threshold, top_k)
+        exact_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        found, _ = index.search(query_vector, score_threshold, top_k)
+        approximate_times.append(time.perf_counter() - start)
+
+        norm = np.linalg.norm(query_vector)
+        if norm > 0.0:
+            num_candidates.append(
+                len(index.find_candidates(query_vector / norm))
+            )
+
+        num_expected += len(expected)
+        num_found += len(np.intersect1d(expected, found))
+
+    return IndexReport(
+        recall=num_found / num_expected if num_expected else 1.0,
+        exact_ms=_milliseconds(exact_times, np.mean),
+        exact_p95_ms=_milliseconds(exact_times, np.percentile, 95),
+        approximate_ms=_milliseconds(approximate_times, np.mean),
+        approximate_p95_ms=_milliseconds(
+            approximate_times,
+            np.percentile,
+            95
+        ),
+        candidates=float(np.mean(num_candidates)) if num_candidates else 0.0,
+    )
+
+
+def _milliseconds(times, statistic, *args):
+    if not times:
+        return 0.0
+    return float(statistic(times, *args)) * 1000.0
@@ -0,0 +1,109 @@
+import numpy as np
+
+
+class ConceptHierarchy:
+    """
+    The SKOS hierarchy of concepts, compiled into NumPy arrays.
+
+    Like SKOSNavigate.parent_path, each node only follows its first parent.
+    This makes the hierarchy a tree (or forest), where the path from a root
+    down to a concept is unique. Each concept is represented by its path from
+    the root, stored as a row of integer node IDs in a matrix. The least common
+    subsumer of two concepts is then the last node of the common prefix of
+    their rows, and its depth is the length of that common prefix. This lets us
+    compare one concept to many others at once, without walking the RDF graph.
+    """
+    def __init__(self, navigator, concepts):
+        """
+        Compile the hierarchy of the given concepts.
+
+        Args:
+            navigator: SKOSNavigate instance for the ontology graph.
+            concepts: The concepts to compile the hierarchy for. The positions
+                of the concepts in this list are used to identify them.
+        """
+        self.concepts = list(concepts)
+        """The concepts in the hierarchy, in the same order as the arrays."""
+
+        # Assign IDs to all nodes, including ancestors not typed as concepts
+        nodes = list(self.concepts)
+        node_ids = {node: i for i, node in enumerate(nodes)}
+        parents = []
+        i = 0
+        while i < len(nodes):
+            parent = next(navigator.find_parents(nodes[i]), None)
+            if parent is not None and parent not in node_ids:
+                node_ids[parent] = len(nodes)
+                nodes.append(parent)
+            parents.append(-1 if parent is None else node_ids[parent])
+            i += 1
+
+        self.parents = np.array(parents, dtype=int)
+        """
+        ID of each node's parent, -1 for the roots. Concepts use their
+        position as ID, while ancestors that are not concepts come after them.
+        """
+
+        paths = [self._path_to_root(node_id) for node_id in range(len(nodes))]
+
+        self.depths = np.array([len(path) for path in paths], dtype=int)
+        """
+        Depth of each node, with the roots having depth 1 (same as
+        SKOSNavigate.depth).
+        """
+
+        max_depth = self.depths.max(initial=0)
+        self.paths = np.full((len(self.concepts), max_depth), -1, dtype=int)
+        """
+        Node IDs of each concept's path from the root, one row per concept.
+        Rows are padded with -1 after the concept itself.
+        """
+        for concept_id in range(len(self.concepts)):
+            path = paths[concept_id][::-1]
+            self.paths[concept_id, :len(path)] = path
+
+    def _path_to_root(self, node_id):
+        path = []
+        visited = set()
+        while node_id != -1 and node_id not in visited:
+            visited.add(node_id)
+            path.append(node_id)
+            node_id = self.parents[node_id]
+        return path
+
+    def lcs_depths(self, concept_id, other_ids):
+        """
+        Find the depth of the least common subsumer for many pairs at once.
+
+        Args:
+            concept_id: Position of one of the concepts in each pair.
+            other_ids: Positions of the other concepts in the pairs.
+
+        Returns:
+            NumPy array with the depth of the least common subsumer of
+            concept_id and each of the other concepts. The depth is 0 when
+            there is no common subsumer.
+        """
+        path = self.paths[concept_id]
+        same = (self.paths[other_ids] == path) & (path != -1)
+        # Length of the common prefix, i.e. number of leading True values
+        return np.cumprod(same, axis=1).sum(axis=1)
+
+    def wup_similarities(self, concept_id, other_ids):
+        """
+        Calculate the Wu-Palmer similarity for many pairs of concepts at once.
+
+        This gives the same result as SKOSNavigate.sim_wup, as long as the
+        concepts share a root.
+
+        Args:
+            concept_id: Position of one of the concepts in each pair.
+            other_ids: Positions of the other concepts in the pairs.
+
+        Returns:
+            NumPy array with the Wu-Palmer similarity between concept_id and
+            each of the other concepts.
+        """
+        lcs_depths = self.lcs_depths(concept_id, other_ids)
+        return 2.0 * lcs_depths / \
+            (self.depths[concept_id] + self.depths[other_ids])
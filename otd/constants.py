@@ -15,3 +15,25 @@ engines = (
     DATAONTOSEARCH_ENGINE,
     GOOGLE_ENGINE,
 )
+
+SEARCH_INDEX_EXACT = 'exact'
+SEARCH_INDEX_LSH = 'lsh'
+
+search_indexes = (
+    SEARCH_INDEX_EXACT,
+    SEARCH_INDEX_LSH,
+)
+
+STAGE_QUERY_PARSING = 'query_parsing'
+STAGE_WORDNET_SCORING = 'wordnet_scoring'
+STAGE_CCS_ENRICHMENT = 'ccs_enrichment'
+STAGE_DATASET_SCORING = 'dataset_scoring'
+STAGE_RESULT_ASSEMBLY = 'result_assembly'
+
+search_stages = (
+    STAGE_QUERY_PARSING,
+    STAGE_WORDNET_SCORING,
+    STAGE_CCS_ENRICHMENT,
+    STAGE_DATASET_SCORING,
+    STAGE_RESULT_ASSEMBLY,
+)
@@ -0,0 +1,90 @@
+from rdflib import URIRef
+
+from utils.graph import RDF, DCAT, DCT
+from utils.stringtable import StringTable
+
+
+class DatasetInfoTable:
+    """
+    Title, description and landing page of every dataset in a dataset graph.
+
+    The information is kept in StringTables instead of the RDF graph, so that
+    a catalog with millions of datasets takes up a few large arrays instead of
+    millions of Python objects. The order of the datasets is the same as that
+    of dataset_graph.subjects(RDF.type, DCAT.Dataset).
+    """
+    def __init__(self, dataset_graph):
+        """
+        Collect the information about the datasets in the given graph.
+
+        Args:
+            dataset_graph: RDF graph with the dcat:Dataset instances.
+        """
+        # Look up the information for all datasets at once, with one pass
+        # through the graph for each predicate
+        def first_object_by_subject(predicate):
+            objects = dict()
+            for subject, obj in dataset_graph.subject_objects(predicate):
+                objects.setdefault(subject, obj)
+            return objects
+
+        titles = first_object_by_subject(DCT.title)
+        descriptions = first_object_by_subject(DCT.description)
+        landing_pages = first_object_by_subject(DCAT.landingPage)
+        datasets = list(dataset_graph.subjects(RDF.type, DCAT.Dataset))
+
+        self.uris = StringTable(datasets)
+        """The URI of each dataset."""
+
+        self.titles = StringTable(str(titles.get(d)) for d in datasets)
+        """The title of each dataset, 'None' for datasets without one."""
+
+        self.descriptions = StringTable(
+            str(descriptions.get(d)) for d in datasets
+        )
+        """The description of each dataset, 'None' for datasets without one."""
+
+        self.hrefs = StringTable(
+            str(landing_pages.get(d, d)) for d in datasets
+        )
+        """The landing page of each dataset, or its URI if it has none."""
+
+    def __len__(self):
+        return len(self.uris)
+
+    @property
+    def nbytes(self):
+        """Number of bytes used by the arrays of this table."""
+        return self.uris.nbytes + self.titles.nbytes + \
+            self.descriptions.nbytes + self.hrefs.nbytes
+
+    def datasets(self):
+        """
+        List the datasets in the table.
+
+        Returns:
+            List with the URIRef of each dataset.
+        """
+        return [URIRef(uri) for uri in self.uris]
+
+    def __getitem__(self, dataset):
+        """
+        Look up the information about a dataset.
+
+        Args:
+            dataset: URI of the dataset to look up.
+
+        Returns:
+            Tuple with the title, description, URI and landing page of the
+            dataset, in the same order as DatasetInfo.
+
+        Raises:
+            KeyError: If the dataset is not in the table.
+        """
+        position = self.uris.get_loc(dataset)
+        return (
+            self.titles[position],
+            self.descriptions[position],
+            self.uris[position],
+            self.hrefs[position],
+        )
@@ -1,20 +1,31 @@
-import itertools
+import collections
+import time
 from collections.abc import Mapping
-from otd.constants import SIMTYPE_AUTOTAG, SIMTYPE_SIMILARITY
+from otd.constants import SIMTYPE_AUTOTAG, SIMTYPE_SIMILARITY, SIMTYPE_ALL, \
+    SEARCH_INDEX_EXACT, SEARCH_INDEX_LSH, search_indexes, search_stages, \
+    STAGE_CCS_ENRICHMENT, STAGE_DATASET_SCORING, STAGE_RESULT_ASSEMBLY
 from bson.errors import InvalidId
 import logging
 from rdflib import URIRef
-from utils.graph import RDF, OTD, DCAT, DCT
+from utils.graph import RDF, OTD, DCAT, DCT, SKOS
 from otd.skosnavigate import SKOSNavigate
+from otd.concepthierarchy import ConceptHierarchy
 from otd.queryextractor import QueryExtractor
 from otd.semscore import SemScore
+from otd.searchkernel import SearchKernel
+from otd.annindex import LSHIndex
+from otd.datasetinfotable import DatasetInfoTable
+from utils.cache import LRUCache, SingleFlight
+from utils.sparse import SparseMatrix
+from utils.timing import Histogram, StageTimings
 import db.dataframe
 import db.graph
-from sklearn.metrics.pairwise import cosine_similarity
+import db.matrixfile
 from collections import namedtuple
 
 import pandas as pd
 import numpy as np
+import scipy.sparse
 import clint.textui.progress
 
 log = logging.getLogger(__name__)
@@ -33,6 +44,11 @@ ConceptSimilarity = namedtuple(
 )
 
 
+LOAD_DURATION_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0,
+                         600.0, 1800.0)
+"""Bucket bounds (in seconds) used for ODSFLoader.load_durations."""
+
+
 class MissingMatrixError(RuntimeError):
     """
     Error indicating that a matrix/DataFrame was expected, but was not found.
@@ -44,25 +60,66 @@ class MissingMatrixError(RuntimeError):
 
 
 class OpenDataSemanticFramework:
+    CDS_CHUNK_SIZE = 1024
+    """
+    Number of similarities to process at a time when computing concept-dataset
+    similarity matrices. Each chunk takes up CDS_CHUNK_SIZE * len(concepts)
+    floats of memory.
+    """
+
     def __init__(self, ontology_uuid, dataset_uuid, auto_compute=True,
-                 concept_similarity=0.0):
+                 concept_similarity=0.0, result_cache_size=256,
+                 result_cache_ttl=None, search_index=SEARCH_INDEX_EXACT):
         """
         The RDF library allows a set of rdf-files to be parsed into
         a graph representing RDF triples. The SKOSNavigate class is
         a tool for navigating between siblings, children and parents in
         a graph, and implements methods for calculating similarity based 
         on the relative position of two concepts.
+
+        The ontology and dataset graphs are fetched from the database using
+        ontology_uuid and dataset_uuid. Instances of db.graph.Ontology and
+        db.graph.Dataset can be given instead, to use graphs which are not
+        stored in the database.
+
+        The results of search_query() are cached, using a cache that holds
+        result_cache_size results (0 disables it). Cached results expire after
+        result_cache_ttl seconds, or never when it is None. The cache is
+        emptied whenever the ontology or a dataset tagging is (re)loaded.
+        Identical searches made at the same time by different threads are
+        done only once, with the result shared between them.
+        The duration of each stage of search_query() is counted in
+        stage_histograms, which has one Histogram per stage name.
+
+        Datasets are retrieved using the index named by search_index, which is
+        one of the search_indexes in otd.constants. The exact index compares
+        the query to every dataset that shares a concept with it, while the
+        lsh index uses an approximate LSHIndex, trading recall for speed on
+        very large catalogs.
         """
+        if search_index not in search_indexes:
+            raise ValueError(
+                f'Unrecognized search index {search_index!r}, please use one '
+                f'of {search_indexes}'
+            )
+        self.search_index = search_index
+        self._result_cache = LRUCache(result_cache_size, result_cache_ttl)
+        self._searches = SingleFlight()
+        self.stage_histograms = {stage: Histogram() for stage in search_stages}
         self.auto_compute = auto_compute
         self.cds = dict()
         self.cds_df_id = dict()
+        self.search_kernels = dict()
+        self.search_indices = dict()
         self.ccs = None
+        self._ccs_array = None
         self.concept_similarity = concept_similarity
 
         # Set up variables needed for graph property setter
         self.__graph = None
         self.navigator = None
         self.concepts = []
+        self._concept_labels = dict()
         self.ontology = None
         self.dataset = None
         self._qe = QueryExtractor()
@@ -71,13 +128,28 @@ class OpenDataSemanticFramework:
         # Then set graph
         self.load_new_graph(ontology_uuid)
 
-        # Other properties
-        self.dataset_graph = db.graph.Dataset.from_uuid(dataset_uuid).graph
+        # Other properties. The dataset graph is only needed to create the
+        # table of dataset information, so it is not kept around afterwards.
+        self._dataset_uuid = dataset_uuid
+        self.__dataset_graph = None
+        self._dataset_info = DatasetInfoTable(self._get_dataset().graph)
 
     @property
     def graph(self):
         return self.__graph
 
+    @property
+    def dataset_graph(self):
+        # Only loaded again when needed, like for computing new matrices
+        if self.__dataset_graph is None:
+            self.__dataset_graph = self._get_dataset().graph
+        return self.__dataset_graph
+
+    def _get_dataset(self):
+        if isinstance(self._dataset_uuid, db.graph.Dataset):
+            return self._dataset_uuid
+        return db.graph.Dataset.from_uuid(self._dataset_uuid)
+
     @graph.setter
     def graph(self, new_graph):
         self.__graph = new_graph
@@ -85,25 +157,71 @@ class OpenDataSemanticFramework:
         # Update dependent properties
         self.navigator = SKOSNavigate(new_graph)
         self.concepts = list(self.navigator.concepts())
-        self._semscore = SemScore(self._qe, self.navigator)
+        self._concept_labels = self._create_concept_label_table(
+            new_graph,
+            self.concepts
+        )
+        self._semscore = SemScore(self._qe, self.navigator, self.concepts)
+
+    def reset_counters(self):
+        """
+        Set the counts of cache hits, shared searches and stage durations to
+        zero, like for a newly created instance.
+        """
+        self._result_cache.reset_counters()
+        self._searches.reset_counters()
+        for histogram in self.stage_histograms.values():
+            histogram.reset()
+
+    @staticmethod
+    def _create_concept_label_table(graph, concepts):
+        # Find the first label of each concept, like pref_and_alt_labels()[0]
+        # would have, but with one pass through the graph for each predicate
+        labels = dict()
+        for predicate in (SKOS.prefLabel, SKOS.altLabel):
+            for concept, label in graph.subject_objects(predicate):
+                if getattr(label, 'language', None) == 'en':
+                    labels.setdefault(concept, label)
+        return {concept: labels.get(concept) for concept in concepts}
 
     def load_new_graph(self, uuid):
-        self.ontology = db.graph.Ontology.from_uuid(uuid)
+        if isinstance(uuid, db.graph.Ontology):
+            self.ontology = uuid
+        else:
+            self.ontology = db.graph.Ontology.from_uuid(uuid)
         graph = self.ontology.graph
         self.graph = graph
         self.load_ccs(self.ontology)
+        self._load_label_synsets(self.ontology)
+        self._result_cache.clear()
+
+    def _load_label_synsets(self, ontology):
+        # Finding the synsets of the concept labels takes long, so it is done
+        # now instead of by the first queries. The result is stored next to
+        # the CCS matrix, so later runs (and other processes) can load it.
+        wordnet_version = self._semscore.get_wordnet_version()
+        stored = ontology.get_label_synsets(wordnet_version)
+        if stored is not None and self._semscore.load_label_arrays(*stored):
+            return
+
+        self._semscore.prepare_labels()
+        if stored is None and self.auto_compute:
+            arrays, labels = self._semscore.get_label_arrays()
+            ontology.save_label_synsets(arrays, labels, wordnet_version)
 
     def compute_ccs(self):
-        data = []
-        for c1 in clint.textui.progress.bar(
-                self.concepts,
+        hierarchy = ConceptHierarchy(self.navigator, self.concepts)
+        num_concepts = len(self.concepts)
+        data = np.zeros((num_concepts, num_concepts))
+        for i in clint.textui.progress.bar(
+                range(num_concepts),
                 'Calculating concept-concept similarity… ',
         ):
-            v = []
-            for c2 in self.concepts:
-                score = self.navigator.sim_wup(c1, c2)
-                v.append(score)
-            data.append(v)
+            # The similarity is symmetric, so only compute the upper triangle
+            others = np.arange(i, num_concepts)
+            scores = hierarchy.wup_similarities(i, others)
+            data[i, i:] = scores
+            data[i:, i] = scores
         ccs = pd.DataFrame(
             columns=self.concepts,
             index=self.concepts,
@@ -114,6 +232,28 @@ class OpenDataSemanticFramework:
     def get_cds(self, name):
         return self.cds[name]
 
+    @property
+    def nbytes(self):
+        """
+        Number of bytes used by the NumPy arrays of this instance, like the
+        matrices and search indices. RDF graphs and other Python objects are
+        not counted.
+        """
+        total = self._dataset_info.nbytes
+        if self._ccs_array is not None:
+            total += self._ccs_array.nbytes
+        # The 'all' matrix may share its matrix, kernel and index with another
+        # one, and the exact index is the kernel itself, so each object is
+        # only counted once
+        arrays = {id(cds): cds for cds in self.cds.values()}
+        arrays.update(
+            (id(kernel), kernel) for kernel in self.search_kernels.values()
+        )
+        arrays.update(
+            (id(index), index) for index in self.search_indices.values()
+        )
+        return total + sum(array.nbytes for array in arrays.values())
+
     def get_ccs(self):
         return self.ccs
 
@@ -134,6 +274,42 @@ class OpenDataSemanticFramework:
 
         self.ccs = result
 
+        if db.matrixfile.is_enabled():
+            # Share the prepared array with other processes. The order of the
+            # concepts is stored with it, and must match ours.
+            file_name = db.matrixfile.get_name(
+                'ccs',
+                ontology.uuid,
+                version=ontology.last_modified
+            )
+            prepared = db.matrixfile.load_or_create_matrix(
+                file_name,
+                lambda: pd.DataFrame(
+                    self._prepare_ccs_array(result),
+                    index=self.concepts,
+                    columns=self.concepts,
+                )
+            )
+            if prepared.index.equals(pd.Index(self.concepts)):
+                self._ccs_array = prepared.values
+                return
+
+        self._ccs_array = self._prepare_ccs_array(result)
+
+    def _prepare_ccs_array(self, ccs):
+        # Prepare concept-concept similarities for enriching queries, with
+        # _ccs_array[i, j] being the similarity used when the query matched
+        # concept i and we look at concept j. A concept is not used to enrich
+        # itself.
+        ccs_array = ccs \
+            .reindex(index=self.concepts, columns=self.concepts) \
+            .values \
+            .astype(float) \
+            .T
+        ccs_array = np.nan_to_num(ccs_array)
+        np.fill_diagonal(ccs_array, 0.0)
+        return ccs_array
+
     def load_similarity_graph(
             self,
             name,
@@ -164,66 +340,238 @@ class OpenDataSemanticFramework:
                     f'the {dataset_tagging.get_collection_name()} graph with UUID '
                     f'{dataset_tagging.uuid}, and not set to auto-create it.'
                 )
+        elif isinstance(result, pd.DataFrame):
+            # Matrix was stored before we switched to sparse matrices
+            result = SparseMatrix.from_dataframe(result)
 
         self.cds[name] = result
         self.cds_df_id[name] = dataset_tagging.get_df_id(
             similarity_threshold
         )
+        self._load_search_kernel(name, result, (self.cds_df_id[name],))
+
+        self.update_all_cdsm()
+        self._result_cache.clear()
 
-        self.add_to_all_cdsm(result)
+    def update_all_cdsm(self):
+        """
+        Update the 'all' matrix after one of the other matrices changed.
 
-    def add_to_all_cdsm(self, cdsm):
-        if 'all' in self.cds:
-            self.cds['all'] = self.cds['all'].append(cdsm, sort=True)
+        The 'all' matrix has one row per dataset, with the highest similarity
+        found in any of the other matrices for each concept. It is merged from
+        all the other matrices again, and gets a new search kernel, whenever
+        one of them changes.
+        """
+        # The layout of the merged matrix depends on the order of the names.
+        # Sort them, so that the same matrices always give the same layout and
+        # file name, no matter which of them was loaded last.
+        names = sorted(n for n in self.cds if n != SIMTYPE_ALL)
+        if len(names) == 1:
+            # Nothing to merge, so the matrix and its kernel are shared
+            self.cds[SIMTYPE_ALL] = self.cds[names[0]]
+            self.search_kernels[SIMTYPE_ALL] = self.search_kernels[names[0]]
+            self.search_indices[SIMTYPE_ALL] = self.search_indices[names[0]]
+            return
+
+        df_ids = tuple(self.cds_df_id[n] for n in names)
+
+        def merge():
+            return SparseMatrix.merge_max([self.cds[n] for n in names])
+
+        if db.matrixfile.is_enabled():
+            merged = db.matrixfile.load_or_create_matrix(
+                self._get_file_name('cds', df_ids),
+                merge
+            )
+        else:
+            merged = merge()
+
+        self.cds[SIMTYPE_ALL] = merged
+        self._load_search_kernel(SIMTYPE_ALL, merged, df_ids)
+
+    def _load_search_kernel(self, name, cds, df_ids):
+        # The kernel and index are made from the matrix, so they are named
+        # after the same DataFrameIds
+        kernel = SearchKernel(cds, arrays=self._load_shared_arrays(
+            'kernel',
+            df_ids,
+            lambda: SearchKernel(cds).get_arrays()
+        ))
+        self.search_kernels[name] = kernel
+        if self.search_index == SEARCH_INDEX_LSH:
+            self.search_indices[name] = LSHIndex(
+                kernel,
+                arrays=self._load_shared_arrays(
+                    'lsh',
+                    df_ids,
+                    lambda: LSHIndex(kernel).get_arrays()
+                )
+            )
         else:
-            self.cds['all'] = cdsm
+            self.search_indices[name] = kernel
+
+    def _load_shared_arrays(self, kind, df_ids, create):
+        # Share the arrays with other processes when matrix files are in use,
+        # otherwise None is returned so that they are created in memory
+        if not db.matrixfile.is_enabled():
+            return None
+        return db.matrixfile.load_or_create_arrays(
+            self._get_file_name(kind, df_ids),
+            create
+        )
 
-    def compute_cds(self, sgraph, name, similarity_threshold):
-        cds = pd.DataFrame(None, columns=self.concepts)
+    @staticmethod
+    def _get_file_name(kind, df_ids):
+        # The files are named after the graphs they were made from, with the
+        # graphs' last modification times as version, so that files made for
+        # earlier versions of the graphs are removed
+        return db.matrixfile.get_name(
+            kind,
+            tuple(df_id._replace(last_modified=None) for df_id in df_ids),
+            version=tuple(df_id.last_modified for df_id in df_ids),
+        )
 
-        # Create zero-vectors for each dataset
-        for dataset in self.dataset_graph.subjects(RDF.type, DCAT.Dataset):
-            cds.loc[dataset] = np.nan
+    def compute_cds(self, sgraph, name, similarity_threshold):
+        datasets = self._dataset_info.datasets()
+        dataset_positions = {d: i for i, d in enumerate(datasets)}
+        concept_positions = {c: i for i, c in enumerate(self.concepts)}
+
+        # Collect (dataset, concept, score) for all similarities in one go
+        dataset_indices = []
+        concept_indices = []
+        scores = []
+        for dataset, concept, score in self._extract_similarities(sgraph):
+            if dataset not in dataset_positions or \
+                    concept not in concept_positions:
+                log.warning(
+                    f'Skipping similarity between dataset {dataset} and '
+                    f'concept {concept}, since one of them is unknown'
+                )
+                continue
+            dataset_indices.append(dataset_positions[dataset])
+            concept_indices.append(concept_positions[concept])
+            scores.append(score)
+        dataset_indices = np.array(dataset_indices, dtype=int)
+        concept_indices = np.array(concept_indices, dtype=int)
+        scores = np.array(scores, dtype=float)
+
+        # Group the similarities by dataset, keeping the order of the datasets
+        order = np.argsort(dataset_indices, kind='stable')
+        dataset_indices = dataset_indices[order]
+        concept_indices = concept_indices[order]
+        scores = scores[order]
+        group_bounds = np.append(
+            np.flatnonzero(np.diff(dataset_indices, prepend=-1)),
+            len(dataset_indices)
+        )
 
-        # Set similarity values in the cds
-        similarities = tuple(sgraph.subjects(RDF.type, OTD.Similarity))
-        for similarity in clint.textui.progress.bar(
-                similarities,
+        # ccs_rows[i, j] is the similarity between the tagged concept i and
+        # concept j
+        ccs_rows = self.ccs \
+            .reindex(index=self.concepts, columns=self.concepts) \
+            .values \
+            .astype(float)
+
+        rows = []
+        row_labels = []
+        for start, end in clint.textui.progress.bar(
+                tuple(self._chunk_groups(group_bounds, self.CDS_CHUNK_SIZE)),
                 f'Constructing concept-dataset similarity matrix for '
                 f'"{name}"… ',
                 every=1,
         ):
-            dataset = next(sgraph.objects(similarity, OTD.dataset), None)
-            concept = next(sgraph.objects(similarity, OTD.concept), None)
-            score = (float)(next(sgraph.objects(similarity, OTD.score), np.nan))
-            for cs in self.concepts:
-                simscore = (float)(self.ccs[cs][concept]) * score
-
-                # Only associate dataset with concepts above Tc (concept-dataset
-                # similarity threshold)
-                if simscore < similarity_threshold:
-                    simscore = 0.0
-                cds.loc[dataset][cs] = np.nanmax(
-                    [simscore, cds.loc[dataset][cs]]
-                )
-        return cds.dropna(thresh=1)
+            first, last = group_bounds[start], group_bounds[end]
+            simscores = ccs_rows[concept_indices[first:last]] * \
+                scores[first:last, np.newaxis]
+
+            # Only associate dataset with concepts above Tc (concept-dataset
+            # similarity threshold)
+            with np.errstate(invalid='ignore'):
+                simscores[simscores < similarity_threshold] = 0.0
+
+            # Each dataset gets the highest score from its similarities.
+            # Missing scores (NaN) are ignored, and datasets without any scores
+            # are left out.
+            dataset_scores = np.fmax.reduceat(
+                simscores,
+                group_bounds[start:end] - first,
+                axis=0
+            )
+            has_scores = ~np.isnan(dataset_scores).all(axis=1)
+            rows.append(scipy.sparse.csr_matrix(
+                np.nan_to_num(dataset_scores[has_scores])
+            ))
+            row_labels.extend(
+                datasets[i]
+                for i in dataset_indices[group_bounds[start:end]][has_scores]
+            )
+
+        if rows:
+            matrix = scipy.sparse.vstack(rows, format='csr')
+        else:
+            matrix = scipy.sparse.csr_matrix((0, len(self.concepts)))
+        return SparseMatrix(matrix, row_labels, self.concepts)
+
+    @staticmethod
+    def _extract_similarities(sgraph):
+        def first_object_by_subject(predicate):
+            objects = dict()
+            for subject, obj in sgraph.subject_objects(predicate):
+                objects.setdefault(subject, obj)
+            return objects
+
+        datasets = first_object_by_subject(OTD.dataset)
+        concepts = first_object_by_subject(OTD.concept)
+        scores = first_object_by_subject(OTD.score)
+
+        for similarity in sgraph.subjects(RDF.type, OTD.Similarity):
+            yield (
+                datasets.get(similarity),
+                concepts.get(similarity),
+                float(scores.get(similarity, np.nan)),
+            )
 
-    def enrich_query_with_ccs(self, score_vec, query, similarity_threshold):
-        new_score_vec = score_vec.copy()
-        query_row = score_vec.loc[query]
-        new_query_row = new_score_vec.loc[query]
+    @staticmethod
+    def _chunk_groups(group_bounds, chunk_size):
+        # Split the groups into chunks of consecutive groups, with up to
+        # chunk_size items in each chunk (unless one group is larger than that)
+        num_groups = len(group_bounds) - 1
+        start = 0
+        while start < num_groups:
+            end = np.searchsorted(
+                group_bounds,
+                group_bounds[start] + chunk_size,
+                side='right'
+            ) - 1
+            end = min(max(end, start + 1), num_groups)
+            yield start, end
+            start = end
+
+    def enrich_query_with_ccs(self, query_vector, similarity_threshold):
+        """
+        Let the concepts matched by a query make related concepts match too.
 
-        for c1, c2 in itertools.permutations(self.concepts, 2):
-            simscore = (float)(self.ccs[c1][c2]) * query_row[c1]
+        Each concept is as similar to the query as the most similar concept
+        in the query, scaled by their concept-concept similarity. Only the
+        concepts matched by the query can contribute.
 
-            if simscore < similarity_threshold:
-                simscore = 0.0
+        Args:
+            query_vector: NumPy array with the query's similarity to each
+                concept, aligned with the concepts attribute.
+            similarity_threshold: Lower threshold for the scaled similarities.
+                Lower scaled similarities are not used.
 
-            new_query_row[c2] = np.nanmax(
-                [simscore, new_query_row[c2]]
-            )
-        return new_score_vec
+        Returns:
+            New NumPy array with the enriched similarity to each concept.
+        """
+        query_vector = np.asarray(query_vector, dtype=float)
+        matched = np.flatnonzero(query_vector)
+        simscores = self._ccs_array[matched] * \
+            query_vector[matched, np.newaxis]
+
+        simscores[simscores < similarity_threshold] = 0.0
 
+        return np.maximum(query_vector, simscores.max(axis=0, initial=0.0))
 
     def datasets(self):
         ds = []
@@ -233,27 +581,57 @@ class OpenDataSemanticFramework:
                 ds.append(title)
         return ds
 
-    def calculate_query_sim_to_concepts(self, query, sim_threshold):
-        scorevec = self._semscore.score_vector(query, sim_threshold)
-        scorevec = self.enrich_query_with_ccs(scorevec, query, self.concept_similarity)
+    def calculate_query_sim_to_concepts(self, query, sim_threshold,
+                                        timings=None):
+        """
+        Calculate how similar the query is to each concept.
+
+        Args:
+            query: The search query.
+            sim_threshold: Lower threshold for how similar a word in the query
+                must be to a concept label for the concept to be matched.
+            timings: Optional StageTimings to record the duration of each
+                stage in.
+
+        Returns:
+            NumPy array with the query's similarity to each concept, in the
+            same order as the concepts attribute.
+        """
+        if timings is None:
+            timings = StageTimings()
+        scorevec = self._semscore.score_vector(query, sim_threshold, timings)
+        with timings.stage(STAGE_CCS_ENRICHMENT):
+            scorevec = self.enrich_query_with_ccs(
+                scorevec,
+                self.concept_similarity
+            )
         return scorevec
 
+    def prepopulate_wup_cache(self):
+        """
+        Fill the process-wide cache of Wu-Palmer similarities with the synset
+        pairs found in the labels of our concepts.
+
+        See SemScore.prepopulate_wup_cache() for details.
+
+        Returns:
+            Number of synset pairs added to the cache.
+        """
+        return self._semscore.prepopulate_wup_cache(self.concepts)
+
     def get_dataset_info(self, dataset):
-        title = next(self.dataset_graph.objects(dataset, DCT.title), None)
-        description = next(
-            self.dataset_graph.objects(dataset, DCT.description),
-            None
-        )
-        href = next(
-            self.dataset_graph.objects(dataset, DCAT.landingPage),
-            dataset
-        )
-        return DatasetInfo(
-            str(title),
-            str(description),
-            str(dataset),
-            str(href)
-        )
+        try:
+            return DatasetInfo(*self._dataset_info[dataset])
+        except KeyError:
+            # Not a dcat:Dataset in the dataset graph, so it gets the same
+            # information as a dataset without title, description or landing
+            # page. The dataset graph is not loaded while serving requests.
+            return DatasetInfo(
+                str(None),
+                str(None),
+                str(dataset),
+                str(dataset)
+            )
 
     def search_query(
             self,
@@ -263,10 +641,18 @@ class OpenDataSemanticFramework:
             score_threshold=0.75,
             include_dataset_info=True,
             include_concepts=True,
+            top_k=None,
+            min_results=0,
+            timings=None,
     ):
         """
         Perform a search query.
 
+        Results are cached, so repeating a query with the same parameters is
+        cheap. See the constructor for how the cache is configured. When an
+        identical search is already running in another thread, this waits for
+        it and returns its result instead of searching again.
+
         Args:
             query: Search query to use.
             cds_name: Name of concept-dataset tagging to use when retrieving
@@ -283,46 +669,244 @@ class OpenDataSemanticFramework:
             include_concepts: Set to False to disable collection of concepts
                 related to the query and to each returned dataset. Should save
                 some time in situations where that information is not needed.
+            top_k: The maximum number of datasets to return. By default, all
+                datasets above score_threshold are returned.
+            min_results: The minimum number of datasets to return. When fewer
+                datasets are above score_threshold, the most similar datasets
+                below it are returned as well. top_k takes precedence.
+            timings: Optional StageTimings to fill with the duration of each
+                stage of the search, named by search_stages in otd.constants.
+                The durations are also added to stage_histograms.
 
         Returns:
             A tuple. The first item is a list of SearchResult that matched,
             sorted with the most similar results first. The second item is a
             list of the top five concepts that were matched with the query.
         """
+        cache_key = (
+            ' '.join(query.split()),
+            cds_name,
+            float(qc_sim_threshold),
+            float(score_threshold),
+            bool(include_dataset_info),
+            bool(include_concepts),
+            top_k,
+            min_results,
+            self._get_version(),
+        )
+        if timings is None:
+            timings = StageTimings()
+        cached = self._result_cache.get(cache_key)
+        if cached is not None:
+            log.info('Using cached result for query')
+            results, most_similar_concepts = cached
+            timings.cached = True
+        else:
+            def search():
+                result = self._search_query(
+                    query,
+                    cds_name,
+                    qc_sim_threshold,
+                    score_threshold,
+                    include_dataset_info,
+                    include_concepts,
+                    top_k,
+                    min_results,
+                    timings,
+                )
+                # Cache the result before it is shared, so that searches made
+                # after this one finishes find it in the cache
+                self._result_cache.put(cache_key, result)
+                self._observe_timings(timings)
+                return result
+
+            (results, most_similar_concepts), shared = self._searches.do(
+                cache_key,
+                search
+            )
+            if shared:
+                log.info('Using result of identical, concurrent query')
+                timings.shared = True
+        # Don't let the caller modify the cached lists
+        return list(results), list(most_similar_concepts)
+
+    def _get_version(self):
+        # Identifies the graphs and matrices currently in use
+        return (
+            self.ontology.uuid,
+            self.ontology.last_modified,
+            tuple(sorted(self.cds_df_id.items())),
+        )
+
+    def _search_query(
+            self,
+            query,
+            cds_name,
+            qc_sim_threshold,
+            score_threshold,
+            include_dataset_info,
+            include_concepts,
+            top_k,
+            min_results,
+            timings,
+    ):
         log.info('Binding query to concepts…')
         # Calculate the query's similarity to our concepts
         query_concept_sim = self.calculate_query_sim_to_concepts(
             query,
-            qc_sim_threshold
+            qc_sim_threshold,
+            timings
         )
 
-        log.info('Extracting most similar concepts…')
-        # What were the most similar concepts?
-        if include_concepts:
-            most_similar_concepts = self.sort_concept_similarities(
-                self.get_concept_similarities_for_query(
-                    query_concept_sim
+        log.info('Comparing datasets to the concepts extracted from the query…')
+        # How similar are the datasets' similarity to the query's similarity?
+        # Only consider the most relevant datasets
+        with timings.stage(STAGE_DATASET_SCORING):
+            dataset_query_sim = self.rank_datasets(
+                query_concept_sim,
+                cds_name,
+                score_threshold,
+                top_k,
+                min_results,
+            )
+
+        log.info('Putting together information for the result…')
+        with timings.stage(STAGE_RESULT_ASSEMBLY):
+            # What were the most similar concepts?
+            most_similar_concepts = self._get_most_similar_concepts_for_query(
+                query_concept_sim,
+                include_concepts
+            )
+
+            # Put together information for the search results page
+            results = self._create_search_results(
+                dataset_query_sim,
+                cds_name,
+                include_dataset_info,
+                include_concepts
+            )
+        log.info(f'Done with query processing! ({timings})')
+        return results, most_similar_concepts
+
+    def _observe_timings(self, timings):
+        for stage, seconds in timings.stages.items():
+            self.stage_histograms[stage].observe(seconds)
+
+    def search_queries(
+            self,
+            queries,
+            cds_name="all",
+            qc_sim_threshold=0.0,
+            score_threshold=0.75,
+            include_dataset_info=True,
+            include_concepts=True,
+            top_k=None,
+            min_results=0,
+    ):
+        """
+        Perform many search queries at once.
+
+        This gives the same results as calling search_query() for each query.
+        With the exact search index, the datasets are compared to all the
+        queries in one operation.
+
+        Args:
+            queries: List of search queries to use.
+            cds_name: Name of concept-dataset tagging to use when retrieving
+                datasets.
+            qc_sim_threshold: See search_query().
+            score_threshold: See search_query().
+            include_dataset_info: See search_query().
+            include_concepts: See search_query().
+            top_k: See search_query().
+            min_results: See search_query().
+
+        Returns:
+            List with one tuple for each query, in the same order as queries.
+            The tuples are the same as those returned by search_query().
+        """
+        queries = list(queries)
+
+        log.info(f'Binding {len(queries)} queries to concepts…')
+        query_concept_sims = [
+            self.calculate_query_sim_to_concepts(query, qc_sim_threshold)
+            for query in queries
+        ]
+
+        log.info('Comparing datasets to the concepts extracted from the '
+                 'queries…')
+        kernel = self.search_kernels[cds_name]
+        if self.search_indices[cds_name] is kernel:
+            query_vectors = np.array([
+                kernel.align_query(query_concept_sim, self.concepts)
+                for query_concept_sim in query_concept_sims
+            ]).reshape((len(queries), len(kernel.concepts)))
+            dataset_query_sims = [
+                self._rank_with_kernel(
+                    kernel,
+                    scores,
+                    score_threshold,
+                    top_k,
+                    min_results
                 )
-            )[:5]
+                for scores in kernel.score_many(query_vectors)
+            ]
         else:
-            most_similar_concepts = []
+            # Approximate indices look up one query at a time
+            dataset_query_sims = [
+                self.rank_datasets(
+                    query_concept_sim,
+                    cds_name,
+                    score_threshold,
+                    top_k,
+                    min_results
+                )
+                for query_concept_sim in query_concept_sims
+            ]
+
+        log.info('Putting together information for the results…')
+        all_results = []
+        for query_concept_sim, dataset_query_sim in zip(
+                query_concept_sims,
+                dataset_query_sims
+        ):
+            all_results.append((
+                self._create_search_results(
+                    dataset_query_sim,
+                    cds_name,
+                    include_dataset_info,
+                    include_concepts
+                ),
+                self._get_most_similar_concepts_for_query(
+                    query_concept_sim,
+                    include_concepts
+                ),
+            ))
+        log.info('Done with query processing!')
+        return all_results
 
-        log.info('Comparing datasets to the concepts extracted from the query…')
-        # How similar are the datasets' similarity to the query's similarity?
-        dataset_query_sim = self.calculate_dataset_query_sim(
+    def _get_most_similar_concepts_for_query(
+            self,
             query_concept_sim,
-            cds_name,
-            query,
-        )
+            include_concepts
+    ):
+        if not include_concepts:
+            return []
+        return self.sort_concept_similarities(
+            self.get_concept_similarities_for_query(
+                query_concept_sim
+            )
+        )[:5]
 
-        log.info('Putting together information for the result…')
-        # Put together information for the search results page
+    def _create_search_results(
+            self,
+            dataset_query_sim,
+            cds_name,
+            include_dataset_info,
+            include_concepts
+    ):
         results = list()
-        for dataset, similarity in dataset_query_sim.items():
-            # Only consider the most relevant datasets
-            # TODO: Return a minimum amount of datasets
-            if similarity < float(score_threshold):
-                continue
+        for dataset, similarity in dataset_query_sim:
             results.append(SearchResult(
                 score=similarity,
                 info=self.get_dataset_info(dataset)
@@ -332,13 +916,12 @@ class OpenDataSemanticFramework:
                     dataset
                 ) if include_concepts else [],
             ))
-        log.info('Done with query processing!')
-        return results, most_similar_concepts
+        return results
 
     def get_concept_similarities_for_query(self, query_concept_similarity):
         return self._create_concept_similarities(
-            query_concept_similarity.columns,
-            query_concept_similarity.values[0]
+            self.concepts,
+            query_concept_similarity
         )
 
     def _create_concept_similarities(self, concepts, similarity_scores):
@@ -350,8 +933,7 @@ class OpenDataSemanticFramework:
         )
 
         for concept, similarity in concept_similarities:
-            labels = self.navigator.pref_and_alt_labels(URIRef(concept))
-            label = labels[0]
+            label = self._get_concept_label(URIRef(concept))
 
             processed_similarities.append(ConceptSimilarity(
                 concept, label, similarity
@@ -359,45 +941,85 @@ class OpenDataSemanticFramework:
 
         return processed_similarities
 
-    def calculate_dataset_query_sim(self, query_concept_sim, cds_name, query):
-        # Add in the datasets' similarity to the concepts
-        entry_concept_sim = query_concept_sim.append(
-            self.cds[cds_name],
-            sort=True
+    def _get_concept_label(self, concept):
+        try:
+            return self._concept_labels[concept]
+        except KeyError:
+            # Not a skos:Concept in the ontology, so look it up
+            return self.navigator.pref_and_alt_labels(concept)[0]
+
+    def calculate_dataset_query_sim(self, query_concept_sim, cds_name):
+        # Compare the query to the datasets' (pre-normalized) concept vectors,
+        # sorting the most similar datasets first
+        return self.search_kernels[cds_name].similarities(
+            query_concept_sim,
+            self.concepts
         )
 
-        # Do the similarity calculation
-        sim_data = cosine_similarity(entry_concept_sim)
+    def rank_datasets(
+            self,
+            query_concept_sim,
+            cds_name,
+            score_threshold=0.75,
+            top_k=None,
+            min_results=0,
+    ):
+        """
+        Find the datasets most similar to the query.
+
+        Unlike calculate_dataset_query_sim(), only the datasets that are
+        returned are sorted.
+
+        Args:
+            query_concept_sim: The query's similarity to each concept, as
+                returned by calculate_query_sim_to_concepts().
+            cds_name: Name of concept-dataset tagging to use when retrieving
+                datasets.
+            score_threshold: Lower threshold for how similar a dataset must
+                be to the query to be included.
+            top_k: The maximum number of datasets to return, or None to return
+                all datasets above score_threshold.
+            min_results: The minimum number of datasets to return.
 
-        # Convert into format used by the rest of the application
-        entry_entry_sim = pd.DataFrame(
-            sim_data,
-            columns=entry_concept_sim.index,
-            index=entry_concept_sim.index
+        Returns:
+            List of (dataset, similarity) tuples, with the most similar dataset
+            first.
+        """
+        kernel = self.search_kernels[cds_name]
+        indices, scores = self.search_indices[cds_name].search(
+            kernel.align_query(query_concept_sim, self.concepts),
+            float(score_threshold),
+            top_k,
+            min_results,
         )
+        return [
+            (URIRef(kernel.datasets[i]), score)
+            for i, score in zip(indices, scores)
+        ]
 
-        # Extract the datasets' similarity to the query, sort most similar
-        # datasets first, then remove the query's similarity to itself
-        dataset_query_sim = entry_entry_sim \
-            .loc[query] \
-            .sort_values(ascending=False) \
-            .drop(query)
-        return dataset_query_sim
+    @staticmethod
+    def _rank_with_kernel(kernel, scores, score_threshold, top_k, min_results):
+        indices = kernel.rank(
+            scores,
+            float(score_threshold),
+            top_k,
+            min_results,
+        )
+        return [(URIRef(kernel.datasets[i]), scores[i]) for i in indices]
 
     def get_most_similar_concepts_for_dataset(self, cds_name, dataset):
-        concepts_for_dataset = self.get_concepts_for_dataset(
-            cds_name,
-            dataset
+        # The most similar concepts are found when the matrix is loaded
+        kernel = self.search_kernels[cds_name]
+        top_concepts = kernel.get_top_concepts(kernel.get_loc(dataset))
+        return self._create_concept_similarities(
+            [concept for concept, _ in top_concepts],
+            [similarity for _, similarity in top_concepts]
         )
-        closest_concepts_for_dataset = self.sort_concept_similarities(
-            concepts_for_dataset
-        )[:5]
-        return closest_concepts_for_dataset
 
     def get_concepts_for_dataset(self, cds_name, dataset):
-        location = self.cds[cds_name].loc[dataset]
+        location = self.cds[cds_name].get_row(dataset)
         return self._create_concept_similarities(
-            location.index,
+            [URIRef(concept) for concept in location.index],
             location.values
         )
 
@@ -432,6 +1054,9 @@ class ODSFLoader(Mapping):
             compute_matrices=False,
             concept_similarity=0.0,
             simtypes=None,
+            result_cache_size=256,
+            result_cache_ttl=None,
+            search_index=SEARCH_INDEX_EXACT,
     ):
         """
         Create new ODSF loader.
@@ -443,9 +1068,21 @@ class ODSFLoader(Mapping):
                 be to a dataset in order to be associated with it.
             simtypes: List of simtypes to load. Can also be just the name of one
                 simtype. By default, all available simtypes are loaded.
+            result_cache_size: The number of search results to cache for each
+                configuration. Use 0 to disable the cache.
+            result_cache_ttl: Number of seconds a search result is cached, or
+                None to keep it until it is evicted or the graphs change.
+            search_index: Name of the search index to use, one of
+                search_indexes in otd.constants. Can also be a dictionary
+                mapping Configuration UUIDs to the search index to use for
+                that configuration, with the exact index used for
+                configurations not in the dictionary.
         """
         self.compute_matrices = compute_matrices
         self._concept_similarity = concept_similarity
+        self._result_cache_size = result_cache_size
+        self._result_cache_ttl = result_cache_ttl
+        self._search_index = search_index
 
         self.__simtypes = None
         if simtypes is None:
@@ -455,6 +1092,20 @@ class ODSFLoader(Mapping):
         self.__instances = dict()
         self.__configurations = dict()
 
+        self.load_counts = collections.Counter()
+        """
+        Number of times an ODSF instance was created or had a dataset tagging
+        reloaded, for each Configuration UUID.
+        """
+
+        self.load_durations = collections.defaultdict(
+            lambda: Histogram(LOAD_DURATION_BUCKETS)
+        )
+        """
+        Histogram of how many seconds the loads counted in load_counts took,
+        for each Configuration UUID.
+        """
+
     @property
     def simtypes(self):
         return self.__simtypes
@@ -499,9 +1150,11 @@ class ODSFLoader(Mapping):
         if (not odsf_exists) or update_available:
             try:
                 configuration = self._get_config_for(k)
+                start = time.perf_counter()
                 self.__instances[k] = self._create_from_configuration(
                     configuration
                 )
+                self._count_load(k, time.perf_counter() - start)
                 self.__configurations[k] = configuration
             except (db.graph.NoSuchGraph, InvalidId):
                 raise KeyError(k)
@@ -520,10 +1173,13 @@ class ODSFLoader(Mapping):
             # Ensure the dataset tagging graphs are up-to-date
             configuration = self._get_config_for(k)
             try:
-                self._ensure_updated_dataset_taggings(
+                start = time.perf_counter()
+                reloaded = self._ensure_updated_dataset_taggings(
                     self.__instances[k],
                     configuration
                 )
+                if reloaded:
+                    self._count_load(k, time.perf_counter() - start)
             except MissingMatrixError:
                 # De-escalate to warning, since we have the existing dataset tag
                 log.warning(
@@ -537,6 +1193,35 @@ class ODSFLoader(Mapping):
 
         return self.__instances[k]
 
+    def _count_load(self, key, seconds):
+        self.load_counts[key] += 1
+        self.load_durations[key].observe(seconds)
+
+    def reset_counters(self):
+        """
+        Forget the loads counted so far, and reset the counters of the loaded
+        ODSF instances.
+
+        This is used in processes forked from the process that did the loads,
+        so that the loads are not counted again by every process.
+        """
+        self.load_counts.clear()
+        self.load_durations.clear()
+        for _, odsf in self.loaded():
+            odsf.reset_counters()
+
+    def loaded(self):
+        """
+        List the ODSF instances which have been loaded so far.
+
+        Unlike items(), this does not load any configurations, nor check for
+        updates.
+
+        Returns:
+            List of (Configuration UUID, ODSF instance) tuples.
+        """
+        return list(self.__instances.items())
+
     def __len__(self) -> int:
         return len(db.graph.Configuration.find_all_ids())
 
@@ -552,6 +1237,9 @@ class ODSFLoader(Mapping):
             c.dataset_uuid,
             self.compute_matrices,
             self._concept_similarity,
+            self._result_cache_size,
+            self._result_cache_ttl,
+            self._get_search_index_for(c.uuid),
         )
         if SIMTYPE_SIMILARITY in self.simtypes:
             odsf.load_similarity_graph(
@@ -565,6 +1253,36 @@ class ODSFLoader(Mapping):
             )
         return odsf
 
+    @staticmethod
+    def parse_search_index(setting):
+        """
+        Parse a textual search index setting, like the one in the SEARCH_INDEX
+        environment variable.
+
+        Args:
+            setting: Either the name of the search index to use for all
+                configurations, or a comma-separated list of UUID=name pairs
+                naming the search index to use for each configuration. None or
+                an empty string selects the exact index.
+
+        Returns:
+            Value which can be given as search_index to ODSFLoader.
+        """
+        if not setting:
+            return SEARCH_INDEX_EXACT
+        if '=' not in setting:
+            return setting.strip()
+        search_index = dict()
+        for pair in setting.split(','):
+            uuid, _, name = pair.partition('=')
+            search_index[uuid.strip()] = name.strip()
+        return search_index
+
+    def _get_search_index_for(self, uuid):
+        if isinstance(self._search_index, str):
+            return self._search_index
+        return self._search_index.get(str(uuid), SEARCH_INDEX_EXACT)
+
     def get_default(self) -> OpenDataSemanticFramework:
         """
         Get the ODSF using the configuration named in the CONFIGURATION_UUID
@@ -618,9 +1336,9 @@ class ODSFLoader(Mapping):
                 to find the relevant dataset taggings.
 
         Returns:
-            Nothing.
+            True if any dataset tagging was reloaded, False otherwise.
         """
-
+        reloaded = False
         for dataset_tagging, name in (
                 (configuration.get_similarity(), SIMTYPE_SIMILARITY),
                 (configuration.get_autotag(), SIMTYPE_AUTOTAG)
@@ -634,3 +1352,5 @@ class ODSFLoader(Mapping):
                     name,
                     dataset_tagging,
                 )
+                reloaded = True
+        return reloaded
@@ -0,0 +1,441 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse
+from rdflib import URIRef
+
+
+class SearchKernel:
+    """
+    Concept-dataset similarity matrix prepared for scoring queries.
+
+    The similarity between a query and a dataset is the cosine similarity
+    between their concept vectors. Since the cosine similarity is the dot
+    product of the two vectors after they have been normalized, we normalize
+    the datasets' vectors once when the kernel is created. Scoring a query
+    against all datasets is then a single sparse matrix-vector product, whose
+    cost is proportional to the number of non-zero values in the matrix.
+    """
+    BOUND_TOLERANCE = 1e-9
+    """
+    Slack used when comparing score bounds to the score threshold, so rounding
+    errors never cause a dataset above the threshold to be skipped.
+    """
+
+    def __init__(self, cds, num_top_concepts=5, arrays=None):
+        """
+        Create a new search kernel for the given concept-dataset matrix.
+
+        Args:
+            cds: Concept-dataset similarity matrix, as a SparseMatrix with
+                datasets as index and concepts as columns.
+            num_top_concepts: Number of concepts to find for each dataset in
+                top_concepts.
+            arrays: Dictionary returned by get_arrays() for a kernel made from
+                the same matrix. When given, the arrays are used as-is instead
+                of being computed from cds, so they may for example be memory
+                mapped.
+        """
+        self._alignment = None
+
+        self.datasets = cds.index
+        """
+        StringTable with the URIs of the datasets, in the same order as the
+        rows of the matrix. It is shared with cds.
+        """
+
+        self.concepts = cds.columns
+        """
+        StringTable with the URIs of the concepts, in the same order as the
+        columns of the matrix. It is shared with cds.
+        """
+
+        if arrays is not None:
+            self._init_from_arrays(cds, arrays)
+            return
+
+        self.matrix = self._normalize_rows(cds.matrix)
+        """
+        Sparse CSR matrix with one normalized concept vector for each dataset.
+        """
+
+        self.postings = self.matrix.tocsc()
+        """
+        Inverted index from concept to datasets, as a sparse CSC matrix. The
+        non-zero values in a column are the postings for that concept, listing
+        the datasets tagged with it along with their normalized similarity.
+        """
+
+        self.max_posting_weights = np.asarray(
+            self.postings.max(axis=0).todense()
+        ).ravel()
+        """The highest normalized similarity found for each concept."""
+
+        self.top_concepts, self.top_concept_scores = self._find_top_concepts(
+            cds.matrix,
+            num_top_concepts
+        )
+        """
+        The most similar concepts for each dataset, with one row per dataset.
+        top_concepts has the column positions of the concepts, while
+        top_concept_scores has their (unnormalized) similarity to the dataset.
+        The most similar concept comes first. Rows are padded with -1 and 0.0
+        when there are fewer concepts than requested.
+        """
+
+    def _init_from_arrays(self, cds, arrays):
+        self.matrix = scipy.sparse.csr_matrix(
+            (arrays['data'], arrays['indices'], arrays['indptr']),
+            shape=cds.shape,
+            copy=False,
+        )
+        self.postings = scipy.sparse.csc_matrix(
+            (
+                arrays['postings_data'],
+                arrays['postings_indices'],
+                arrays['postings_indptr'],
+            ),
+            shape=cds.shape,
+            copy=False,
+        )
+        self.max_posting_weights = arrays['max_posting_weights']
+        self.top_concepts = arrays['top_concepts']
+        self.top_concept_scores = arrays['top_concept_scores']
+
+    def get_arrays(self):
+        """
+        Collect the arrays that make up this kernel.
+
+        Returns:
+            Dictionary with the NumPy arrays of this kernel, which can be given
+            to the constructor to re-create it.
+        """
+        self.matrix.sort_indices()
+        self.postings.sort_indices()
+        return {
+            'data': self.matrix.data,
+            'indices': self.matrix.indices,
+            'indptr': self.matrix.indptr,
+            'postings_data': self.postings.data,
+            'postings_indices': self.postings.indices,
+            'postings_indptr': self.postings.indptr,
+            'max_posting_weights': self.max_posting_weights,
+            'top_concepts': self.top_concepts,
+            'top_concept_scores': self.top_concept_scores,
+        }
+
+    @staticmethod
+    def _normalize_rows(matrix):
+        matrix = matrix.astype(float)
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)))
+        norms = norms.ravel()
+        # Vectors of length zero stay zero, like they do in sklearn
+        norms[norms == 0.0] = 1.0
+        # Scale each row's non-zero values by the norm of that row
+        row_lengths = np.diff(matrix.indptr)
+        matrix.data /= np.repeat(norms, row_lengths)
+        return matrix
+
+    @staticmethod
+    def _find_top_concepts(matrix, n):
+        num_rows, num_columns = matrix.shape
+        top_concepts = np.full((num_rows, n), -1, dtype=int)
+        top_scores = np.zeros((num_rows, n))
+
+        # Sort the non-zero values by row, then by decreasing value. Ties are
+        # broken by column position, like a stable sort of the row would.
+        coo = matrix.tocoo()
+        order = np.lexsort((coo.col, -coo.data, coo.row))
+        rows = coo.row[order]
+        row_starts = np.searchsorted(rows, np.arange(num_rows))
+        positions = np.arange(len(rows)) - row_starts[rows]
+        kept = positions < n
+        top_concepts[rows[kept], positions[kept]] = coo.col[order][kept]
+        top_scores[rows[kept], positions[kept]] = coo.data[order][kept]
+
+        # Rows with too few non-zero values are filled up with the first
+        # concepts that have zero similarity
+        num_found = np.bincount(rows[kept], minlength=num_rows)
+        for row in np.flatnonzero(num_found < min(n, num_columns)):
+            found = set(top_concepts[row, :num_found[row]])
+            zero_columns = (c for c in range(num_columns) if c not in found)
+            for position in range(num_found[row], min(n, num_columns)):
+                top_concepts[row, position] = next(zero_columns)
+
+        return top_concepts, top_scores
+
+    @property
+    def nbytes(self):
+        """
+        Number of bytes used by the arrays of this kernel, not counting the
+        labels it shares with its matrix.
+        """
+        return sum(
+            array.nbytes
+            for array in (
+                self.matrix.data,
+                self.matrix.indices,
+                self.matrix.indptr,
+                self.postings.data,
+                self.postings.indices,
+                self.postings.indptr,
+                self.max_posting_weights,
+                self.top_concepts,
+                self.top_concept_scores,
+            )
+        )
+
+    def get_loc(self, dataset):
+        """
+        Find the position of the given dataset.
+
+        Args:
+            dataset: URI of the dataset to look up.
+
+        Returns:
+            Position of the dataset in the datasets attribute. The first
+            position is used if the dataset occurs multiple times.
+
+        Raises:
+            KeyError: If the dataset is not in the matrix.
+        """
+        return self.datasets.get_loc(dataset)
+
+    def get_top_concepts(self, position):
+        """
+        Retrieve the most similar concepts for the given dataset.
+
+        Args:
+            position: Position of the dataset in the datasets attribute.
+
+        Returns:
+            List of (concept, similarity) tuples, with the concept as URIRef
+            and the most similar concept first.
+        """
+        return [
+            (URIRef(self.concepts[concept]), score)
+            for concept, score in zip(
+                self.top_concepts[position],
+                self.top_concept_scores[position]
+            )
+            if concept != -1
+        ]
+
+    def align_query(self, query_concept_sim, concepts=None):
+        """
+        Create a query vector with the concepts in the same order as the matrix.
+
+        Args:
+            query_concept_sim: The query's similarity to each concept. Either
+                a Series using concepts as index, or a NumPy array aligned
+                with the concepts argument.
+            concepts: List of the concepts that query_concept_sim is aligned
+                with, when it is a NumPy array. The positions of our concepts
+                in the list are remembered, so pass the same list each time.
+
+        Returns:
+            NumPy array with the query's similarity to each concept, in the same
+            order as the columns of the matrix. Concepts not found in the query
+            are given a similarity of zero.
+        """
+        if concepts is None:
+            positions = self._find_positions(query_concept_sim.index)
+            query_concept_sim = query_concept_sim.values.astype(float)
+        else:
+            positions = self._get_positions(concepts)
+        found = positions != -1
+        aligned = np.zeros(len(positions))
+        aligned[found] = query_concept_sim[positions[found]]
+        return np.nan_to_num(aligned)
+
+    def _get_positions(self, concepts):
+        # Find the position of each of our concepts in the given list (-1 when
+        # missing). The positions are kept for the last list we were given,
+        # since the same list is used for every query.
+        alignment = self._alignment
+        if alignment is not None and alignment[0] is concepts:
+            return alignment[1]
+        positions = self._find_positions(concepts)
+        self._alignment = (concepts, positions)
+        return positions
+
+    def _find_positions(self, concepts):
+        ours = self.concepts.get_indexer(concepts)
+        found = ours != -1
+        positions = np.full(len(self.concepts), -1, dtype=int)
+        positions[ours[found]] = np.flatnonzero(found)
+        return positions
+
+    def score(self, query_vector):
+        """
+        Calculate the cosine similarity between the query and every dataset.
+
+        Args:
+            query_vector: The query's similarity to each concept, aligned with
+                the matrix using align_query().
+
+        Returns:
+            NumPy array with the query's similarity to each dataset, in the same
+            order as the datasets attribute.
+        """
+        norm = np.linalg.norm(query_vector)
+        if norm == 0.0:
+            # No concepts matched, so no dataset is similar to the query
+            return np.zeros(len(self.datasets))
+        return self.matrix.dot(query_vector / norm)
+
+    def search(
+            self,
+            query_vector,
+            score_threshold=0.0,
+            top_k=None,
+            min_results=0,
+    ):
+        """
+        Find the datasets to include in the result for the given query.
+
+        This gives the same result as using score() followed by rank(), but
+        uses the inverted index to only score datasets that share concepts
+        with the query, when possible. Concepts are visited in order of how
+        much they can contribute to a dataset's score. Once the remaining
+        concepts cannot bring a new dataset up to score_threshold, no more
+        datasets are considered.
+
+        Args:
+            query_vector: The query's similarity to each concept, aligned with
+                the matrix using align_query().
+            score_threshold: See rank().
+            top_k: See rank().
+            min_results: See rank().
+
+        Returns:
+            Tuple with two NumPy arrays. The first has the positions of the
+            datasets to include, most similar first. The second has their
+            similarity to the query.
+        """
+        norm = np.linalg.norm(query_vector)
+        if score_threshold > 0.0 and norm > 0.0:
+            normalized = query_vector / norm
+            candidates = self._find_candidates(normalized, score_threshold)
+            scores = self.matrix[candidates].dot(normalized)
+
+            # We can only use the candidates if they fill min_results,
+            # otherwise datasets we skipped may be among the most similar
+            if np.count_nonzero(scores >= score_threshold) >= min_results:
+                selected = self.rank(scores, score_threshold, top_k)
+                return candidates[selected], scores[selected]
+
+        # Zero-scoring datasets may be included, so score all of them
+        scores = self.score(query_vector)
+        selected = self.rank(scores, score_threshold, top_k, min_results)
+        return selected, scores[selected]
+
+    def _find_candidates(self, normalized_query, score_threshold):
+        concepts = np.flatnonzero(normalized_query)
+
+        # The most a concept can add to any dataset's score
+        bounds = normalized_query[concepts] * \
+            self.max_posting_weights[concepts]
+        order = np.argsort(-bounds, kind='stable')
+        concepts = concepts[order]
+
+        # A dataset not seen before concept i can score at most the sum of
+        # the bounds from concept i and onwards
+        remaining = np.cumsum(bounds[order][::-1])[::-1]
+        admitted = concepts[
+            remaining >= score_threshold - self.BOUND_TOLERANCE
+        ]
+
+        indptr = self.postings.indptr
+        postings = [
+            self.postings.indices[indptr[concept]:indptr[concept + 1]]
+            for concept in admitted
+        ]
+        if not postings:
+            return np.array([], dtype=int)
+        return np.unique(np.concatenate(postings))
+
+    def score_many(self, query_vectors):
+        """
+        Calculate the cosine similarity between many queries and every dataset.
+
+        Args:
+            query_vectors: Matrix with one row for each query, with the
+                query's similarity to each concept aligned using align_query().
+
+        Returns:
+            NumPy array with one row for each query, with the query's
+            similarity to each dataset in the same order as the datasets
+            attribute.
+        """
+        norms = np.linalg.norm(query_vectors, axis=1)
+        # Queries that matched no concepts stay zero
+        norms[norms == 0.0] = 1.0
+        normalized = query_vectors / norms[:, np.newaxis]
+        return np.asarray(self.matrix.dot(normalized.T)).T
+
+    def similarities(self, query_concept_sim, concepts=None):
+        """
+        Calculate the similarity between the query and every dataset.
+
+        Args:
+            query_concept_sim: The query's similarity to each concept, see
+                align_query().
+            concepts: See align_query().
+
+        Returns:
+            Series with the query's similarity to each dataset, using the
+            datasets' URIRefs as index. The most similar datasets are sorted
+            first.
+        """
+        scores = self.score(self.align_query(query_concept_sim, concepts))
+        return pd.Series(scores, index=[URIRef(d) for d in self.datasets]) \
+            .sort_values(ascending=False)
+
+    @staticmethod
+    def rank(scores, score_threshold=0.0, top_k=None, min_results=0):
+        """
+        Find the datasets to include in the result, most similar first.
+
+        Only the datasets that are included in the result are sorted. The rest
+        are skipped using partial selection, so we never sort the whole catalog.
+
+        Args:
+            scores: The query's similarity to each dataset, as returned by
+                score().
+            score_threshold: Lower threshold for how similar a dataset must be
+                to the query to be included.
+            top_k: The maximum number of datasets to include. Use None to
+                include all datasets above the threshold.
+            min_results: The minimum number of datasets to include. When fewer
+                datasets are above the threshold, the most similar datasets
+                below the threshold are included as well. top_k takes
+                precedence over this.
+
+        Returns:
+            NumPy array with the indices of the datasets to include, with the
+            most similar dataset first.
+        """
+        candidates = np.flatnonzero(scores >= score_threshold)
+
+        if len(candidates) < min_results:
+            candidates = SearchKernel._select_top(
+                np.arange(len(scores)),
+                scores,
+                min_results
+            )
+
+        if top_k is not None:
+            candidates = SearchKernel._select_top(candidates, scores, top_k)
+
+        order = np.argsort(-scores[candidates], kind='stable')
+        return candidates[order]
+
+    @staticmethod
+    def _select_top(candidates, scores, k):
+        if k >= len(candidates):
+            return candidates
+        if k <= 0:
+            return candidates[:0]
+        # Put the k most similar candidates first, in no particular order
+        selection = np.argpartition(-scores[candidates], k - 1)[:k]
+        return candidates[selection]
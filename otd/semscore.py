@@ -1,50 +1,282 @@
+import collections
 import itertools
-import statistics
-import pandas as pd
+import numpy as np
 from nltk.corpus import wordnet as wn
 
+from otd.constants import STAGE_QUERY_PARSING, STAGE_WORDNET_SCORING
+from otd.synsethierarchy import SynsetHierarchy
+from utils.cache import LRUCache
+from utils.timing import StageTimings
+
+
+WUP_CACHE_SIZE = 500000
+"""Maximum number of synset pairs to keep in wup_cache."""
+
+wup_cache = LRUCache(WUP_CACHE_SIZE)
+"""
+Wu-Palmer similarities of synset pairs, shared by all SemScore instances in
+this process. The keys are tuples with the names of the two synsets, in the
+order they were compared.
+"""
+
+_NOT_CACHED = object()
+
+
+def wup_similarity(synset1, synset2):
+    """
+    Find the Wu-Palmer similarity of two synsets, using wup_cache.
+
+    Args:
+        synset1: The synset to compare from, usually from the query.
+        synset2: The synset to compare to, usually from a concept label.
+
+    Returns:
+        The similarity as given by synset1.wup_similarity(synset2), which may
+        be None when the synsets cannot be compared.
+    """
+    # The similarity is not always symmetric, so the order is part of the key
+    key = (synset1.name(), synset2.name())
+    score = wup_cache.get(key, _NOT_CACHED)
+    if score is _NOT_CACHED:
+        score = synset1.wup_similarity(synset2)
+        wup_cache.put(key, score)
+    return score
+
 
 class SemScore:
-    def __init__(self, extractor, navigator):
+    def __init__(self, extractor, navigator, concepts):
         self.extractor = extractor
         self.navigator = navigator
+        self.concepts = concepts
         self._synsets_by_concept = dict()
+        self._label_table = None
 
-    def score_vector(self, query, sim_threshold):
-        concepts = list(self.navigator.concepts())
-        scoreDataFrame = pd.DataFrame(columns=concepts)
-        scoreDataFrame.loc[query] = [0]*len(concepts)
+    def score_vector(self, query, sim_threshold, timings=None):
+        """
+        Calculate how similar the query is to each concept.
 
-        query_synsets = self.synsets_from_query(query)
+        Args:
+            query: The search query.
+            sim_threshold: Lower threshold for a concept's similarity. Lower
+                similarities are set to 0.
+            timings: Optional StageTimings to record the duration of query
+                parsing and WordNet scoring in.
 
-        for concept in concepts:
-            labels = self.synset_sets_from_concept(concept)
+        Returns:
+            NumPy array of float32 with the query's similarity to each concept,
+            in the same order as the concepts given to the constructor.
+        """
+        if timings is None:
+            timings = StageTimings()
+
+        with timings.stage(STAGE_QUERY_PARSING):
+            query_words = tuple(self.extractor.search(query))
 
-            label_scores = [SemScore.calculate_score_for_label(l, query_synsets)
-                            for l in labels]
+        with timings.stage(STAGE_WORDNET_SCORING):
+            return self._score_words(query_words, sim_threshold)
 
-            concept_score = max(filter(None, label_scores), default=0.0)
-            if concept_score < sim_threshold:
-                concept_score = 0.0
+    def _score_words(self, query_words, sim_threshold):
+        table = self._get_label_table()
 
-            scoreDataFrame.loc[query][concept] = concept_score
+        query_synsets = tuple(itertools.chain.from_iterable(
+            self.synset_sets_from_words(query_words)
+        ))
 
-        return scoreDataFrame
+        # The best score of each label word is the highest similarity between
+        # any of its synsets and any of the query synsets, so the query
+        # synsets can be compared to each distinct label synset just once
+        synset_scores = np.zeros(len(table.synsets))
+        for query_synset in query_synsets:
+            np.maximum(
+                synset_scores,
+                self._score_synset(query_synset, table),
+                out=synset_scores
+            )
+
+        word_scores = _reduce_segments(
+            np.maximum,
+            synset_scores[table.word_synsets],
+            table.word_lengths
+        )
+
+        # Each label gets the harmonic mean of its words' non-zero scores
+        matched = word_scores > 0.0
+        inverses = np.zeros(len(word_scores))
+        inverses[matched] = 1.0 / word_scores[matched]
+        num_matched = _reduce_segments(
+            np.add,
+            matched.astype(float),
+            table.label_lengths
+        )
+        inverse_sums = _reduce_segments(np.add, inverses, table.label_lengths)
+        highest = _reduce_segments(
+            np.maximum,
+            word_scores,
+            table.label_lengths
+        )
+        label_scores = np.zeros(len(num_matched))
+        has_matches = num_matched > 0
+        label_scores[has_matches] = \
+            num_matched[has_matches] / inverse_sums[has_matches]
+        # The mean of one score is that score, without rounding errors
+        label_scores[num_matched == 1] = highest[num_matched == 1]
+
+        concept_scores = _reduce_segments(
+            np.maximum,
+            label_scores,
+            table.concept_lengths
+        )
+        concept_scores[concept_scores < sim_threshold] = 0.0
+        return concept_scores.astype(np.float32)
 
     @staticmethod
-    def calculate_score_for_label(label_words, query_synsets):
-        scores = [SemScore.calculate_score_for_label_word(w, query_synsets)
-                  for w in label_words]
-        try:
-            return statistics.harmonic_mean(filter(None, scores))
-        except statistics.StatisticsError:
-            return 0.0
+    def _score_synset(query_synset, table):
+        # Find the similarity between the query synset and each label synset,
+        # using 0 where NLTK gives None
+        scores = np.zeros(len(table.synsets))
+        hierarchy = table.hierarchy
+        if hierarchy.can_compare(query_synset):
+            scores[hierarchy.compiled_ids] = \
+                hierarchy.wup_similarities(query_synset)
+            partitions = table.uncompiled_partitions
+        else:
+            partitions = table.partitions
+
+        query_roots = frozenset(query_synset.root_hypernyms())
+        for (pos, roots), synset_ids in partitions.items():
+            # Without a simulated root, synsets from different hierarchies
+            # have no common hypernym and can never be similar
+            if query_roots.isdisjoint(roots) and not _simulates_root(
+                    query_synset,
+                    table.synsets[synset_ids[0]]
+            ):
+                continue
+            for i in synset_ids:
+                scores[i] = \
+                    wup_similarity(query_synset, table.synsets[i]) or 0.0
+        return scores
+
+    def _get_label_table(self):
+        if self._label_table is None:
+            self._label_table = _LabelTable(
+                [self.synset_sets_from_concept(c) for c in self.concepts]
+            )
+        return self._label_table
+
+    def prepare_labels(self):
+        """
+        Find the synsets of all concept labels and compile them, which is
+        otherwise done by the first query.
+        """
+        self._get_label_table()
+
+    def get_label_arrays(self):
+        """
+        Describe the synsets of the concept labels, so that they can be stored
+        and given to load_label_arrays() later.
+
+        Returns:
+            Tuple with a dictionary of NumPy arrays and a dictionary which can
+            be serialized to JSON, suitable for Ontology.save_label_synsets().
+        """
+        table = self._get_label_table()
+        arrays = {
+            'word_synsets': table.word_synsets,
+            'word_lengths': table.word_lengths,
+            'label_lengths': table.label_lengths,
+            'concept_lengths': table.concept_lengths,
+        }
+        labels = {
+            'concepts': [str(concept) for concept in self.concepts],
+            'synsets': [synset.name() for synset in table.synsets],
+        }
+        return arrays, labels
+
+    def load_label_arrays(self, arrays, labels):
+        """
+        Use the synsets of the concept labels described by get_label_arrays(),
+        instead of finding them by tagging the labels.
+
+        Args:
+            arrays: Dictionary of arrays returned by get_label_arrays().
+            labels: Dictionary returned along with the arrays.
+
+        Returns:
+            True if the synsets were loaded. False if they were made for a
+            different list of concepts, in which case nothing is changed.
+        """
+        if labels['concepts'] != [str(concept) for concept in self.concepts]:
+            return False
+
+        synsets = [wn.synset(name) for name in labels['synsets']]
+        synset_ids = iter(arrays['word_synsets'].tolist())
+        word_lengths = iter(arrays['word_lengths'].tolist())
+        label_lengths = iter(arrays['label_lengths'].tolist())
+        label_synsets_by_concept = []
+        for num_labels in arrays['concept_lengths'].tolist():
+            label_synsets = []
+            for _ in range(num_labels):
+                label_synsets.append([
+                    [synsets[next(synset_ids)] for _ in range(num_synsets)]
+                    for num_synsets in itertools.islice(
+                        word_lengths,
+                        next(label_lengths)
+                    )
+                ])
+            label_synsets_by_concept.append(label_synsets)
+
+        self._synsets_by_concept.update(
+            zip(self.concepts, label_synsets_by_concept)
+        )
+        self._label_table = _LabelTable(label_synsets_by_concept)
+        return True
 
     @staticmethod
-    def calculate_score_for_label_word(label_synsets, query_synsets):
-        synset_pairs = itertools.product(query_synsets, label_synsets)
-        scores = [q.wup_similarity(c) for q, c in synset_pairs]
-        return max(filter(None, scores), default=0.0)
+    def get_wordnet_version():
+        """
+        Find the version of WordNet in use, which decides the synsets found.
+
+        Returns:
+            The WordNet version, like '3.0'.
+        """
+        return wn.get_version()
+
+    def prepopulate_wup_cache(self, concepts):
+        """
+        Fill wup_cache with the similarities between the synsets found in the
+        labels of the given concepts, so that queries using the same words as
+        the labels are scored without asking WordNet.
+
+        Only pairs which cannot be compared using the compiled SynsetHierarchy
+        are added, since the others never use the cache. Pairs are added
+        until the cache is full, so that no entries are evicted. Pairs which
+        are cached already are skipped.
+
+        Args:
+            concepts: The concepts whose labels to use.
+
+        Returns:
+            Number of synset pairs added to the cache.
+        """
+        synsets = dict()
+        for concept in concepts:
+            for label in self.synset_sets_from_concept(concept):
+                for word_synsets in label:
+                    for synset in word_synsets:
+                        synsets.setdefault(synset.name(), synset)
+
+        added = 0
+        for synset1, synset2 in itertools.product(synsets.values(), repeat=2):
+            if len(wup_cache) >= wup_cache.maxsize:
+                break
+            if SynsetHierarchy.can_compare(synset1) and \
+                    SynsetHierarchy.can_compare(synset2):
+                continue
+            key = (synset1.name(), synset2.name())
+            if key not in wup_cache:
+                wup_cache.put(key, synset1.wup_similarity(synset2))
+                added += 1
+        return added
 
     def synsets_from_query(self, q):
         return self.synsets_from_str(q)
@@ -132,3 +364,78 @@ class SemScore:
         else:
             return None
 
+
+class _LabelTable:
+    # The synsets of all concept labels, flattened into arrays. Each concept
+    # has a number of labels, each label has a number of words, and each word
+    # has a number of synsets, all stored consecutively.
+    def __init__(self, label_synsets_by_concept):
+        synset_ids = dict()
+        word_synsets = []
+        word_lengths = []
+        label_lengths = []
+        concept_lengths = []
+        for labels in label_synsets_by_concept:
+            concept_lengths.append(len(labels))
+            for label in labels:
+                label_lengths.append(len(label))
+                for synsets in label:
+                    word_lengths.append(len(synsets))
+                    word_synsets.extend(
+                        synset_ids.setdefault(synset, len(synset_ids))
+                        for synset in synsets
+                    )
+
+        self.synsets = list(synset_ids)
+        self.word_synsets = np.array(word_synsets, dtype=int)
+        self.word_lengths = np.array(word_lengths, dtype=int)
+        self.label_lengths = np.array(label_lengths, dtype=int)
+        self.concept_lengths = np.array(concept_lengths, dtype=int)
+
+        self.hierarchy = SynsetHierarchy(self.synsets)
+        is_compiled = np.zeros(len(self.synsets), dtype=bool)
+        is_compiled[self.hierarchy.compiled_ids] = True
+
+        # Synsets compared by NLTK are grouped by their part of speech and
+        # root hypernyms, so that groups which cannot be similar to a query
+        # synset are skipped in one go. Whether a synset is compiled depends
+        # on its part of speech, so each group is either compiled or not.
+        partitions = collections.defaultdict(list)
+        for i, synset in enumerate(self.synsets):
+            roots = frozenset(synset.root_hypernyms())
+            partitions[(synset.pos(), roots)].append(i)
+        self.partitions = partitions
+        self.uncompiled_partitions = {
+            key: synset_ids
+            for key, synset_ids in partitions.items()
+            if not is_compiled[synset_ids[0]]
+        }
+
+
+_root_simulation = dict()
+
+
+def _simulates_root(synset1, synset2):
+    # Check if NLTK adds a fake root above the hierarchies when comparing
+    # synsets with these parts of speech, which only depends on the parts of
+    # speech (and the WordNet version). The synsets must have different root
+    # hypernyms: without a fake root they then have no common hypernym, and
+    # the similarity is None. With a fake root, it is never None.
+    key = (synset1.pos(), synset2.pos())
+    try:
+        return _root_simulation[key]
+    except KeyError:
+        simulates = wup_similarity(synset1, synset2) is not None
+        _root_simulation[key] = simulates
+        return simulates
+
+
+def _reduce_segments(ufunc, values, lengths):
+    # Reduce each run of consecutive values with the given lengths, using 0 for
+    # empty runs
+    result = np.zeros(len(lengths))
+    not_empty = lengths > 0
+    if not_empty.any():
+        starts = np.cumsum(lengths) - lengths
+        result[not_empty] = ufunc.reduceat(values, starts[not_empty])
+    return result
@@ -0,0 +1,219 @@
+import collections
+
+import numpy as np
+import scipy.sparse
+
+
+class SynsetHierarchy:
+    """
+    The WordNet hypernym hierarchy of a set of synsets, compiled into arrays.
+
+    Every synset is given an integer ID, and so is every hypernym found above
+    them. For each of these nodes, we store the distance to each of its
+    ancestors (itself included) in a sparse matrix, along with the minimum and
+    maximum depth of the node. This is all that is needed to find the
+    Wu-Palmer similarity the way NLTK does it, so one synset can be compared
+    to all the compiled synsets with a handful of array operations instead of
+    one call to Synset.wup_similarity per pair.
+
+    Only synsets which NLTK compares without simulating a root (nouns, for
+    WordNet 3.0) are compiled. Pairs involving other synsets must be compared
+    by NLTK.
+
+    How NLTK picks the least common subsumer and decides whether to simulate
+    a root is not part of its public API, which is why the NLTK version is
+    pinned in requirements.txt. The benchmark subcommand checks that the
+    similarities still match (see benchmark.run.check_wup_similarities).
+    """
+    def __init__(self, synsets):
+        """
+        Compile the hierarchy above the given synsets.
+
+        Args:
+            synsets: The synsets to compile the hierarchy for. The positions
+                of the synsets in this list are used to identify them.
+        """
+        self.synsets = list(synsets)
+        """The synsets given to the constructor, in the same order."""
+
+        self.compiled_ids = np.array(
+            [i for i, synset in enumerate(self.synsets)
+             if self.can_compare(synset)],
+            dtype=int
+        )
+        """
+        Positions of the synsets which are compiled, and can therefore be
+        compared using wup_similarities().
+        """
+
+        # Assign IDs to all nodes. The compiled synsets come first, in the
+        # same order as compiled_ids, while ancestors come after them.
+        nodes = [self.synsets[i] for i in self.compiled_ids]
+        self._node_ids = dict()
+        for node in nodes:
+            self._node_ids.setdefault(node, len(self._node_ids))
+        nodes = list(self._node_ids)
+        self._synset_node_ids = np.array(
+            [self._node_ids[self.synsets[i]] for i in self.compiled_ids],
+            dtype=int
+        )
+
+        rows = []
+        columns = []
+        distances = []
+        i = 0
+        while i < len(nodes):
+            for ancestor, distance in hypernym_distances(nodes[i]).items():
+                if ancestor not in self._node_ids:
+                    self._node_ids[ancestor] = len(nodes)
+                    nodes.append(ancestor)
+                rows.append(i)
+                columns.append(self._node_ids[ancestor])
+                distances.append(distance)
+            i += 1
+        num_nodes = len(nodes)
+
+        # One is added to the distances, so that a node's zero distance to
+        # itself is not mistaken for a missing entry
+        self.distances = scipy.sparse.csr_matrix(
+            (np.array(distances, dtype=int) + 1, (rows, columns)),
+            shape=(num_nodes, num_nodes)
+        )
+        """
+        Sparse matrix where distances[i, j] is one more than the length of
+        the shortest hypernym path from node i up to its ancestor j.
+        """
+
+        # Columns are picked from the rows of the compiled synsets on every
+        # comparison, which is faster in this format
+        self._synset_columns = \
+            self.distances[self._synset_node_ids].tocsc()
+
+        self.min_depths = np.array([n.min_depth() for n in nodes], dtype=int)
+        """Minimum depth of each node, like Synset.min_depth."""
+
+        self.max_depths = np.array([n.max_depth() for n in nodes], dtype=int)
+        """Maximum depth of each node, like Synset.max_depth."""
+
+        names = [node.name() for node in nodes]
+        self._name_ranks = np.empty(num_nodes, dtype=int)
+        self._name_ranks[sorted(range(num_nodes), key=names.__getitem__)] = \
+            np.arange(num_nodes)
+
+    @staticmethod
+    def can_compare(synset):
+        """
+        Check if the synset can be compared to the compiled synsets.
+
+        Args:
+            synset: The synset to check.
+
+        Returns:
+            True if NLTK compares synset to the compiled synsets without
+            simulating a root, so that wup_similarities() gives the same
+            result.
+        """
+        return not synset._needs_root()
+
+    def wup_similarities(self, synset):
+        """
+        Calculate the Wu-Palmer similarity between one synset and all the
+        compiled synsets at once.
+
+        This gives the same result as synset.wup_similarity(other) for each
+        of the compiled synsets, except that 0 is used where NLTK would give
+        None.
+
+        Args:
+            synset: The synset to compare with. can_compare() must be True
+                for it.
+
+        Returns:
+            NumPy array with the similarity to each of the synsets at
+            compiled_ids, in the same order.
+        """
+        num_nodes = self.distances.shape[0]
+        scores = np.zeros(len(self.compiled_ids))
+
+        # Only ancestors of the compiled synsets can be common ancestors
+        ancestors = [
+            (self._node_ids[ancestor], distance)
+            for ancestor, distance in hypernym_distances(synset).items()
+            if ancestor in self._node_ids
+        ]
+        if not ancestors:
+            return scores
+        ancestor_ids, ancestor_distances = map(np.array, zip(*ancestors))
+
+        # Like NLTK, the common ancestor with the greatest minimum depth is
+        # picked as the least common subsumer. Ties go to the synset itself,
+        # then to the ancestor whose name comes first.
+        synset_id = self._node_ids.get(synset, -1)
+        priorities = \
+            self.min_depths[ancestor_ids] * 2 * num_nodes + \
+            (ancestor_ids == synset_id) * num_nodes + \
+            num_nodes - 1 - self._name_ranks[ancestor_ids]
+        order = np.argsort(-priorities)
+        ancestor_ids = ancestor_ids[order]
+        ancestor_distances = ancestor_distances[order]
+
+        # The first entry in each row is the highest priority common ancestor
+        common = self._synset_columns[:, ancestor_ids].tocsr()
+        common.sort_indices()
+        has_common = np.diff(common.indptr) > 0
+        if not has_common.any():
+            return scores
+        others = self._synset_node_ids[has_common]
+        subsumers = ancestor_ids[common.indices[common.indptr[:-1][has_common]]]
+
+        # Shortest path from the synset to each subsumer, through any of
+        # their common ancestors
+        synset_distances = np.full(num_nodes, np.inf)
+        synset_distances[ancestor_ids] = ancestor_distances
+        subsumer_rows = self.distances[subsumers]
+        len1 = np.minimum.reduceat(
+            subsumer_rows.data - 1 + synset_distances[subsumer_rows.indices],
+            subsumer_rows.indptr[:-1]
+        )
+
+        # Shortest path from the other synsets to their subsumer
+        other_rows = self.distances[others]
+        in_both = other_rows.multiply(subsumer_rows)
+        in_both.data[:] = 1
+        path_lengths = (other_rows + subsumer_rows).multiply(in_both).tocsr()
+        path_lengths.sort_indices()
+        len2 = np.minimum.reduceat(
+            path_lengths.data,
+            path_lengths.indptr[:-1]
+        ) - 2
+
+        depths = self.max_depths[subsumers] + 1
+        scores[has_common] = (2.0 * depths) / (len1 + len2 + 2 * depths)
+        return scores
+
+
+def hypernym_distances(synset):
+    """
+    Find the length of the shortest hypernym path from a synset to each of
+    its ancestors.
+
+    Instance hypernyms are followed as well, like NLTK does when finding
+    common hypernyms.
+
+    Args:
+        synset: The synset to start from.
+
+    Returns:
+        Dictionary with the synset and its ancestors as keys, and their
+        distance from the synset as values.
+    """
+    distances = {synset: 0}
+    queue = collections.deque([synset])
+    while queue:
+        current = queue.popleft()
+        distance = distances[current] + 1
+        for hypernym in current.hypernyms() + current.instance_hypernyms():
+            if hypernym not in distances:
+                distances[hypernym] = distance
+                queue.append(hypernym)
+    return distances
@@ -0,0 +1,193 @@
+"""
+Module with a bounded, thread-safe cache, and a helper for sharing the result
+of concurrent, identical computations.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Cache which evicts the least recently used entry once it is full.
+
+    Entries can optionally expire after a given number of seconds. The cache
+    can be used from multiple threads at once, and keeps count of how many
+    look-ups found an entry (hits) and how many did not (misses).
+    """
+    def __init__(self, maxsize=128, ttl=None):
+        """
+        Create a new, empty cache.
+
+        Args:
+            maxsize: The maximum number of entries to keep. Use 0 to disable
+                the cache, so nothing is stored.
+            ttl: Number of seconds an entry is kept before it expires. Use None
+                to keep entries until they are evicted.
+        """
+        self.maxsize = maxsize
+        """The maximum number of entries to keep."""
+
+        self.ttl = ttl
+        """Number of seconds an entry is kept, or None to not expire entries."""
+
+        self.hits = 0
+        """Number of look-ups which found an entry."""
+
+        self.misses = 0
+        """Number of look-ups which did not find an entry."""
+
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Look up the entry with the given key.
+
+        Args:
+            key: The key to look up.
+            default: Value to return if no (unexpired) entry is found.
+
+        Returns:
+            The cached value, or default if not found.
+        """
+        with self.__lock:
+            try:
+                value, expires = self.__entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            if expires is not None and expires <= time.monotonic():
+                del self.__entries[key]
+                self.misses += 1
+                return default
+
+            self.__entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """
+        Store the value, evicting the least recently used entry if needed.
+
+        Args:
+            key: The key to store the value under.
+            value: The value to store.
+        """
+        if self.maxsize <= 0:
+            return
+
+        expires = None
+        if self.ttl is not None:
+            expires = time.monotonic() + self.ttl
+
+        with self.__lock:
+            self.__entries[key] = (value, expires)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.maxsize:
+                self.__entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Remove all entries from the cache. The hit and miss counts are kept.
+        """
+        with self.__lock:
+            self.__entries.clear()
+
+    def reset_counters(self):
+        """
+        Set the hit and miss counts to zero. The entries are kept.
+        """
+        with self.__lock:
+            self.hits = 0
+            self.misses = 0
+
+    def __contains__(self, key):
+        # Unlike get(), this neither counts as a look-up nor marks the entry
+        # as recently used
+        with self.__lock:
+            try:
+                value, expires = self.__entries[key]
+            except KeyError:
+                return False
+            return expires is None or expires > time.monotonic()
+
+    def __len__(self):
+        return len(self.__entries)
+
+
+class SingleFlight:
+    """
+    Coalescer of concurrent calls which compute the same thing.
+
+    When a call is made with a key while another call with the same key is
+    running, it waits for the running call to finish and shares its result
+    (or exception), instead of computing it again. Only concurrent calls are
+    coalesced, so this is usually combined with a cache like LRUCache.
+    """
+    def __init__(self):
+        """
+        Create a new coalescer, with no calls running.
+        """
+        self.shared = 0
+        """Number of calls which shared the result of another call."""
+
+        self.__calls = dict()
+        self.__lock = threading.Lock()
+
+    def reset_counters(self):
+        """
+        Set the count of shared calls to zero.
+        """
+        with self.__lock:
+            self.shared = 0
+
+    def do(self, key, func):
+        """
+        Call func, unless a call with the same key is already running.
+
+        Args:
+            key: Hashable key identifying what func computes.
+            func: Function which takes no arguments, computing the result.
+
+        Returns:
+            Tuple with the result of func, and whether it was shared from
+            another call instead of computed by this one.
+
+        Raises:
+            Any exception raised by func, including when raised in the call
+            whose result is shared.
+        """
+        with self.__lock:
+            call = self.__calls.get(key)
+            is_running = call is not None
+            if is_running:
+                self.shared += 1
+            else:
+                call = self.__calls[key] = _Call()
+
+        if is_running:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.__lock:
+                del self.__calls[key]
+            call.done.set()
+        return call.result, False
+
+
+class _Call:
+    # A running call of SingleFlight.do(), with its outcome once done
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
@@ -442,3 +442,15 @@ def float_between_0_and_1(s):
         )
 
     return value
+
+
+def non_negative_int(s):
+    try:
+        value = int(s)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'{s} is not an integer')
+
+    if value < 0:
+        raise argparse.ArgumentTypeError(f'{s} is negative')
+
+    return value
@@ -0,0 +1,348 @@
+"""
+Module for collecting metrics and exposing them in the Prometheus text format.
+
+Metrics are collected per process in a Metrics instance. When the application
+runs in multiple processes, like Gunicorn workers, each process writes its
+metrics to a file in a shared directory using MetricsDirectory, and the
+process that answers a scrape merges the files of all processes.
+"""
+import json
+import math
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from utils.timing import DEFAULT_BUCKETS, Histogram
+
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+
+class Metrics:
+    """
+    Counters, gauges and histograms of one process, identified by metric name
+    and labels.
+
+    All metrics with the same name form a family, which must have the same
+    type. Counters and histograms are summed when merged with the metrics of
+    other processes, so they should only count what happened in this process.
+    Gauges are summed as well, so give them a label that differs between
+    processes (like pid) when that is not wanted.
+    """
+    def __init__(self):
+        self._families = OrderedDict()
+        self._samples = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _describe(self, name, metric_type, help_text):
+        existing = self._families.setdefault(name, (metric_type, help_text))
+        if existing[0] != metric_type:
+            raise ValueError(
+                f'Metric {name} is a {existing[0]}, not a {metric_type}'
+            )
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((labels or dict()).items()))
+
+    def clear(self):
+        """
+        Remove all metrics.
+        """
+        with self._lock:
+            self._families.clear()
+            self._samples.clear()
+
+    def inc(self, name, help_text, labels=None, amount=1.0):
+        """
+        Increase a counter.
+
+        Args:
+            name: Name of the metric.
+            help_text: Description of the metric.
+            labels: Dictionary with the labels of the sample to increase.
+            amount: How much to increase the counter by.
+        """
+        with self._lock:
+            self._describe(name, COUNTER, help_text)
+            key = self._key(name, labels)
+            self._samples[key] = self._samples.get(key, 0.0) + amount
+
+    def set(self, name, metric_type, help_text, value, labels=None):
+        """
+        Set the value of a counter or gauge, or the state of a histogram.
+
+        This is used for values that are counted elsewhere, like the number
+        of cache hits.
+
+        Args:
+            name: Name of the metric.
+            metric_type: COUNTER, GAUGE or HISTOGRAM.
+            help_text: Description of the metric.
+            value: The number to use, or a Histogram for histograms.
+            labels: Dictionary with the labels of the sample to set.
+        """
+        with self._lock:
+            self._describe(name, metric_type, help_text)
+            self._samples[self._key(name, labels)] = value
+
+    def observe(self, name, help_text, value, labels=None,
+                buckets=DEFAULT_BUCKETS):
+        """
+        Count a value in a histogram.
+
+        Args:
+            name: Name of the metric.
+            help_text: Description of the metric.
+            value: The value to count, like a duration in seconds.
+            labels: Dictionary with the labels of the histogram.
+            buckets: Bucket bounds to use if the histogram is new.
+        """
+        with self._lock:
+            self._describe(name, HISTOGRAM, help_text)
+            key = self._key(name, labels)
+            histogram = self._samples.get(key)
+            if histogram is None:
+                histogram = self._samples[key] = Histogram(buckets)
+        histogram.observe(value)
+
+    def to_dict(self):
+        """
+        Describe the metrics using only dictionaries, lists, strings and
+        numbers.
+
+        Returns:
+            Dictionary which can be serialized to JSON and given to render()
+            or merge().
+        """
+        with self._lock:
+            families = OrderedDict(self._families)
+            samples = list(self._samples.items())
+
+        described_samples = []
+        for (name, labels), value in samples:
+            if isinstance(value, Histogram):
+                counts, total, _ = value.snapshot()
+                value = {
+                    'bounds': [_format_value(b) for b in value.bounds],
+                    'counts': counts,
+                    'sum': total,
+                }
+            described_samples.append([name, dict(labels), value])
+
+        return {
+            'families': {
+                name: {'type': metric_type, 'help': help_text}
+                for name, (metric_type, help_text) in families.items()
+            },
+            'samples': described_samples,
+        }
+
+
+def merge(snapshots):
+    """
+    Merge the metrics of multiple processes.
+
+    Samples with the same name and labels are summed. Histograms are summed
+    bucket by bucket, and must use the same bounds.
+
+    Args:
+        snapshots: Iterable of dictionaries returned by Metrics.to_dict().
+
+    Returns:
+        Dictionary with the same structure, with the merged metrics.
+    """
+    families = OrderedDict()
+    samples = OrderedDict()
+    for snapshot in snapshots:
+        families.update(snapshot['families'])
+        for name, labels, value in snapshot['samples']:
+            key = (name, tuple(sorted(labels.items())))
+            existing = samples.get(key)
+            if existing is None:
+                samples[key] = value
+            elif isinstance(value, dict):
+                samples[key] = {
+                    'bounds': existing['bounds'],
+                    'counts': [
+                        a + b
+                        for a, b in zip(existing['counts'], value['counts'])
+                    ],
+                    'sum': existing['sum'] + value['sum'],
+                }
+            else:
+                samples[key] = existing + value
+
+    return {
+        'families': families,
+        'samples': [
+            [name, dict(labels), value]
+            for (name, labels), value in samples.items()
+        ],
+    }
+
+
+def render(snapshot):
+    """
+    Render metrics in the Prometheus text exposition format.
+
+    Args:
+        snapshot: Dictionary returned by Metrics.to_dict() or merge().
+
+    Returns:
+        The metrics as text, ready to be served to Prometheus.
+    """
+    samples_by_name = OrderedDict()
+    for name, labels, value in snapshot['samples']:
+        samples_by_name.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for name, family in snapshot['families'].items():
+        if name not in samples_by_name:
+            continue
+        lines.append(f'# HELP {name} {_escape_help(family["help"])}')
+        lines.append(f'# TYPE {name} {family["type"]}')
+        for labels, value in samples_by_name[name]:
+            if family['type'] == HISTOGRAM:
+                for bound, count in zip(value['bounds'], value['counts']):
+                    bucket_labels = dict(labels, le=bound)
+                    lines.append(
+                        f'{name}_bucket{_format_labels(bucket_labels)} '
+                        f'{_format_value(count)}'
+                    )
+                lines.append(
+                    f'{name}_sum{_format_labels(labels)} '
+                    f'{_format_value(value["sum"])}'
+                )
+                lines.append(
+                    f'{name}_count{_format_labels(labels)} '
+                    f'{_format_value(value["counts"][-1])}'
+                )
+            else:
+                lines.append(
+                    f'{name}{_format_labels(labels)} {_format_value(value)}'
+                )
+    return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    formatted = ','.join(
+        f'{key}="{_escape_label(str(value))}"'
+        for key, value in sorted(labels.items())
+    )
+    return '{' + formatted + '}'
+
+
+def _escape_label(value):
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _escape_help(value):
+    return value.replace('\\', r'\\').replace('\n', r'\n')
+
+
+def _format_value(value):
+    if isinstance(value, str):
+        return value
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if math.isnan(value):
+        return 'NaN'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class MetricsDirectory:
+    """
+    Directory shared by the processes of an application, where each process
+    stores its metrics in a file named after its process ID.
+
+    Counters and histograms of processes that have exited are kept, so that
+    totals never decrease when a worker is replaced. Gauges of processes that
+    have exited are left out, since they describe state that no longer exists.
+    """
+    def __init__(self, directory):
+        """
+        Use the given directory for sharing metrics.
+
+        Args:
+            directory: Path to the directory. It is created if missing.
+        """
+        self.directory = directory
+        """Path to the directory where metrics are stored."""
+
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, metrics: Metrics, pid=None):
+        """
+        Store the metrics of a process, replacing those stored before.
+
+        Args:
+            metrics: The metrics to store.
+            pid: ID of the process the metrics belong to. Defaults to the
+                current process.
+        """
+        pid = os.getpid() if pid is None else pid
+        path = os.path.join(self.directory, f'{pid}.json')
+        fd, temporary = tempfile.mkstemp(
+            prefix=f'.{pid}-',
+            dir=self.directory
+        )
+        try:
+            with os.fdopen(fd, 'w') as fp:
+                json.dump(metrics.to_dict(), fp)
+            os.replace(temporary, path)
+        except OSError:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+
+    def read(self):
+        """
+        Merge the metrics of all processes.
+
+        Returns:
+            Dictionary with the merged metrics, as returned by merge().
+        """
+        snapshots = []
+        for filename in os.listdir(self.directory):
+            name, extension = os.path.splitext(filename)
+            if extension != '.json' or not name.isdigit():
+                continue
+            try:
+                with open(os.path.join(self.directory, filename)) as fp:
+                    snapshot = json.load(fp)
+            except (OSError, ValueError):
+                # Removed or replaced while we were reading it
+                continue
+
+            if not _is_running(int(name)):
+                gauges = {
+                    family_name
+                    for family_name, family in snapshot['families'].items()
+                    if family['type'] == GAUGE
+                }
+                snapshot['samples'] = [
+                    sample
+                    for sample in snapshot['samples']
+                    if sample[0] not in gauges
+                ]
+            snapshots.append(snapshot)
+        return merge(snapshots)
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # The process exists, but belongs to someone else
+        return True
+    return True
@@ -0,0 +1,267 @@
+"""
+Module with a sparse matrix that has labelled rows and columns.
+"""
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+from utils.stringtable import StringTable
+
+
+class SparseMatrix:
+    """
+    Sparse matrix in CSR format, whose rows and columns have labels.
+
+    This is used for the concept-dataset similarity matrices, where each
+    dataset is tagged with only a handful of concepts. Like with a DataFrame,
+    the labels of the rows are found in index, while the labels of the columns
+    are found in columns. The labels are kept as strings in StringTables, so
+    that a matrix with millions of rows takes up a few arrays instead of one
+    object per label. Missing values are not supported, they are treated as
+    zero.
+    """
+    def __init__(self, matrix, index, columns):
+        """
+        Create a new sparse matrix with labelled rows and columns.
+
+        Args:
+            matrix: The matrix itself. Will be converted to CSR format if it
+                is not already in that format.
+            index: Labels of the matrix' rows, as a StringTable or an
+                iterable of strings.
+            columns: Labels of the matrix' columns, as a StringTable or an
+                iterable of strings.
+        """
+        self.matrix = scipy.sparse.csr_matrix(matrix)
+        """The matrix itself, in CSR format."""
+
+        self.index = _to_string_table(index)
+        """Labels of the matrix' rows, as a StringTable."""
+
+        self.columns = _to_string_table(columns)
+        """Labels of the matrix' columns, as a StringTable."""
+
+        if self.matrix.shape != (len(self.index), len(self.columns)):
+            raise ValueError(
+                f'Shape of matrix {self.matrix.shape} does not match the '
+                f'number of labels ({len(self.index)}, {len(self.columns)})'
+            )
+
+    @classmethod
+    def from_dataframe(cls, df):
+        """
+        Create a new sparse matrix with the contents of the given DataFrame.
+
+        Args:
+            df: The DataFrame to convert. Missing values are treated as zero.
+
+        Returns:
+            New SparseMatrix with the same contents and labels as df.
+        """
+        values = np.nan_to_num(df.values.astype(float))
+        return cls(values, df.index, df.columns)
+
+    def to_dataframe(self):
+        """
+        Create a dense DataFrame with the contents of this matrix.
+
+        Returns:
+            New DataFrame with the same contents and labels as this matrix,
+            with the labels as strings.
+        """
+        return pd.DataFrame(
+            self.matrix.toarray(),
+            index=list(self.index),
+            columns=list(self.columns),
+        )
+
+    @classmethod
+    def from_dict(cls, d):
+        """
+        Create a new sparse matrix from the output of to_dict().
+
+        Args:
+            d: Dictionary returned by to_dict(), potentially after having been
+                serialized to and parsed from JSON.
+
+        Returns:
+            New SparseMatrix with the contents described by d.
+        """
+        return cls.from_arrays(
+            d['data'],
+            d['indices'],
+            d['indptr'],
+            d['index'],
+            d['columns'],
+        )
+
+    @classmethod
+    def from_arrays(cls, data, indices, indptr, index, columns):
+        """
+        Create a new sparse matrix from the arrays that make up a CSR matrix.
+
+        NumPy arrays are used as-is without being copied, so they may for
+        example be memory mapped.
+
+        Args:
+            data: The non-zero values, row by row.
+            indices: Column position of each value in data.
+            indptr: Position in data where each row starts, followed by the
+                length of data.
+            index: Labels of the matrix' rows, see the constructor.
+            columns: Labels of the matrix' columns, see the constructor.
+
+        Returns:
+            New SparseMatrix with the given contents.
+        """
+        matrix = scipy.sparse.csr_matrix(
+            (data, indices, indptr),
+            shape=(len(index), len(columns)),
+            copy=False,
+        )
+        return cls(matrix, index, columns)
+
+    def to_dict(self):
+        """
+        Describe this matrix using only lists, strings and numbers.
+
+        Returns:
+            Dictionary which can be serialized to JSON and given to
+            from_dict().
+        """
+        return {
+            'data': self.matrix.data.tolist(),
+            'indices': self.matrix.indices.tolist(),
+            'indptr': self.matrix.indptr.tolist(),
+            'index': list(self.index),
+            'columns': list(self.columns),
+        }
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def nbytes(self):
+        """Number of bytes used by the arrays of the matrix and its labels."""
+        return self.matrix.data.nbytes + self.matrix.indices.nbytes + \
+            self.matrix.indptr.nbytes + self.index.nbytes + \
+            self.columns.nbytes
+
+    def get_loc(self, label):
+        """
+        Find the position of the row with the given label.
+
+        Args:
+            label: Label of the row to look up.
+
+        Returns:
+            The position of the row. If multiple rows have this label, the
+            position of the first one is returned.
+
+        Raises:
+            KeyError: If no row has this label.
+        """
+        return self.index.get_loc(label)
+
+    def get_row(self, label):
+        """
+        Retrieve the row with the given label.
+
+        Args:
+            label: Label of the row to retrieve.
+
+        Returns:
+            Series with the row's values, using the column labels (as strings)
+            as index.
+
+        Raises:
+            KeyError: If no row has this label.
+        """
+        row = self.matrix[self.get_loc(label)]
+        return pd.Series(row.toarray()[0], index=list(self.columns))
+
+    def reindex(self, index=None, columns=None):
+        """
+        Create a copy of this matrix, with rows and columns moved to match the
+        given labels.
+
+        Args:
+            index: The labels of the rows of the new matrix. Rows which are not
+                in this matrix are filled with zeros, while rows of this matrix
+                which are not in the list are left out. Use None to keep the
+                rows as they are.
+            columns: Same as index, except for the columns.
+
+        Returns:
+            New SparseMatrix with the given rows and columns, or this matrix if
+            they are unchanged.
+        """
+        index = self.index if index is None else _to_string_table(index)
+        columns = self.columns if columns is None \
+            else _to_string_table(columns)
+        if index.equals(self.index) and columns.equals(self.columns):
+            return self
+
+        # Find the new position of each of our rows and columns, -1 if left out
+        coo = self.matrix.tocoo()
+        new_rows = index.get_indexer(self.index)[coo.row]
+        new_cols = columns.get_indexer(self.columns)[coo.col]
+        kept = (new_rows >= 0) & (new_cols >= 0)
+        matrix = scipy.sparse.csr_matrix(
+            (coo.data[kept], (new_rows[kept], new_cols[kept])),
+            shape=(len(index), len(columns)),
+        )
+        return SparseMatrix(matrix, index, columns)
+
+    @classmethod
+    def merge_max(cls, matrices):
+        """
+        Merge matrices, using the highest value found for each row and column.
+
+        The rows of the result are those of the first matrix, followed by any
+        new rows from the following matrices. The columns are the sorted union
+        of all the matrices' columns, unless they are all the same. The first
+        matrix is only rearranged when the other matrices have new rows or
+        columns.
+
+        Args:
+            matrices: Non-empty list of SparseMatrix to merge. Each matrix must
+                have unique row labels.
+
+        Returns:
+            New SparseMatrix with the rows and columns of all the matrices.
+        """
+        first, *others = matrices
+
+        index = first.index
+        columns = first.columns
+        for other in others:
+            is_new = index.get_indexer(other.index) == -1
+            if is_new.any():
+                index = StringTable.concatenate(
+                    [index, other.index.take(np.flatnonzero(is_new))]
+                )
+            if not columns.equals(other.columns):
+                columns = StringTable(
+                    sorted(set(columns) | set(other.columns))
+                )
+
+        merged = first.reindex(index, columns)
+        for other in others:
+            aligned = other.reindex(index, columns)
+            merged = SparseMatrix(
+                merged.matrix.maximum(aligned.matrix),
+                index,
+                columns,
+            )
+        return merged
+
+
+def _to_string_table(labels):
+    if isinstance(labels, StringTable):
+        return labels
+    return StringTable(labels)
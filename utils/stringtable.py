@@ -0,0 +1,286 @@
+"""
+Module with an immutable sequence of strings, stored in a few NumPy arrays.
+"""
+import hashlib
+
+import numpy as np
+
+
+def hash_string(string):
+    """
+    Hash a string to a 64-bit integer.
+
+    Unlike hash(), the result is the same in every process.
+
+    Args:
+        string: The string to hash.
+
+    Returns:
+        The hash of the string, as an integer which fits in an uint64.
+    """
+    return _hash_bytes(string.encode('utf-8'))
+
+
+def _hash_bytes(encoded):
+    digest = hashlib.blake2b(encoded, digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+class StringTable:
+    """
+    Immutable sequence of strings which supports fast look-up of positions.
+
+    The strings are encoded into one buffer, with the position where each
+    string starts kept in a separate array. Look-ups use a sorted array of
+    string hashes. Millions of strings therefore take up only a handful of
+    objects, instead of one string object and dictionary entry each. Since the
+    garbage collector and reference counting never write to the arrays, they
+    stay shared between processes forked after the table is created.
+    """
+    _COMPARE_CHUNK_SIZE = 65536
+
+    def __init__(self, strings):
+        """
+        Create a new table with the given strings.
+
+        Args:
+            strings: Iterable of the strings to store, in order.
+        """
+        encoded = [str(string).encode('utf-8') for string in strings]
+
+        lengths = np.array([len(e) for e in encoded], dtype=np.int64)
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        hashes = np.array(
+            [_hash_bytes(e) for e in encoded],
+            dtype=np.uint64
+        )
+        self._set_arrays(
+            offsets,
+            np.frombuffer(b''.join(encoded), dtype=np.uint8),
+            hashes
+        )
+
+    def _set_arrays(self, offsets, buffer, hashes):
+        self._offsets = offsets
+        self._buffer = buffer
+        # Stable sort, so duplicates are found in order of position
+        self._order = np.argsort(hashes, kind='stable')
+        self._sorted_hashes = hashes[self._order]
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        Re-create a table from the output of get_arrays().
+
+        The arrays are used as-is without being copied, so they may for
+        example be memory mapped.
+
+        Args:
+            arrays: Dictionary returned by get_arrays().
+
+        Returns:
+            New StringTable with the same strings as the original table.
+        """
+        table = cls.__new__(cls)
+        table._offsets = arrays['offsets']
+        table._buffer = arrays['buffer']
+        table._order = arrays['order']
+        table._sorted_hashes = arrays['sorted_hashes']
+        return table
+
+    def get_arrays(self):
+        """
+        Collect the arrays that make up this table.
+
+        Returns:
+            Dictionary with the NumPy arrays of this table, which can be given
+            to from_arrays() to re-create it.
+        """
+        return {
+            'offsets': self._offsets,
+            'buffer': self._buffer,
+            'order': self._order,
+            'sorted_hashes': self._sorted_hashes,
+        }
+
+    def _get_hashes(self):
+        # The hash of each string, in order of position
+        hashes = np.empty(len(self), dtype=np.uint64)
+        hashes[self._order] = self._sorted_hashes
+        return hashes
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    @property
+    def nbytes(self):
+        """Number of bytes used by the arrays of this table."""
+        return self._offsets.nbytes + self._buffer.nbytes + \
+            self._order.nbytes + self._sorted_hashes.nbytes
+
+    def __getitem__(self, position):
+        if not -len(self) <= position < len(self):
+            raise IndexError(position)
+        position %= len(self)
+        start, end = self._offsets[position], self._offsets[position + 1]
+        return self._buffer[start:end].tobytes().decode('utf-8')
+
+    def __iter__(self):
+        return (self[position] for position in range(len(self)))
+
+    def __contains__(self, string):
+        try:
+            self.get_loc(string)
+        except KeyError:
+            return False
+        return True
+
+    def get_loc(self, string):
+        """
+        Find the position of the given string.
+
+        Args:
+            string: The string to look up.
+
+        Returns:
+            The position of the string. If the string is found in multiple
+            positions, the first one is returned.
+
+        Raises:
+            KeyError: If the string is not in the table.
+        """
+        string = str(string)
+        string_hash = np.uint64(hash_string(string))
+        start = np.searchsorted(self._sorted_hashes, string_hash, 'left')
+        end = np.searchsorted(self._sorted_hashes, string_hash, 'right')
+        for position in self._order[start:end]:
+            if self[position] == string:
+                return int(position)
+        raise KeyError(string)
+
+    def equals(self, other):
+        """
+        Check if this table has the same strings as another, in the same order.
+
+        Args:
+            other: The StringTable to compare with.
+
+        Returns:
+            True if both tables have the same strings in the same order.
+        """
+        return self is other or (
+            np.array_equal(self._offsets, other._offsets) and
+            np.array_equal(self._buffer, other._buffer)
+        )
+
+    def get_indexer(self, strings):
+        """
+        Find the position of many strings at once.
+
+        Args:
+            strings: StringTable with the strings to look up. Other iterables
+                of strings are converted to a StringTable first.
+
+        Returns:
+            NumPy array with the position of each string, like get_loc()
+            would give, or -1 for strings which are not in this table.
+        """
+        if not isinstance(strings, StringTable):
+            strings = StringTable(strings)
+        hashes = strings._get_hashes()
+        starts = np.searchsorted(self._sorted_hashes, hashes, 'left')
+        found = starts < len(self._sorted_hashes)
+        found[found] = self._sorted_hashes[starts[found]] == hashes[found]
+        positions = np.full(len(strings), -1, dtype=np.int64)
+        positions[found] = self._order[starts[found]]
+
+        # Strings whose hash is found, but which differ from the first string
+        # with that hash, are looked up one at a time. With 64-bit hashes,
+        # this is practically never needed.
+        matched = np.flatnonzero(found)
+        different = ~self._strings_equal(
+            positions[matched],
+            strings,
+            matched
+        )
+        for i in matched[different]:
+            try:
+                positions[i] = self.get_loc(strings[i])
+            except KeyError:
+                positions[i] = -1
+        return positions
+
+    def _strings_equal(self, positions, other, other_positions):
+        # Compare the strings at positions with those at other_positions in
+        # the other table, pair by pair, in chunks to limit memory use
+        starts = self._offsets[positions]
+        lengths = self._offsets[positions + 1] - starts
+        other_starts = other._offsets[other_positions]
+        equal = lengths == \
+            other._offsets[other_positions + 1] - other_starts
+        compared = np.flatnonzero(equal & (lengths > 0))
+        for first in range(0, len(compared), self._COMPARE_CHUNK_SIZE):
+            pairs = compared[first:first + self._COMPARE_CHUNK_SIZE]
+            pair_lengths = lengths[pairs]
+            pair_starts = np.cumsum(pair_lengths) - pair_lengths
+            within = np.arange(pair_lengths.sum()) - \
+                np.repeat(pair_starts, pair_lengths)
+            differs = self._buffer[
+                np.repeat(starts[pairs], pair_lengths) + within
+            ] != other._buffer[
+                np.repeat(other_starts[pairs], pair_lengths) + within
+            ]
+            equal[pairs[np.logical_or.reduceat(differs, pair_starts)]] = False
+        return equal
+
+    def take(self, positions):
+        """
+        Create a new table with the strings at the given positions.
+
+        Args:
+            positions: NumPy array with the positions of the strings to
+                include, in order.
+
+        Returns:
+            New StringTable with the selected strings.
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        starts = self._offsets[positions]
+        lengths = self._offsets[positions + 1] - starts
+        offsets = np.zeros(len(positions) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        within = np.arange(offsets[-1]) - np.repeat(offsets[:-1], lengths)
+        table = StringTable.__new__(StringTable)
+        table._set_arrays(
+            offsets,
+            self._buffer[np.repeat(starts, lengths) + within],
+            self._get_hashes()[positions]
+        )
+        return table
+
+    @classmethod
+    def concatenate(cls, tables):
+        """
+        Create a new table with the strings of the given tables, in order.
+
+        Args:
+            tables: Non-empty list of StringTable to concatenate.
+
+        Returns:
+            New StringTable with the strings of all the tables.
+        """
+        buffer_starts = np.cumsum([0] + [len(t._buffer) for t in tables[:-1]])
+        offsets = np.concatenate(
+            [np.zeros(1, dtype=np.int64)] + [
+                t._offsets[1:] + start
+                for t, start in zip(tables, buffer_starts)
+            ]
+        )
+        table = cls.__new__(cls)
+        table._set_arrays(
+            offsets,
+            np.concatenate([t._buffer for t in tables]),
+            np.concatenate([t._get_hashes() for t in tables])
+        )
+        return table
@@ -0,0 +1,180 @@
+"""
+Module for measuring how long the stages of an operation take.
+"""
+import bisect
+import math
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+    5.0, 10.0,
+)
+"""Upper bounds (in seconds) of the buckets used by Histogram by default."""
+
+
+class StageTimings:
+    """
+    Durations of the stages of one operation, like a search query.
+
+    Use stage() as a context manager around each stage. Stages are kept in the
+    order they were first entered, and entering a stage again adds to its
+    duration.
+    """
+    def __init__(self):
+        self.stages = OrderedDict()
+        """Mapping from stage name to its duration in seconds."""
+
+        self.cached = False
+        """Whether the result was taken from a cache instead of computed."""
+
+        self.shared = False
+        """
+        Whether the result was shared by an identical operation which ran at
+        the same time, instead of computed.
+        """
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Measure the time spent inside the with-block as part of a stage.
+
+        Args:
+            name: Name of the stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stages[name] = self.stages.get(name, 0.0) + elapsed
+
+    @property
+    def total(self):
+        """The sum of the durations of all stages, in seconds."""
+        return sum(self.stages.values())
+
+    def to_dict(self):
+        """
+        Describe the timings using only dictionaries, strings and numbers.
+
+        Returns:
+            Dictionary which can be serialized to JSON, with the duration of
+            each stage and the total in seconds.
+        """
+        return {
+            'cached': self.cached,
+            'shared': self.shared,
+            'total': self.total,
+            'stages': dict(self.stages),
+        }
+
+    def __str__(self):
+        return ', '.join(
+            f'{name} {seconds * 1000.0:.1f} ms'
+            for name, seconds in self.stages.items()
+        )
+
+
+class Histogram:
+    """
+    Distribution of observed values, counted in buckets with fixed bounds.
+
+    The buckets follow the Prometheus convention, where each bucket counts the
+    values less than or equal to its upper bound, and a last bucket with an
+    infinite bound counts everything. The histogram can be used from multiple
+    threads at once.
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        Create a new, empty histogram.
+
+        Args:
+            buckets: Upper bounds of the buckets. A bucket for infinity is
+                added automatically.
+        """
+        self.bounds = tuple(sorted(buckets)) + (math.inf,)
+        """Upper bound of each bucket, the last one being infinity."""
+
+        self._counts = [0] * len(self.bounds)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """
+        Count a value.
+
+        Args:
+            value: The value to count, like a duration in seconds.
+        """
+        bucket = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self._counts[bucket] += 1
+            self._sum += value
+
+    def snapshot(self):
+        """
+        Read the state of the histogram.
+
+        Returns:
+            Tuple with the cumulative count for each bucket (in the same order
+            as bounds), the sum of all values and the number of values.
+        """
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative = []
+        running = 0
+        for count in counts:
+            running += count
+            cumulative.append(running)
+        return cumulative, total, running
+
+    @property
+    def count(self):
+        """Number of values observed."""
+        return self.snapshot()[2]
+
+    def reset(self):
+        """
+        Forget all observed values.
+        """
+        with self._lock:
+            self._counts = [0] * len(self.bounds)
+            self._sum = 0.0
+
+    def quantile(self, q):
+        """
+        Estimate a quantile of the observed values.
+
+        Like Prometheus' histogram_quantile(), this assumes the values are
+        spread evenly within each bucket.
+
+        Args:
+            q: The quantile to estimate, between 0.0 and 1.0. Use 0.99 for the
+                99th percentile.
+
+        Returns:
+            Estimate of the quantile, or NaN if nothing has been observed. If
+            the quantile falls in the last bucket, the highest finite bound is
+            returned.
+        """
+        cumulative, _, count = self.snapshot()
+        if count == 0:
+            return math.nan
+
+        rank = q * count
+        bucket = bisect.bisect_left(cumulative, rank)
+        if bucket == len(self.bounds) - 1:
+            return self.bounds[-2]
+
+        lower_bound = self.bounds[bucket - 1] if bucket > 0 else 0.0
+        lower_count = cumulative[bucket - 1] if bucket > 0 else 0
+        in_bucket = cumulative[bucket] - lower_count
+        if in_bucket == 0:
+            return lower_bound
+        return lower_bound + (self.bounds[bucket] - lower_bound) * \
+            (rank - lower_count) / in_bucket